@@ -0,0 +1,80 @@
+## CENTER-STAR BENCHMARK
+# Description: Per-accession cost of the built-in center-star aligner against MAFFT on real replicate sets
+#
+# Notes:
+# Accessions and fields are taken from a raw export (tests/raw_transcript.csv by default); only accessions
+# that would reach the alignment step of variant_consensus (non-identical, not all short) are timed.
+# Agreement is the fraction of accessions where center-star and MAFFT give the same consensus
+# Usage: python3 benchmarks/bench_centerstar.py -file tests/raw_transcript.csv -mafft /usr/local/bin/mafft
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import consensus_tools
+from consensus_tools import *
+from io_tools import read_transcripts
+
+FIELDS = ["Collector", "Locality", "County", "Host", "Other Notes", "Begin Date Collected"]
+
+
+def aligned_sets(data, field):
+    ''' Variant lists of the accessions that variant_consensus would align '''
+    sets = []
+    for k, v in create_variant_dict("subject_id", field, data).items():
+        if len(set(v)) > 1 and sum([len(i) < 2 for i in v]) < len(v):
+            sets.append(v)
+    return sets
+
+
+def time_strategy(sets, strategy, repeats):
+    ''' Returns the consensus of every set and the mean seconds per accession over `repeats` runs '''
+    start = time.perf_counter()
+    for i in range(repeats):
+        results = [character_align(v, ".", "dumber", align_strategy = strategy) for v in sets]
+    return results, (time.perf_counter() - start) / (repeats * len(sets))
+
+
+def main():
+    args = parser.parse_args()
+    if args.mafft:
+        consensus_tools.mafft = args.mafft
+    use_mafft = os.path.exists(consensus_tools.mafft)
+    if not use_mafft:
+        print("MAFFT not found at", consensus_tools.mafft, "- timing center-star only")
+
+    data = read_transcripts(args.file)
+    rows = []
+    for field in FIELDS:
+        sets = aligned_sets(data, field)
+        if len(sets) == 0:
+            continue
+
+        centerstar, centerstar_time = time_strategy(sets, "centerstar", args.repeats)
+        row = {"field": field, "accessions": len(sets),
+               "mean_variants": sum(len(v) for v in sets) / len(sets),
+               "centerstar_ms": 1000 * centerstar_time}
+        if use_mafft:
+            try:
+                linsi, linsi_time = time_strategy(sets, "linsi", 1)
+                row["mafft_linsi_ms"] = 1000 * linsi_time
+                row["speedup"] = linsi_time / centerstar_time
+                row["agreement"] = sum(a == b for a, b in zip(centerstar, linsi)) / len(sets)
+            except subprocess.CalledProcessError as e:
+                print("\nMAFFT failed on", field, "-", e)
+        rows.append(row)
+
+    print("\n", pd.DataFrame(rows).to_string(index = False, float_format = "%.3f"))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Center-star vs MAFFT alignment benchmark")
+    parser.add_argument("-file", default = os.path.join("tests", "raw_transcript.csv"), help = "Raw transcription export")
+    parser.add_argument("-repeats", type = int, default = 20, help = "Timing repeats for the center-star aligner")
+    parser.add_argument("-mafft", help = "Path to the MAFFT binary")
+    main()
@@ -0,0 +1,129 @@
+## CONSENSUS MICRO-BENCHMARKS
+# Description: Times the consensus and normalization functions on synthetic exports of increasing size
+#
+# Notes:
+# Reports time per accession, peak Python memory (tracemalloc) and accuracy against the known ground truth
+# Usage: python3 benchmarks/bench_consensus.py -sizes [10,100,1000] -output bench_consensus.csv
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from Levenshtein import ratio
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from Bio.Align import MultipleSeqAlignment, AlignInfo
+
+import consensus_tools
+from consensus_tools import *
+from normalization_tools import refcheck
+from synthetic_tools import generate_transcripts, COLLECTORS
+
+
+def measure(func):
+    ''' Runs func once, returning its result, the wall time in seconds and the peak traced memory in MB '''
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def accuracy(estimates, truth):
+    ''' Exact match rate and mean Levenshtein similarity between estimates and truth (two aligned lists) '''
+    if len(truth) == 0:
+        return float("nan"), float("nan")
+    exact = sum(est == tru for est, tru in zip(estimates, truth)) / len(truth)
+    similarity = sum(ratio(str(est), str(tru)) for est, tru in zip(estimates, truth)) / len(truth)
+    return exact, similarity
+
+
+def padded_alignment(variants):
+    ''' Naive alignment (right-padded with gaps) so dumber_consensus can be timed without MAFFT '''
+    width = max(len(v) for v in variants)
+    records = [SeqRecord(Seq(v.ljust(width, "-")), id = str(i)) for i, v in enumerate(variants)]
+    return AlignInfo.SummaryInfo(MultipleSeqAlignment(records))
+
+
+def frame_accuracy(results, truth, field):
+    merged = pd.merge(truth[["subject_id", field]], results, on = "subject_id", suffixes = ("_truth", ""))
+    return accuracy(list(merged[field]), list(merged[field + "_truth"]))
+
+
+def bench_size(n_accessions, n_replicates, field_length, wdir):
+    data, truth = generate_transcripts(n_accessions = n_accessions, n_replicates = n_replicates,
+                                       field_length = field_length, seed = n_accessions)
+    rows = []
+
+    def record(name, func, score):
+        try:
+            result, elapsed, peak = measure(func)
+            exact, similarity = score(result)
+            status = "ok"
+        except Exception as e:
+            elapsed, peak, exact, similarity = [float("nan")] * 4
+            status = type(e).__name__
+        rows.append({"function": name, "accessions": n_accessions, "replicates": n_replicates,
+                     "ms_per_accession": 1000 * elapsed / n_accessions, "peak_mb": peak,
+                     "exact": exact, "similarity": similarity, "status": status})
+
+    record("vote_count", lambda: vote_count("subject_id", "Country", data),
+           lambda res: frame_accuracy(res, truth, "Country"))
+    record("best_transcript_fuzzy", lambda: best_transcript("subject_id", "Locality", data, "fuzzy"),
+           lambda res: frame_accuracy(res, truth, "Locality"))
+    record("best_transcript_distance", lambda: best_transcript("subject_id", "Locality", data, "distance"),
+           lambda res: frame_accuracy(res, truth, "Locality"))
+
+    # dumber_consensus is timed on pre-built alignments so only the consensus step is measured
+    groups = create_variant_dict("subject_id", "Locality", data)
+    alignments = [padded_alignment(v) for v in groups.values() if max(len(i) for i in v) > 0]
+    locality_truth = dict(zip(truth["subject_id"], truth["Locality"]))
+    keys = [k for k, v in groups.items() if max(len(i) for i in v) > 0]
+    record("dumber_consensus", lambda: [dumber_consensus(a, threshold = 0.5) for a in alignments],
+           lambda res: accuracy(res, [locality_truth[k] for k in keys]))
+
+    record("token_align", lambda: variant_consensus("subject_id", "Locality", data, "token", "dumber", wdir),
+           lambda res: frame_accuracy(res, truth, "Locality"))
+    if os.path.exists(consensus_tools.mafft):
+        record("character_align", lambda: variant_consensus("subject_id", "Locality", data, "character", "dumber", wdir),
+               lambda res: frame_accuracy(res, truth, "Locality"))
+    else:
+        print("MAFFT not found at", consensus_tools.mafft, "- skipping character_align")
+
+    collectors = list(data["Collector"].str.lower())
+    collector_truth = [truth_value for truth_value in truth["Collector"] for i in range(n_replicates)]
+    record("refcheck", lambda: refcheck(collectors, COLLECTORS, threshold = 0.9)[0],
+           lambda res: accuracy(res, collector_truth))
+    return rows
+
+
+def main():
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.strip("[|]").split(",")]
+
+    rows = []
+    for size in sizes:
+        print("\nBenchmarking", size, "accessions ...")
+        rows.extend(bench_size(size, args.replicates, args.length, args.wd))
+
+    results = pd.DataFrame(rows)
+    pd.set_option("display.width", 200)
+    print("\n", results.to_string(index = False, float_format = "%.3f"))
+    if args.output:
+        results.to_csv(args.output, index = False)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Consensus and normalization micro-benchmarks")
+    parser.add_argument("-sizes", default = "[10,100,1000]", help = "Accession counts. Must be in the format [n1,n2,n3]")
+    parser.add_argument("-replicates", type = int, default = 4, help = "Replicate transcriptions per accession")
+    parser.add_argument("-length", type = int, default = 30, help = "Approximate length of the Locality field")
+    parser.add_argument("-wd", default = ".", help = "Working directory for temporary alignment files")
+    parser.add_argument("-output", "-o", help = "Optional CSV file for the results")
+    main()
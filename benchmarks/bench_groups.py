@@ -0,0 +1,100 @@
+## VARIANT GROUPING MEMORY BENCHMARK
+# Description: Memory and time of grouping replicate transcriptions by accession - the dictionary of lists
+#              (create_variant_dict) against the sorted, offset-indexed VariantGroups
+#
+# Notes:
+# The export is built directly with NumPy (random accession order, values drawn from a pool of synthetic
+# transcriptions), so millions of rows can be generated in seconds. Each mode groups every target field the
+# way transcriptResolver does and walks the groups once. Memory is traced with tracemalloc: the peak of the
+# whole run, and the memory held by the grouping while a method walks a field (the dictionary of the field,
+# or the sorted order, offsets and sorted field values)
+# Usage: python3 benchmarks/bench_groups.py -rows 5000000 -fields 6
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from consensus_tools import create_variant_dict, VariantGroups
+from synthetic_tools import generate_transcripts, FREE_TEXT_FIELDS, CONSTRAINED_FIELDS
+
+
+def synthetic_export(rows, replicates, fields, seed = 1):
+    ''' Export of `rows` rows, `replicates` rows per accession in random order '''
+    rng = np.random.default_rng(seed)
+    pool, truth = generate_transcripts(n_accessions = 2000, n_replicates = replicates, seed = seed)
+
+    n_accessions = rows // replicates
+    accessions = np.array(["%024x" % i for i in range(n_accessions)], dtype = object)
+    data = {"subject_id": accessions[rng.permutation(np.repeat(np.arange(n_accessions), replicates))]}
+    for field in fields:
+        data[field] = pool[field].to_numpy()[rng.integers(0, len(pool), n_accessions * replicates)]
+    return pd.DataFrame(data, dtype = object) # as read by io_tools.read_transcripts
+
+
+def dict_of_lists(data, fields):
+    identical = 0
+    held = 0
+    for field in fields:
+        entry_id = create_variant_dict("subject_id", field, data)
+        held = max(held, tracemalloc.get_traced_memory()[0])
+        for k, v in entry_id.items():
+            identical += len(set(v)) == 1
+        del entry_id
+    return identical, held
+
+
+def sorted_groups(data, fields):
+    identical = 0
+    held = 0
+    groups = VariantGroups(data, "subject_id")
+    for field in fields:
+        for i, (k, v) in enumerate(groups.items(field)):
+            if i == 0:
+                held = max(held, tracemalloc.get_traced_memory()[0])
+            identical += len(set(v)) == 1
+    return identical, held
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result, held = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return result, elapsed, peak, held / 1e6
+
+
+def main():
+    args = parser.parse_args()
+    fields = (FREE_TEXT_FIELDS + CONSTRAINED_FIELDS)[:args.fields]
+
+    print("\nBuilding a synthetic export of", args.rows, "rows and", len(fields), "target fields ...")
+    data = synthetic_export(args.rows, args.replicates, fields)
+
+    rows = []
+    results = set()
+    for name, func in [("dict of lists", dict_of_lists), ("sorted groups", sorted_groups)]:
+        print("\nGrouping with", name, "...")
+        result, elapsed, peak, held = measure(func, data, fields)
+        results.add(result)
+        rows.append({"mode": name, "rows": len(data), "fields": len(fields), "seconds": elapsed,
+                     "peak_mb": peak, "held_per_field_mb": held})
+
+    if len(results) != 1:
+        raise Exception("The two groupings disagree")
+    print("\n", pd.DataFrame(rows).to_string(index = False, float_format = "%.1f"))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Variant grouping memory benchmark")
+    parser.add_argument("-rows", type = int, default = 5000000, help = "Rows in the synthetic export")
+    parser.add_argument("-replicates", type = int, default = 4, help = "Replicate transcriptions per accession")
+    parser.add_argument("-fields", type = int, default = 6, help = "Number of target fields")
+    main()
@@ -0,0 +1,69 @@
+## IMPORT TIME BENCHMARK
+# Description: Measures the cold import cost of each CLI entry point in a fresh interpreter
+#
+# Notes:
+# Each entry point is imported in a new python process (-X importtime); the wall time is the median
+# over several runs and the slowest direct imports are listed from the importtime report
+# Usage: python3 benchmarks/bench_import.py -runs 5
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Entry point -> statement executed in the fresh interpreter
+ENTRY_POINTS = {"transcriptPrepare": "import transcriptPrepare",
+                "transcriptResolver": "import transcriptResolver",
+                "transcriptResolver (vote_count)": "import transcriptResolver; transcriptResolver.get_method('vote_count')",
+                "transcriptResolver (consensus)": "import transcriptResolver; transcriptResolver.get_method('consensus')",
+                "transcriptClean": "import transcriptClean",
+                "transcriptPipeline": "import transcriptPipeline"}
+
+
+def time_import(statement, runs):
+    ''' Median wall time (seconds) of running statement in a fresh interpreter, and the last importtime report '''
+    times = []
+    report = ""
+    for i in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-W", "ignore", "-c", statement],
+                              cwd = ROOT, capture_output = True, text = True)
+        times.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            raise Exception(proc.stderr)
+        report = proc.stderr
+    return statistics.median(times), report
+
+
+def slowest_imports(report, n):
+    ''' Direct imports of the entry module with the largest cumulative time (microseconds) from a -X importtime report '''
+    imports = []
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2 # one space, then two per nesting level
+        if depth == 1:
+            imports.append((int(cumulative_us), name.strip()))
+    return sorted(imports, reverse = True)[:n]
+
+
+def main():
+    args = parser.parse_args()
+    baseline, report = time_import("pass", args.runs)
+    print("\nInterpreter startup: %.0f ms" % (1000 * baseline))
+
+    for name, statement in ENTRY_POINTS.items():
+        elapsed, report = time_import(statement, args.runs)
+        top = ", ".join("%s %.0fms" % (module, us / 1000) for us, module in slowest_imports(report, args.top))
+        print("%-32s %6.0f ms  (%s)" % (name, 1000 * (elapsed - baseline), top))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import time of each CLI entry point")
+    parser.add_argument("-runs", type = int, default = 5, help = "Runs per entry point")
+    parser.add_argument("-top", type = int, default = 4, help = "Number of slowest imports to list")
+    main()
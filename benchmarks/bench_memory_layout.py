@@ -0,0 +1,118 @@
+## MEMORY LAYOUT BENCHMARK
+# Description: Resident memory of a large export read with one Python string per cell (the default) and with
+#              the low-cardinality columns as categoricals (-categorical), and the time of vote counting on each
+#
+# Notes:
+# The export is assembled by sampling rows of a synthetic pool (synthetic_tools) into a multi-million-row raw
+# export CSV with every column of a Notes from Nature export. Each layout is measured in a fresh interpreter, so
+# the resident set sizes (RSS) do not share allocations: RSS held by the frame once the file is read (after
+# returning freed heap pages to the system, so parser buffers do not count), peak RSS while reading, and the
+# time of vote_count on Country, State/Province and County
+# Usage: python3 benchmarks/bench_memory_layout.py -rows 2000000
+
+import gc
+import os
+import sys
+import json
+import time
+import ctypes
+import argparse
+import resource
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+from io_tools import read_transcripts
+from consensus_tools import vote_count
+from synthetic_tools import generate_transcripts
+
+VOTE_FIELDS = ["Country", "State/Province", "County"]
+
+
+def rss_mb():
+    ''' Current resident set size of this process '''
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def release_memory():
+    ''' Returns freed heap pages to the system (glibc), so RSS shows the memory that is still in use '''
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def synthetic_export(path, rows, replicates, seed = 1):
+    ''' Writes a raw export of `rows` rows, `replicates` rows per accession in random order '''
+    rng = np.random.default_rng(seed)
+    pool, truth = generate_transcripts(n_accessions = 5000, n_replicates = replicates, seed = seed)
+
+    n_accessions = rows // replicates
+    picks = rng.integers(0, len(pool), n_accessions * replicates)
+    data = {col: pool[col].to_numpy()[picks] for col in pool.columns}
+    data["id"] = np.array(["%024x" % i for i in range(len(picks))], dtype = object)
+    data["subject_id"] = np.array(["%024x" % i for i in range(n_accessions)], dtype = object)[
+                            rng.permutation(np.repeat(np.arange(n_accessions), replicates))]
+    data["user_name"] = np.array(["volunteer%d" % i for i in range(50000)], dtype = object)[rng.integers(0, 50000, len(picks))]
+    pd.DataFrame(data, columns = pool.columns).to_csv(path, index = False)
+
+
+def measure(path, categorical):
+    ''' Runs in its own interpreter (see -measure); prints the measurements as JSON '''
+    start = time.perf_counter()
+    data = read_transcripts(path, categorical = categorical)
+    read_seconds = time.perf_counter() - start
+    release_memory()
+    read_rss = rss_mb()
+
+    start = time.perf_counter()
+    for field in VOTE_FIELDS:
+        vote_count("subject_id", field, data)
+    vote_seconds = time.perf_counter() - start
+
+    print(json.dumps({"rows": len(data), "rss_mb": read_rss, "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                      "read_s": read_seconds, "vote_s": vote_seconds}))
+
+
+def main():
+    args = parser.parse_args()
+    if args.measure:
+        measure(args.file, args.measure == "categorical")
+        return
+
+    path = args.file
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "export.csv")
+        print("\nWriting a synthetic export of", args.rows, "rows to", path, "...")
+        synthetic_export(path, args.rows, args.replicates)
+
+    rows = []
+    for layout in ["object", "categorical"]:
+        print("\nReading with the", layout, "layout ...")
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "-measure", layout, "-file", path],
+                                cwd = ROOT, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, check = True)
+        result = json.loads(output.stdout.decode("utf-8").strip().splitlines()[-1])
+        rows.append(dict({"layout": layout}, **result))
+
+    table = pd.DataFrame(rows)
+    print("\n", table.to_string(index = False, float_format = "%.1f"))
+    print("\nRSS reduction: %.1f%% (%.0f MB)" % (100 * (1 - table["rss_mb"][1] / table["rss_mb"][0]),
+                                                 table["rss_mb"][0] - table["rss_mb"][1]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Memory layout benchmark")
+    parser.add_argument("-rows", type = int, default = 2000000, help = "Rows in the synthetic export")
+    parser.add_argument("-replicates", type = int, default = 4, help = "Replicate transcriptions per accession")
+    parser.add_argument("-file", help = "Use this export instead of a synthetic one")
+    parser.add_argument("-measure", choices = ["object", "categorical"], help = argparse.SUPPRESS)
+    main()
@@ -0,0 +1,76 @@
+## OUTLIER FILTER BENCHMARK
+# Description: Effect of the MinHash outlier filter on alignment input size, alignment width, speed and accuracy
+#
+# Notes:
+# Synthetic exports with a share of junk replicates (see synthetic_tools.generate_transcripts junk_rate) are
+# resolved with and without -outlier_threshold. Alignment width is measured with the built-in center-star
+# aligner; gap columns are alignment columns minus the length of the consensus
+# Usage: python3 benchmarks/bench_outliers.py -accessions 500 -junk [0,0.1,0.2] -thresholds [0.1,0.2,0.3]
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from consensus_tools import variant_consensus, VariantGroups, centerstar_character_align, character_placeholders
+from minhash_tools import filter_outliers
+from synthetic_tools import generate_transcripts
+
+FIELD = "Locality"
+
+
+def alignment_size(groups, threshold):
+    ''' Total characters fed to the aligner and total alignment columns over all accessions with variants '''
+    chars = 0
+    columns = 0
+    for k, v in groups.items(FIELD):
+        if len(set(v)) == 1:
+            continue
+        if threshold is not None:
+            v, dropped = filter_outliers(v, threshold)
+        chars += sum(len(string) for string in v)
+        columns += len(centerstar_character_align(character_placeholders(v))[0])
+    return chars, columns
+
+
+def main():
+    args = parser.parse_args()
+    thresholds = [None] + [float(t) for t in args.thresholds.strip("[|]").split(",")]
+
+    rows = []
+    for junk in [float(j) for j in args.junk.strip("[|]").split(",")]:
+        data, truth = generate_transcripts(n_accessions = args.accessions, n_replicates = args.replicates,
+                                           field_length = args.length, junk_rate = junk, seed = 1)
+        truth = dict(zip(truth["subject_id"], truth[FIELD]))
+        groups = VariantGroups(data, "subject_id")
+
+        for threshold in thresholds:
+            start = time.perf_counter()
+            result = variant_consensus("subject_id", FIELD, groups, "character", "dumber", ".",
+                                       align_strategy = args.strategy, outlier_threshold = threshold)
+            elapsed = time.perf_counter() - start
+            chars, columns = alignment_size(groups, threshold)
+
+            estimates = dict(zip(result["subject_id"], result[FIELD]))
+            dropped = sum(len(d.split("|")) for d in result[FIELD + "_dropped"] if d != "") if threshold is not None else 0
+            rows.append({"junk": junk, "threshold": "off" if threshold is None else str(threshold),
+                         "dropped": dropped, "input_chars": chars, "align_columns": columns,
+                         "gap_columns": columns - sum(len(e) for e in estimates.values()),
+                         "ms_per_accession": 1000 * elapsed / args.accessions,
+                         "accuracy": sum(estimates[k] == truth[k] for k in estimates) / len(estimates)})
+
+    print("\n", pd.DataFrame(rows).to_string(index = False, float_format = "%.3f"))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="MinHash outlier filter benchmark")
+    parser.add_argument("-accessions", type = int, default = 500, help = "Number of specimens")
+    parser.add_argument("-replicates", type = int, default = 5, help = "Replicates per specimen")
+    parser.add_argument("-length", type = int, default = 40, help = "Approximate length of the Locality field")
+    parser.add_argument("-junk", default = "[0,0.1,0.2]", help = "Junk rates. Must be in the format [r1,r2,r3]")
+    parser.add_argument("-thresholds", default = "[0.1,0.2,0.3]", help = "Outlier thresholds. Must be in the format [t1,t2,t3]")
+    parser.add_argument("-strategy", default = "centerstar", help = "Character alignment strategy")
+    main()
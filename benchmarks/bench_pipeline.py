@@ -0,0 +1,189 @@
+## END-TO-END PIPELINE BENCHMARK
+# Description: Throughput and peak memory of the prepare, resolve and clean stages on scaled copies of the
+#              test fixtures, checked against stored baselines
+#
+# Notes:
+# tests/raw_transcript.csv is replicated up to each size; every copy gets new subject_id, id and specimen
+# numbers and fresh typos in its free-text fields. The essig database is replaced by a SQLite stand-in
+# (db_tools.create_standin) and MAFFT by benchmarks/stub_mafft.py unless -mafft names a real binary. Each
+# stage runs in its own interpreter on the previous stage's output file, so its peak RSS is its own.
+# Results are compared with benchmarks/baselines/pipeline.json: the run fails (exit status 1) if a stage's
+# throughput drops, or its peak memory grows, by more than -tolerance, or if it outputs a different number
+# of rows. -update_baselines stores this run's results instead
+# Usage: python3 benchmarks/bench_pipeline.py -sizes [10000,100000,1000000] -tolerance 0.25
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+
+from io_tools import read_transcripts, ENCODING
+from synthetic_tools import add_typos
+
+STAGES = ["prepare", "resolve", "clean"]
+BASELINES = os.path.join(ROOT, "benchmarks", "baselines", "pipeline.json")
+STUB_MAFFT = os.path.join(ROOT, "benchmarks", "stub_mafft.py")
+
+COL_TARGET = ["filename", "Collector", "Begin Date Collected", "End Date Collected", "Country",
+              "State/Province", "County", "id", "Locality", "Host"]
+COL_METHOD = ["vote_count", "consensus_centerstar", "vote_count", "vote_count", "vote_count",
+              "vote_count", "vote_count", "metadata", "consensus_token", "consensus"]
+
+
+def scaled_fixture(path, rows, typo_rate = 0.01, seed = 1):
+    ''' Writes a raw export of `rows` rows made of perturbed copies of tests/raw_transcript.csv '''
+    rng = random.Random(seed)
+    raw = read_transcripts(os.path.join(ROOT, "tests", "raw_transcript.csv"))
+    copies = []
+    for copy in range(rows // len(raw) + 1):
+        data = raw.copy()
+        data["subject_id"] = [x + "%06d" % copy for x in data["subject_id"]]
+        data["id"] = [x + "%06d" % copy for x in data["id"]]
+        # a new specimen number per copy, so every copy is a different specimen for the cleaner
+        data["filename"] = [re.sub(r"([A-Z]+)\s*([0-9]+)", lambda m: m.group(1) + str(copy) + m.group(2), x, count = 1)
+                            for x in data["filename"]]
+        if copy > 0:
+            for field in ["Collector", "Locality"]:
+                data[field] = [add_typos(x, typo_rate, rng) for x in data[field]]
+        copies.append(data)
+    pd.concat(copies, ignore_index = True).iloc[:rows].to_csv(path, index = False)
+
+
+def standin_database(path):
+    ''' SQLite stand-in for the essig database: the collectors of tests/clean_transcript.csv, nothing databased yet '''
+    from db_tools import create_standin
+    clean = read_transcripts(os.path.join(ROOT, "tests", "clean_transcript.csv"))
+    names = sorted(set(clean["Collector"]) - {""})
+    people = pd.DataFrame({"name_full": names, "name_short": [""] * len(names), "collector": [1] * len(names)})
+    create_standin(path, people, [])
+
+
+def peak_mb():
+    ''' Peak resident set size of this process. Unlike getrusage's ru_maxrss, VmHWM is not carried over from
+        the parent (which holds the fixture) through fork and exec '''
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_stage(stage, source, target, sqlite, mafft):
+    ''' Runs in its own interpreter (see -stage); prints the measurements as JSON '''
+    start = time.perf_counter()
+    if stage == "prepare":
+        from transcriptPrepare import prepare_file, fetch_essig_ids
+        rows = prepare_file(source, fetch_essig_ids(None, None, sqlite = sqlite), "filename", output = target)
+
+    elif stage == "resolve":
+        import consensus_tools
+        from transcriptResolver import resolve_transcripts
+        consensus_tools.mafft = mafft
+        data = read_transcripts(source, usecols = ["subject_id"] + COL_TARGET)
+        resolved = resolve_transcripts(data = data, col_id = "subject_id", col_target = COL_TARGET,
+                                       col_method = COL_METHOD, wdir = os.path.dirname(target))
+        resolved.to_csv(target, index = False)
+        rows = len(resolved)
+
+    elif stage == "clean":
+        from transcriptClean import transcriptCleaner, clean_transcripts
+        # no snapshot: the reference indexes are built from the stand-in and the reference CSVs (and not saved)
+        args = SimpleNamespace(wd = None, file = source, username = None, password = None, sqlite = sqlite,
+                               reference = None, reference_max_age = None)
+        allClean = clean_transcripts(transcriptCleaner(args))
+        allClean.to_csv(target, index = False)
+        rows = len(allClean)
+
+    print(json.dumps({"seconds": time.perf_counter() - start, "rows_out": rows,
+                      "peak_mb": peak_mb()}))
+
+
+def compare(results, baselines, tolerance):
+    ''' Regressions of results against baselines (list of messages) '''
+    failures = []
+    for key, result in results.items():
+        if key not in baselines:
+            continue
+        base = baselines[key]
+        if result["rows_out"] != base["rows_out"]:
+            failures.append("%s: %d rows out, baseline %d" % (key, result["rows_out"], base["rows_out"]))
+        if result["rows_per_s"] < base["rows_per_s"] * (1 - tolerance):
+            failures.append("%s: %.0f rows/s, baseline %.0f" % (key, result["rows_per_s"], base["rows_per_s"]))
+        if result["peak_mb"] > base["peak_mb"] * (1 + tolerance):
+            failures.append("%s: peak %.0f MB, baseline %.0f MB" % (key, result["peak_mb"], base["peak_mb"]))
+    return failures
+
+
+def main():
+    args = parser.parse_args()
+    if args.stage:
+        run_stage(args.stage, args.source, args.target, args.sqlite, args.mafft)
+        return
+
+    wdir = tempfile.mkdtemp()
+    sqlite = os.path.join(wdir, "essig.sqlite")
+    standin_database(sqlite)
+
+    results = dict()
+    for size in [int(x) for x in args.sizes.strip("[|]").split(",")]:
+        print("\nBuilding a fixture of", size, "rows ...")
+        files = [os.path.join(wdir, "%d_%s.csv" % (size, name)) for name in ["raw"] + STAGES]
+        scaled_fixture(files[0], size)
+
+        for stage, source, target in zip(STAGES, files[:-1], files[1:]):
+            print("Running", stage, "...")
+            rows_in = len(pd.read_csv(source, encoding = ENCODING, usecols = [0]))
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "-stage", stage, "-source", source,
+                                     "-target", target, "-sqlite", sqlite, "-mafft", args.mafft],
+                                    cwd = ROOT, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, check = True)
+            result = json.loads(output.stdout.decode("utf-8").strip().splitlines()[-1])
+            result["rows_in"] = rows_in
+            result["rows_per_s"] = rows_in / result["seconds"]
+            results["%d/%s" % (size, stage)] = result
+
+    table = pd.DataFrame([dict({"size/stage": key}, **result) for key, result in results.items()])
+    print("\n", table[["size/stage", "rows_in", "rows_out", "seconds", "rows_per_s", "peak_mb"]].to_string(index = False, float_format = "%.1f"))
+
+    if args.update_baselines:
+        baselines = json.load(open(BASELINES)) if os.path.exists(BASELINES) else dict()
+        baselines.update({key: {name: result[name] for name in ["rows_out", "rows_per_s", "peak_mb"]}
+                          for key, result in results.items()})
+        os.makedirs(os.path.dirname(BASELINES), exist_ok = True)
+        with open(BASELINES, "w") as f:
+            json.dump(baselines, f, indent = 2, sort_keys = True)
+        print("\nBaselines written to", BASELINES)
+        return
+
+    if not os.path.exists(BASELINES):
+        print("\nNo baselines at", BASELINES, "- run with -update_baselines to create them")
+        return
+    failures = compare(results, json.load(open(BASELINES)), args.tolerance)
+    if len(failures) > 0:
+        print("\nRegressions beyond a tolerance of %.0f%%:" % (100 * args.tolerance))
+        [print("  " + failure) for failure in failures]
+        sys.exit(1)
+    print("\nNo regressions beyond a tolerance of %.0f%%" % (100 * args.tolerance))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark")
+    parser.add_argument("-sizes", default = "[10000,100000,1000000]", help = "Fixture sizes in rows. Must be in the format -sizes [size1,size2]")
+    parser.add_argument("-tolerance", type = float, default = 0.25, help = "Allowed fractional drop in throughput (or growth in peak memory)")
+    parser.add_argument("-mafft", default = STUB_MAFFT, help = "MAFFT binary (default: the stub in benchmarks/)")
+    parser.add_argument("-update_baselines", action = "store_true", help = "Store this run's results as the baselines")
+    parser.add_argument("-stage", choices = STAGES, help = argparse.SUPPRESS)
+    parser.add_argument("-source", help = argparse.SUPPRESS)
+    parser.add_argument("-target", help = argparse.SUPPRESS)
+    parser.add_argument("-sqlite", help = argparse.SUPPRESS)
+    main()
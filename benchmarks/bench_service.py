@@ -0,0 +1,116 @@
+## RESOLVER SERVICE LOAD BENCHMARK
+# Description: Batch latency of a warm resolverService against a cold transcriptResolver.py run
+#
+# Notes:
+# Starts resolverService on a free local port, sends synthetic batches from concurrent clients and reports
+# latency percentiles and throughput. Batches are drawn from a fixed pool, so repeated batches show the
+# effect of the consensus cache. The cold baseline runs transcriptResolver.py in a fresh interpreter on one batch
+# Usage: python3 benchmarks/bench_service.py -batch 50 -requests 200 -clients 4
+
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+
+from resolverClient import submit
+from synthetic_tools import generate_transcripts
+
+COL_TARGET = ["Country", "State/Province", "Collector", "Locality"]
+COL_METHOD = ["vote_count", "vote_count", "consensus_centerstar", "consensus_centerstar"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(address, timeout = 60):
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            return submit(address, "health", timeout = 1)
+        except Exception:
+            time.sleep(0.2)
+    raise Exception("resolverService did not start within " + str(timeout) + " seconds")
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def cold_run(batch, wdir):
+    ''' Wall time of one transcriptResolver.py run (new interpreter, cold imports) on a batch '''
+    batch.to_csv(os.path.join(wdir, "batch.csv"), index = False)
+    command = [sys.executable, os.path.join(ROOT, "transcriptResolver.py"), "-wd", wdir, "-file", "batch.csv",
+               "-stem", "cold", "-col_id", "subject_id",
+               "-col_target", "[" + ",".join(COL_TARGET) + "]", "-col_method", "[" + ",".join(COL_METHOD) + "]"]
+    start = time.perf_counter()
+    subprocess.run(command, cwd = ROOT, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, check = True)
+    return time.perf_counter() - start
+
+
+def main():
+    args = parser.parse_args()
+    batches = []
+    for i in range(args.pool):
+        data, truth = generate_transcripts(n_accessions = args.batch, seed = i)
+        batches.append(data[["subject_id"] + COL_TARGET])
+
+    wdir = tempfile.mkdtemp()
+    port = free_port()
+    address = "http://127.0.0.1:%d" % port
+    service = subprocess.Popen([sys.executable, os.path.join(ROOT, "resolverService.py"), "-port", str(port),
+                                "-no_clean", "-wd", wdir], cwd = ROOT,
+                               stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    try:
+        start = time.perf_counter()
+        wait_for(address)
+        startup = time.perf_counter() - start
+
+        def send(i):
+            batch = batches[i % len(batches)]
+            request = {"rows": batch.to_dict(orient = "records"), "col_id": "subject_id",
+                       "col_target": COL_TARGET, "col_method": COL_METHOD}
+            start = time.perf_counter()
+            submit(address, "resolve", request)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers = args.clients) as pool:
+            latencies = list(pool.map(send, range(args.requests)))
+        elapsed = time.perf_counter() - start
+        cache = submit(address, "health")["cache_entries"]
+    finally:
+        service.terminate()
+        service.wait()
+
+    cold = [cold_run(batches[0], wdir) for i in range(args.cold)]
+
+    rows = [{"mode": "service (warm)", "requests": args.requests, "clients": args.clients,
+             "p50_ms": 1000 * percentile(latencies, 0.5), "p95_ms": 1000 * percentile(latencies, 0.95),
+             "max_ms": 1000 * max(latencies), "batches_per_s": args.requests / elapsed},
+            {"mode": "transcriptResolver.py (cold)", "requests": args.cold, "clients": 1,
+             "p50_ms": 1000 * percentile(cold, 0.5), "p95_ms": 1000 * percentile(cold, 0.95),
+             "max_ms": 1000 * max(cold), "batches_per_s": len(cold) / sum(cold)}]
+    print("\nService startup: %.2f s, cached consensus results: %d" % (startup, cache))
+    print("\n", pd.DataFrame(rows).to_string(index = False, float_format = "%.1f"))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="resolverService load benchmark")
+    parser.add_argument("-batch", type = int, default = 50, help = "Accessions per batch")
+    parser.add_argument("-pool", type = int, default = 20, help = "Number of distinct batches")
+    parser.add_argument("-requests", type = int, default = 200, help = "Number of batches sent to the service")
+    parser.add_argument("-clients", type = int, default = 4, help = "Concurrent clients")
+    parser.add_argument("-cold", type = int, default = 3, help = "Number of cold transcriptResolver.py runs")
+    main()
@@ -0,0 +1,70 @@
+## ALIGNMENT STRATEGY BENCHMARK
+# Description: Speed gained and consensus agreement lost by each character alignment strategy
+#
+# Notes:
+# Every setting is compared against L-INS-i (the default): agreement is the fraction of accessions with
+# the same consensus as L-INS-i, accuracy the fraction equal to the synthetic ground truth
+# Usage: python3 benchmarks/bench_strategy.py -accessions 200 -replicates [3,5,8] -mafft /usr/local/bin/mafft
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import consensus_tools
+from consensus_tools import variant_consensus
+from synthetic_tools import generate_transcripts
+
+# Setting name -> (strategy, thresholds)
+SETTINGS = [("linsi", "linsi", None),
+            ("fftns2", "fftns2", None),
+            ("centerstar", "centerstar", None),
+            ("auto (default)", "auto", None),
+            ("auto (centerstar<=5)", "auto", {"centerstar_max_variants": 5}),
+            ("auto (divergence<=0.1)", "auto", {"fast_max_divergence": 0.1}),
+            ("auto (divergence<=0.4)", "auto", {"fast_max_divergence": 0.4})]
+
+
+def main():
+    args = parser.parse_args()
+    if args.mafft:
+        consensus_tools.mafft = args.mafft
+    if not os.path.exists(consensus_tools.mafft):
+        raise Exception("MAFFT not found at " + consensus_tools.mafft + "; pass -mafft")
+
+    rows = []
+    for replicates in [int(n) for n in args.replicates.strip("[|]").split(",")]:
+        data, truth = generate_transcripts(n_accessions = args.accessions, n_replicates = replicates,
+                                           field_length = args.length, seed = replicates)
+        truth = dict(zip(truth["subject_id"], truth["Locality"]))
+
+        reference = None
+        for name, strategy, thresholds in SETTINGS:
+            start = time.perf_counter()
+            result = variant_consensus("subject_id", "Locality", data, "character", "dumber", args.wd,
+                                       workers = args.workers, align_strategy = strategy, align_thresholds = thresholds)
+            elapsed = time.perf_counter() - start
+
+            estimates = dict(zip(result["subject_id"], result["Locality"]))
+            if reference is None:
+                reference = estimates
+            rows.append({"replicates": replicates, "setting": name,
+                         "ms_per_accession": 1000 * elapsed / args.accessions,
+                         "agreement_with_linsi": sum(estimates[k] == reference[k] for k in estimates) / len(estimates),
+                         "accuracy": sum(estimates[k] == truth[k] for k in estimates) / len(estimates)})
+
+    print("\n", pd.DataFrame(rows).to_string(index = False, float_format = "%.3f"))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Alignment strategy benchmark")
+    parser.add_argument("-accessions", type = int, default = 200, help = "Number of specimens")
+    parser.add_argument("-replicates", default = "[3,5,8]", help = "Replicates per specimen. Must be in the format [n1,n2,n3]")
+    parser.add_argument("-length", type = int, default = 60, help = "Approximate length of the Locality field")
+    parser.add_argument("-workers", type = int, default = 1, help = "Number of concurrent MAFFT alignments")
+    parser.add_argument("-mafft", help = "Path to the MAFFT binary")
+    parser.add_argument("-wd", default = ".", help = "Working directory")
+    main()
@@ -0,0 +1,71 @@
+## TOKEN VS CHARACTER ALIGNMENT BENCHMARK
+# Description: Compares speed and accuracy of token_align and character_align on synthetic free-text fields
+#
+# Notes:
+# character_align needs MAFFT; pass -mafft to point at a non-default binary
+# Usage: python3 benchmarks/bench_token_align.py -accessions 200 -lengths [30,100,300]
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from Levenshtein import ratio
+
+import consensus_tools
+from consensus_tools import create_variant_dict, token_align, character_align
+from synthetic_tools import generate_transcripts
+
+
+def bench_method(name, func, groups, truth):
+    estimates = []
+    start = time.perf_counter()
+    for k, v in groups:
+        estimates.append(func(v))
+    elapsed = time.perf_counter() - start
+
+    exact = sum(est == truth[k] for est, (k, v) in zip(estimates, groups)) / len(groups)
+    similarity = sum(ratio(est, truth[k]) for est, (k, v) in zip(estimates, groups)) / len(groups)
+    return {"method": name, "ms_per_accession": 1000 * elapsed / len(groups),
+            "exact": exact, "similarity": similarity}
+
+
+def main():
+    args = parser.parse_args()
+    if args.mafft:
+        consensus_tools.mafft = args.mafft
+    lengths = [int(length) for length in args.lengths.strip("[|]").split(",")]
+
+    rows = []
+    for length in lengths:
+        data, truth = generate_transcripts(n_accessions = args.accessions, n_replicates = args.replicates,
+                                           field_length = length, case_rate = 0, dropout_rate = 0, seed = length)
+        truth = dict(zip(truth["subject_id"], truth["Locality"]))
+
+        # Only accessions that actually need an alignment (identical variants take the fast path)
+        groups = [(k, v) for k, v in create_variant_dict("subject_id", "Locality", data).items() if len(set(v)) > 1]
+
+        methods = [("token_align", lambda v: token_align(v, args.wd, "dumber"))]
+        if os.path.exists(consensus_tools.mafft):
+            methods.append(("character_align", lambda v: character_align(v, args.wd, "dumber")))
+        else:
+            print("MAFFT not found at", consensus_tools.mafft, "- skipping character_align")
+
+        for name, func in methods:
+            row = bench_method(name, func, groups, truth)
+            row["field_length"] = length
+            rows.append(row)
+
+    print("\n", pd.DataFrame(rows).to_string(index = False, float_format = "%.3f"))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Token vs character alignment benchmark")
+    parser.add_argument("-accessions", type = int, default = 200, help = "Number of specimens")
+    parser.add_argument("-replicates", type = int, default = 4, help = "Replicate transcriptions per specimen")
+    parser.add_argument("-lengths", default = "[30,100,300]", help = "Locality lengths. Must be in the format [n1,n2,n3]")
+    parser.add_argument("-mafft", help = "Path to the MAFFT binary")
+    parser.add_argument("-wd", default = ".", help = "Working directory for temporary alignment files")
+    main()
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+## STUB MAFFT
+# Description: Stand-in for the MAFFT binary in benchmarks, for machines without MAFFT
+#
+# Notes:
+# Reads FASTA records (from stdin for "-", otherwise from the file named last on the command line), ignores
+# every option and right-pads the sequences with gaps to the same length. The "alignment" is not a real one,
+# but the call costs a process start and a pipe round trip, like the real binary
+# Usage: set consensus_tools.mafft to the path of this script (as benchmarks/bench_pipeline.py does)
+
+import sys
+
+path = sys.argv[-1]
+text = sys.stdin.read() if path == "-" else open(path).read()
+
+records = []
+for line in text.splitlines():
+    if line.startswith(">"):
+        records.append([line, ""])
+    elif len(records) > 0:
+        records[-1][1] += line.strip()
+
+width = max([len(seq) for name, seq in records] + [0])
+for name, seq in records:
+    print(name)
+    print(seq.ljust(width, "-"))
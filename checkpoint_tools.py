@@ -0,0 +1,78 @@
+## CHECKPOINT TOOLS
+# Description: Append-only checkpoint of resolved accessions, so an interrupted consensus run can be resumed
+#
+# Notes:
+# Each line of the checkpoint file is a JSON object {"field": ..., "accession": ..., "value": ...}.
+# Results are buffered and appended (and fsynced) at most every `interval` seconds; a line cut short by a
+# crash is ignored when the file is read back, so only the accessions resolved since the last flush are lost
+
+
+## DEPENDENCIES
+import os # Path tools
+import json
+import time
+import threading
+from collections import defaultdict
+
+
+class Checkpoint:
+    def __init__(self, path, resume = False, interval = 30.0):
+        ''' Arguments:
+            path        -- checkpoint file (JSON lines)
+            resume      -- if True, results already in the file are loaded and the file is appended to;
+                           otherwise any existing file is discarded
+            interval    -- minimum number of seconds between two writes to disk
+        '''
+        self.path = path
+        self.interval = interval
+        self.pending = []
+        self.last = time.perf_counter()
+        self.results = defaultdict(dict) # field -> accession -> value
+        self.lock = threading.Lock() # columns resolved concurrently record into the same checkpoint
+
+        if resume:
+            self.load()
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding = "utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError: # partially written line
+                    continue
+                self.results[entry["field"]][entry["accession"]] = entry["value"]
+
+    def completed(self, field):
+        ''' Dictionary of accession -> value of the accessions of `field` resolved by an earlier run '''
+        return self.results.get(field, dict())
+
+    def record(self, field, accession, value):
+        with self.lock:
+            self.results[field][accession] = value
+            self.pending.append({"field": field, "accession": accession, "value": value})
+        if time.perf_counter() - self.last >= self.interval:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.last = time.perf_counter()
+            if len(self.pending) == 0:
+                return
+            with open(self.path, "a", encoding = "utf-8") as f:
+                f.write("".join(json.dumps(entry) + "\n" for entry in self.pending))
+                f.flush()
+                os.fsync(f.fileno())
+            self.pending = []
+
+    def close(self, remove = False):
+        ''' Writes any pending results; with remove = True the checkpoint file is deleted instead (run finished) '''
+        if remove:
+            self.pending = []
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        else:
+            self.flush()
@@ -9,26 +9,33 @@
 
 
 ## DEPENDENCIES
+# fuzzywuzzy, Levenshtein and Biopython are slow to import, so they are imported inside the functions
+# that use them (best_transcript and character_align); a vote_count-only run never loads them
 import pandas as pd 
+import numpy as np
 from collections import defaultdict
 import itertools as it
-from fuzzywuzzy import fuzz # Fuzzy string matching for best_transcript()
-from fuzzywuzzy import process # For reflst matching
-from Levenshtein import * # Levenshtein distance for best_transcript() 
+import copy
 
 import os # Path tools
 import string # String tools
-import nltk # For tokenizing
 import subprocess # For subprocessing MAFFT
 import re # Regular expressions
-from Bio import AlignIO
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
-from Bio import SeqIO
-from Bio.Align import AlignInfo
+import time # Alignment latency
+import asyncio # Concurrent MAFFT subprocesses
+from metrics_tools import metrics, Progress # Instrumentation
 
 mafft = "/usr/local/bin/mafft"
 
+# MAFFT options for each alignment strategy ('centerstar' is aligned in-process and never calls MAFFT)
+MAFFT_STRATEGIES = {"linsi": ['--localpair', '--maxiterate', '1000'], # L-INS-i: most accurate, slowest
+                    "fftns2": ['--retree', '2', '--maxiterate', '0']} # FFT-NS-2: fast progressive alignment
+ALIGN_STRATEGIES = ["auto", "centerstar"] + list(MAFFT_STRATEGIES)
+
+# Thresholds used by the 'auto' strategy (see choose_align_strategy)
+ALIGN_THRESHOLDS = {"centerstar_max_variants": 3, # up to this many variants: built-in center-star aligner
+                    "fast_max_divergence": 0.2} # variants at most this far apart: FFT-NS-2, otherwise L-INS-i
+
 def create_variant_dict(accession, field, data):
     ''' Creates a dictionary from different transcriptions
 
@@ -58,13 +65,76 @@ def create_variant_dict(accession, field, data):
 
     return entry_id
 
+class VariantGroups:
+    ''' Replicate transcriptions grouped by accession, without building a list per accession
+
+        The accessions are factorized in order of first appearance and the rows stably sorted by accession
+        once; offsets[i]:offsets[i + 1] are then the sorted positions of the i-th accession's replicates.
+        A field's variants are handed out as slices (views) of a single sorted array of that field
+    '''
+    def __init__(self, data, accession):
+        ''' Arguments:
+            data        -- pandas.core.frame.Dataframe object, must contain the accession column
+            accession   -- string, unique ID field
+        '''
+        if not isinstance(data, pd.DataFrame):
+            raise Exception("Data must be a pandas.core.frame.DataFrame object")
+        if accession not in list(data.columns):
+            raise Exception("Accession field not found in data object")
+
+        codes, self.keys = pd.factorize(data[accession], sort = False, use_na_sentinel = False)
+        self.order = np.argsort(codes, kind = "stable")
+        self.offsets = np.zeros(len(self.keys) + 1, dtype = np.int64)
+        np.cumsum(np.bincount(codes, minlength = len(self.keys)), out = self.offsets[1:])
+        self.accession = accession
+        self.data = data
+
+    def __len__(self):
+        return len(self.keys)
+
+    def values(self, field):
+        ''' All values of a field, sorted by accession (a new array; it is not kept by the groups) '''
+        if field not in list(self.data.columns):
+            raise Exception("Target field not found in data object")
+        return self.data[field].to_numpy()[self.order]
+
+    def items(self, field):
+        ''' Yields (accession, variants) pairs in order of first appearance; variants is a NumPy view '''
+        values = self.values(field)
+        offsets = self.offsets
+        for i, k in enumerate(self.keys):
+            yield k, values[offsets[i]:offsets[i + 1]]
+
+    def split(self, n):
+        ''' Splits the accessions into up to n chunks of consecutive accessions, so the chunks can be resolved
+            separately and their results concatenated in order. Each chunk is a VariantGroups sharing the data
+            and sorted row order of these groups, over its own range of accessions: no rows are copied '''
+        bounds = np.linspace(0, len(self.keys), max(1, min(n, len(self.keys))) + 1).astype(np.int64)
+        chunks = []
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            chunk = copy.copy(self)
+            chunk.keys = self.keys[a:b]
+            chunk.order = self.order[self.offsets[a]:self.offsets[b]] # a view
+            chunk.offsets = self.offsets[a:b + 1] - self.offsets[a]
+            chunks.append(chunk)
+        return chunks
+
+def variant_groups(accession, data):
+    ''' VariantGroups of data by accession; data may already be a VariantGroups (e.g. shared by every field
+        resolved by transcriptResolver), in which case it is returned as is '''
+    if isinstance(data, VariantGroups):
+        if data.accession != accession:
+            raise Exception("Variant groups were built on " + data.accession + ", not " + accession)
+        return data
+    return VariantGroups(data, accession)
+
 def best_transcript(accession,  field, data, method):
     ''' Selects the best variant based on its similarity to other variants
         
         Arguments:
         accession   -- string, define unique ID field
         field       -- string, define target field to resolve,
-        data        -- pandas.core.frame.Dataframe object,
+        data        -- pandas.core.frame.Dataframe object (or VariantGroups),
                     must contain specified accession and field columns
         method      -- either fuzzy string matching ('fuzzy')
                     or Levenshtein ('distance') method,
@@ -78,15 +148,18 @@ def best_transcript(accession,  field, data, method):
     if method not in ["fuzzy", "distance"]:
         raise Exception("Method argument not recognized. Must be either 'fuzzy' or 'distance'")
 
-    # Generate dictionary of accessions paired with list of field entries
-    entry_id = create_variant_dict(accession, field, data)
+    from fuzzywuzzy import fuzz # Fuzzy string matching
+    from Levenshtein import distance # Levenshtein distance
+
+    # Group the field entries by accession
+    groups = variant_groups(accession, data)
 
     # Reconcile entries
     if method == "fuzzy":
         # Create a new dictionary to hold results
         entry_fuzzy_results = defaultdict(list)
         entry_pairs = defaultdict(list)
-        for k, v in entry_id.items():
+        for k, v in groups.items(field):
             pairs = []
             for pair in it.combinations(v, 2):
                 # pair = map(str.lower, pair)
@@ -112,7 +185,7 @@ def best_transcript(accession,  field, data, method):
         entry_dist_results = defaultdict(list)
         entry_pairs = defaultdict(list)
         # For each specimen:
-        for k, v in entry_id.items():
+        for k, v in groups.items(field):
             pairs = []
             for pair in it.combinations(v, 2):
                 # pair = map(str.lower, pair)
@@ -136,98 +209,230 @@ def best_transcript(accession,  field, data, method):
                         
         return pd.DataFrame({str(accession): acc_id, str(field): entry_est})
 
-def token_align(x, wdir, consensus_method):
-    ''' Implements a sequence alignment and consensus finding on tokenized strings
+def encode_tokens(x):
+    ''' Tokenizes strings on white space and encodes every unique token as an integer ID
 
         Arguments:
         x       -- List of strings
 
         Returns:
-        Consensus string
+        a tuple of 2 lists - the token ID sequence of each string, and the tokens indexed by their ID
+    '''
+    token_id = dict()
+    vocabulary = []
+    encoded = []
+    for entry in x:
+        ids = []
+        for token in entry.split():
+            if token not in token_id:
+                token_id[token] = len(vocabulary)
+                vocabulary.append(token)
+            ids.append(token_id[token])
+        encoded.append(ids)
+    return encoded, vocabulary
+
+def pairwise_align(a, b):
+    ''' Global alignment (unit cost edit distance) of two sequences of hashable items
 
+        Arguments:
+        a, b    -- sequences (e.g., lists of token IDs or strings)
+
+        Returns:
+        a tuple (aligned a, aligned b, distance), where the aligned sequences are lists padded with None as gaps
     '''
-    if consensus_method not in ["dumb", "dumber"]:
-        raise Exception("Consensus method not recognized. Must be either 'dumb' or 'dumber'")
+    n, m = len(a), len(b)
+    cost = [list(range(m + 1))]
+    for i in range(1, n + 1):
+        row = [i] + [0] * m
+        prev = cost[i - 1]
+        ai = a[i - 1]
+        for j in range(1, m + 1):
+            row[j] = min(prev[j - 1] + (ai != b[j - 1]), prev[j] + 1, row[j - 1] + 1)
+        cost.append(row)
+
+    # Traceback, preferring matches/substitutions over gaps
+    aligned_a, aligned_b = [], []
+    i, j = n, m
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and cost[i][j] == cost[i - 1][j - 1] + (a[i - 1] != b[j - 1]):
+            aligned_a.append(a[i - 1])
+            aligned_b.append(b[j - 1])
+            i, j = i - 1, j - 1
+        elif i > 0 and cost[i][j] == cost[i - 1][j] + 1:
+            aligned_a.append(a[i - 1])
+            aligned_b.append(None)
+            i -= 1
+        else:
+            aligned_a.append(None)
+            aligned_b.append(b[j - 1])
+            j -= 1
 
-    
-    # Concatenate strings and tokenize 
-    regexptoken = nltk.RegexpTokenizer(pattern = '\s+', gaps = True)                           
-    y = string.join(x)
-    tokens = regexptoken.tokenize(y)
-    # tokens = nltk.word_tokenize(y) #word_tokenize assumes you are a sentence, so any ultimate periods are tokenize separately
-
-    # Find unique tokens
-    unique_tokens = []
-    for token in tokens:
-        if token not in unique_tokens:
-            unique_tokens.append(token)
-            
-    # Create a dictionary of tokens
-    unique_token_id = dict()
-    index = 0
-    for unique_token in unique_tokens:
-        unique_token_id[unique_token] = string.ascii_letters[index]
-        index += 1
-
-    # Convert strings into token IDs
-    entry_token_strings = []
-    for entry in x:
-        entry_tokens = regexptoken.tokenize(entry) #nltk.word_tokenize(entry)
-        entry_token_string = ""
-        for token in entry_tokens:
-            #print token
-            entry_token_string += unique_token_id[token]
-            #print entry_token_string
-        entry_token_strings.append(entry_token_string)
-
-    # Convert strings into SeqRecord objects
-    entry_token_strings = [Seq(token) for token in entry_token_strings]
-    temp = [SeqRecord(entry_token_string, id = str(acc)) for acc, entry_token_string in enumerate(entry_token_strings)]
-
-    # Write a fasta file from the list of 
-    temp_file = os.path.join(wdir, "temp.fasta")
-    SeqIO.write(temp, temp_file, "fasta")
-
-    # Align using alignment algorithm MAFFT
-    res = subprocess.check_output([mafft, '--text','--localpair','--maxiterate','1000',temp_file])
-    res = res.decode("utf-8")
-
-    # Export results into working dir
-    out_file = os.path.join(wdir, "temp_align.fasta")  # create alignment file name
-
-    f = open(out_file, 'wb')
-    f.write(bytes(res, "UTF-8"))
-    f.close()
-
-    # Import alignment
-    alignres = AlignIO.read(out_file, "fasta")
-    summary_align = AlignInfo.SummaryInfo(alignres)
+    return aligned_a[::-1], aligned_b[::-1], cost[n][m]
 
-    # Determine consensus
-    consensus = alignment_consensus(summary_align, method = consensus_method)
+def merge_center_star(center, pairs):
+    ''' Merges pairwise alignments against a common center sequence into a multiple alignment
 
-    # Reinterpret consensus
-    inv_unique_token_id = {v:k for k, v in unique_token_id.items()}
-    consensus = [inv_unique_token_id[token] for token in consensus]
-    consensus = string.join(consensus, sep = " ")
+        Arguments:
+        center  -- the center sequence
+        pairs   -- list of (aligned center, aligned other) tuples, one per non-center sequence,
+                   with None as the gap item
 
-    # Remove temporary file
-    os.remove(out_file)
-    os.remove(temp_file)
-    
-    return str(consensus)
+        Returns:
+        List of aligned rows (lists of equal length, None as gaps); the center row comes first
+    '''
+    # Count insertions (relative to the center) before each center position; slot len(center) is the tail
+    slots = len(center) + 1
+    insertions = []
+    for aligned_center, aligned_other in pairs:
+        inserted = [[] for i in range(slots)]
+        matched = [None] * len(center)
+        pos = 0
+        for c, o in zip(aligned_center, aligned_other):
+            if c is None:
+                inserted[pos].append(o)
+            else:
+                matched[pos] = o
+                pos += 1
+        insertions.append((inserted, matched))
+
+    widths = [max([len(inserted[slot]) for inserted, matched in insertions] + [0]) for slot in range(slots)]
+
+    rows = []
+    center_row = []
+    for slot in range(slots):
+        center_row.extend([None] * widths[slot])
+        if slot < len(center):
+            center_row.append(center[slot])
+    rows.append(center_row)
+
+    for inserted, matched in insertions:
+        row = []
+        for slot in range(slots):
+            row.extend(inserted[slot] + [None] * (widths[slot] - len(inserted[slot])))
+            if slot < len(center):
+                row.append(matched[slot])
+        rows.append(row)
+    return rows
+
+def levenshtein_align(a, b):
+    ''' Pairwise alignment of two strings from the edit operations of the Levenshtein C extension
 
+        Returns:
+        a tuple of (aligned a, aligned b, edit distance), the aligned sequences being lists of
+        characters with None as the gap item
+    '''
+    from Levenshtein import opcodes
+
+    aligned_a, aligned_b = [], []
+    distance = 0
+    for op, i1, i2, j1, j2 in opcodes(a, b):
+        if op != "equal":
+            distance += max(i2 - i1, j2 - j1)
+        # Pair characters up where both strings have them, then pad the longer block with gaps
+        width = max(i2 - i1, j2 - j1)
+        aligned_a.extend(list(a[i1:i2]) + [None] * (width - (i2 - i1)))
+        aligned_b.extend(list(b[j1:j2]) + [None] * (width - (j2 - j1)))
+    return aligned_a, aligned_b, distance
+
+def center_star_align(seqs, align = pairwise_align, distance = None):
+    ''' Center-star multiple alignment: the sequence with the smallest summed distance to all others
+        is chosen as the center and every other sequence is aligned to it
+
+        Arguments:
+        seqs        -- list of sequences
+        align       -- pairwise aligner returning (aligned a, aligned b, distance)
+        distance    -- optional function returning the distance of two sequences, used to pick the center
+                       without aligning every pair; by default all pairs are aligned with `align`
+
+        Returns:
+        List of aligned rows in the order of seqs (None as gaps)
+    '''
+    if len(seqs) == 1:
+        return [list(seqs[0])]
+
+    n = len(seqs)
+    alignments = dict()
+    totals = [0] * n
+    for i, j in it.combinations(range(n), 2):
+        if distance is None:
+            alignments[(i, j)] = align(seqs[i], seqs[j])
+            d = alignments[(i, j)][2]
+        else:
+            d = distance(seqs[i], seqs[j])
+        totals[i] += d
+        totals[j] += d
+    center = totals.index(min(totals))
+
+    others = [i for i in range(n) if i != center]
+    pairs = []
+    for i in others:
+        if (center, i) in alignments:
+            aligned_center, aligned_other, d = alignments[(center, i)]
+        elif (i, center) in alignments:
+            aligned_other, aligned_center, d = alignments[(i, center)]
+        else:
+            aligned_center, aligned_other, d = align(seqs[center], seqs[i])
+        pairs.append((aligned_center, aligned_other))
+
+    merged = merge_center_star(seqs[center], pairs)
+    rows = [None] * n
+    rows[center] = merged[0]
+    for i, row in zip(others, merged[1:]):
+        rows[i] = row
+    return rows
+
+def column_consensus(rows, threshold = 0.5):
+    ''' Majority consensus over the columns of an alignment of item sequences (None as gaps)
+
+        A column contributes its most frequent item if it occurs in at least `threshold` of the rows;
+        otherwise the column is dropped. Ties go to the item of the first row, as in vote_count
+
+        Returns:
+        List of consensus items
+    '''
+    consensus = []
+    for column in zip(*rows):
+        counts = defaultdict(int) # in order of first appearance
+        for item in column:
+            if item is not None:
+                counts[item] += 1
+        if len(counts) == 0:
+            continue
+        max_size = max(counts.values())
+        max_items = [item for item, count in counts.items() if count == max_size]
+        if float(max_size) / len(rows) >= threshold:
+            consensus.append(max_items[0])
+    return consensus
+
+def token_align(x, wdir = None, consensus_method = "dumber"):
+    ''' Implements a sequence alignment and consensus finding on tokenized strings
+
+        Tokens are encoded as integer IDs, so the vocabulary size is unbounded, and the ID sequences
+        are aligned with a built-in center-star aligner (no MAFFT call)
+
+        Arguments:
+        x                   -- List of strings
+        wdir                -- unused, kept for compatibility with character_align
+        consensus_method    -- 'dumb' or 'dumber'; both use a 0.5 majority threshold per token column
+
+        Returns:
+        Consensus string
 
-def character_align(x, wdir, consensus_method):
-    ''' x   -- list of strings
-    
-        Returns: Single string
     '''
     if consensus_method not in ["dumb", "dumber"]:
         raise Exception("Consensus method not recognized. Must be either 'dumb' or 'dumber'")
 
-    
-    # Placeholder characters (= * < > ( ) not allowed in mafft)
+    start = time.perf_counter()
+    encoded, vocabulary = encode_tokens(x)
+    rows = center_star_align(encoded)
+    consensus = column_consensus(rows, threshold = 0.5)
+    metrics.observe("align.token", time.perf_counter() - start)
+
+    return " ".join(vocabulary[token] for token in consensus)
+
+
+def character_placeholders(x):
+    ''' Replaces characters MAFFT cannot handle (= * < > ( ) and white space) with placeholders '''
     y = [re.sub("\s", "_", string) for string in x] # convert spaces into underscores
     y = [re.sub("=", "", string) for string in y]
     y = [re.sub("<", "", string) for string in y]
@@ -236,26 +441,74 @@ def character_align(x, wdir, consensus_method):
     y = [re.sub("\.", "%", string) for string in y]
     y = [re.sub("\(", "[", string) for string in y]
     y = [re.sub("\)", "]", string) for string in y]
-    
-    # Convert string into SeqRecord objects
-    temp = [Seq(string, "alphabet") for string in y]
-    temp = [SeqRecord(string, id = str(acc)) for acc, string in enumerate(temp)]
-    temp_file = os.path.join(wdir, "temp.fasta")
-    SeqIO.write(temp, temp_file, "fasta")
+    return y
+
+def to_fasta(y):
+    ''' FASTA text of a list of strings, with their list index as record id '''
+    return "".join(">%d\n%s\n" % (i, string) for i, string in enumerate(y))
+
+def parse_fasta(text):
+    ''' Parses MAFFT output into the list of aligned strings, in the order of their record ids '''
+    records = []
+    for line in text.splitlines():
+        if line.startswith(">"):
+            records.append([int(line[1:].split()[0]), []])
+        elif len(records) > 0:
+            records[-1][1].append(line.strip())
+    return ["".join(seq) for rec_id, seq in sorted(records)]
+
+def mafft_command(strategy = "linsi"):
+    ''' MAFFT command line for text alignment, reading the sequences from stdin '''
+    return [mafft, '--text'] + MAFFT_STRATEGIES[strategy] + ['-']
+
+def choose_align_strategy(x, thresholds = None):
+    ''' Picks the cheapest alignment strategy expected to align the variants well
+
+        - 'centerstar' for a handful of variants (built-in aligner, no MAFFT call)
+        - 'fftns2' when every variant is close to the first one, so the fast mode finds the same alignment
+        - 'linsi' for the remaining, divergent (hard) cases
+
+        Arguments:
+        x           -- list of strings
+        thresholds  -- dictionary overriding keys of ALIGN_THRESHOLDS
+
+        Returns:
+        strategy name
+    '''
+    from Levenshtein import ratio
 
-    # Subprocessing MAFFT
-    res = subprocess.check_output([mafft, '--text','--localpair','--maxiterate','1000', temp_file])
-    res = res.decode("utf-8")
+    limits = dict(ALIGN_THRESHOLDS)
+    if thresholds:
+        limits.update(thresholds)
 
-    # Export results into working dir
-    out_file = os.path.join(wdir, "temp_align.fasta")  # create alignment file name
+    if len(x) <= limits["centerstar_max_variants"]:
+        return "centerstar"
+    divergence = max(1 - ratio(x[0], other) for other in x[1:])
+    if divergence <= limits["fast_max_divergence"]:
+        return "fftns2"
+    return "linsi"
 
-    f = open(out_file, 'wb')
-    f.write(bytes(res, "UTF-8"))
-    f.close()
+def centerstar_character_align(y):
+    ''' Aligns placeholder-encoded strings in-process, without MAFFT
 
-    # Import alignment
-    alignres = AlignIO.read(out_file, "fasta")
+        The center is the string with the fewest summed Levenshtein distances to the others, and every
+        other string is aligned to it from the Levenshtein edit operations (see levenshtein_align)
+
+        Returns:
+        List of aligned strings with '-' as gaps
+    '''
+    from Levenshtein import distance
+
+    rows = center_star_align(y, align = levenshtein_align, distance = distance)
+    return ["".join("-" if char is None else char for char in row) for row in rows]
+
+def character_consensus(aligned, consensus_method):
+    ''' Consensus string of a character alignment (list of aligned, placeholder-encoded strings) '''
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
+    from Bio.Align import MultipleSeqAlignment, AlignInfo
+
+    alignres = MultipleSeqAlignment([SeqRecord(Seq(string), id = str(acc)) for acc, string in enumerate(aligned)])
     summary_align = AlignInfo.SummaryInfo(alignres)
 
     # Determine consensus
@@ -269,13 +522,138 @@ def character_align(x, wdir, consensus_method):
     consensus = re.sub("%", ".", str(consensus))
     consensus = re.sub("\[", "(", str(consensus))
     consensus = re.sub("\]", ")", str(consensus))
+    return consensus
 
-    # Remove temporary file
-    os.remove(out_file)
-    os.remove(temp_file)
+def character_align(x, wdir, consensus_method, align_strategy = "linsi", thresholds = None):
+    ''' x               -- list of strings
+        align_strategy  -- 'linsi', 'fftns2', 'centerstar' or 'auto' (see choose_align_strategy)
+    
+        Returns: Single string
+    '''
+    if consensus_method not in ["dumb", "dumber"]:
+        raise Exception("Consensus method not recognized. Must be either 'dumb' or 'dumber'")
 
-    # Return
-    return consensus
+    # Placeholder characters (= * < > ( ) not allowed in mafft)
+    y = character_placeholders(x)
+
+    if align_strategy == "auto":
+        align_strategy = choose_align_strategy(y, thresholds)
+    metrics.incr("align.strategy." + align_strategy)
+
+    start = time.perf_counter()
+    if align_strategy == "centerstar":
+        aligned = centerstar_character_align(y)
+    else:
+        # Subprocessing MAFFT, feeding the sequences through a pipe
+        res = subprocess.check_output(mafft_command(align_strategy), input = to_fasta(y).encode("utf-8"))
+        aligned = parse_fasta(res.decode("utf-8"))
+        metrics.incr("mafft.calls")
+    metrics.observe("align.character", time.perf_counter() - start)
+
+    return character_consensus(aligned, consensus_method)
+
+async def mafft_align_async(y, timeout = None, retries = 1, strategy = "linsi"):
+    ''' Aligns a list of placeholder-encoded strings with a MAFFT subprocess, without blocking the event loop
+
+        Arguments:
+        y       -- list of strings
+        timeout -- seconds before a MAFFT job is killed (None for no limit)
+        retries -- number of further attempts after a failed or timed out job
+        strategy -- key of MAFFT_STRATEGIES
+
+        Returns:
+        List of aligned strings; raises an Exception if every attempt failed
+    '''
+    fasta = to_fasta(y).encode("utf-8")
+    error = ""
+    for attempt in range(retries + 1):
+        start = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(*mafft_command(strategy), stdin = asyncio.subprocess.PIPE,
+                                                    stdout = asyncio.subprocess.PIPE, stderr = asyncio.subprocess.PIPE)
+        metrics.incr("mafft.calls")
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(fasta), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            metrics.incr("mafft.timeouts")
+            error = "timed out after %s seconds" % timeout
+            continue
+
+        metrics.observe("align.character", time.perf_counter() - start)
+        if proc.returncode == 0:
+            return parse_fasta(out.decode("utf-8"))
+        metrics.incr("mafft.errors")
+        error = "exit status %d: %s" % (proc.returncode, err.decode("utf-8", "replace").strip()[-200:])
+
+    raise Exception(error)
+
+def align_accessions(jobs, consensus_method, max_jobs = 1, timeout = None, retries = 1, progress = None,
+                     align_strategy = "linsi", thresholds = None, on_result = None):
+    ''' Runs MAFFT character alignments for many accessions, keeping up to max_jobs subprocesses in flight
+
+        Each consensus is computed as soon as its alignment completes. A failed accession is logged and
+        reported instead of aborting the run
+
+        Arguments:
+        jobs                -- list of (accession, list of strings) tuples
+        consensus_method    -- 'dumb' or 'dumber'
+        max_jobs            -- maximum number of concurrent MAFFT processes
+        timeout, retries    -- see mafft_align_async
+        progress            -- optional metrics_tools.Progress, updated per completed accession
+        align_strategy      -- 'linsi', 'fftns2', 'centerstar' or 'auto' (chosen per accession)
+        thresholds          -- dictionary overriding keys of ALIGN_THRESHOLDS for 'auto'
+        on_result           -- optional function called with (accession, consensus) as each alignment completes
+
+        Returns:
+        a tuple of 2 dictionaries - accession -> consensus, and accession -> error message for failures
+    '''
+    results = dict()
+    failures = dict()
+
+    async def worker(queue):
+        while True:
+            try:
+                k, v = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                y = character_placeholders(v)
+                strategy = choose_align_strategy(y, thresholds) if align_strategy == "auto" else align_strategy
+                metrics.incr("align.strategy." + strategy)
+                if strategy == "centerstar":
+                    start = time.perf_counter()
+                    aligned = centerstar_character_align(y)
+                    metrics.observe("align.character", time.perf_counter() - start)
+                else:
+                    aligned = await mafft_align_async(y, timeout, retries, strategy)
+                results[k] = character_consensus(aligned, consensus_method)
+                if on_result is not None:
+                    on_result(k, results[k])
+            except Exception as e:
+                failures[k] = str(e)
+                metrics.incr("mafft.failures")
+                print("\nAlignment failed for accession", k, "-", failures[k])
+            if progress is not None:
+                progress.update()
+
+    async def run():
+        queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+        await asyncio.gather(*[worker(queue) for i in range(max(1, max_jobs))])
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(run())
+    else:
+        # Called from a running event loop (e.g. a notebook or an async server), which asyncio.run cannot
+        # nest in: the alignments get their own loop in a worker thread
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers = 1) as pool:
+            pool.submit(asyncio.run, run()).result()
+    return results, failures
 
 def alignment_consensus(alignment, method):
 
@@ -295,75 +673,193 @@ def alignment_consensus(alignment, method):
 
     return consensus
 
-def variant_consensus(accession, field, data, align_method, consensus_method, wdir):
+def variant_consensus(accession, field, data, align_method, consensus_method, wdir,
+                      workers = 1, mafft_timeout = None, mafft_retries = 1,
+                      align_strategy = "linsi", align_thresholds = None, checkpoint = None, cache = None,
+                      outlier_threshold = None, verbose = True):
+    ''' Finds the consensus of the replicate transcriptions of every accession by sequence alignment
+
+        Arguments:
+        accession           -- string, define unique ID field
+        field               -- string, define target field to resolve
+        data                -- pandas.core.frame.Dataframe object (or VariantGroups)
+        align_method        -- 'character' (MAFFT) or 'token' (built-in token aligner)
+        consensus_method    -- 'dumb' or 'dumber'
+        wdir                -- working directory
+        workers             -- maximum number of concurrent MAFFT processes (character alignment)
+        mafft_timeout       -- seconds before a MAFFT job is killed (None for no limit)
+        mafft_retries       -- further attempts for a failed MAFFT job; accessions that still fail
+                               are logged and given an empty consensus
+        align_strategy      -- character alignment strategy: 'linsi' (MAFFT L-INS-i), 'fftns2' (MAFFT FFT-NS-2),
+                               'centerstar' (built-in center-star aligner) or 'auto' (chosen per accession by choose_align_strategy)
+        align_thresholds    -- dictionary overriding keys of ALIGN_THRESHOLDS for 'auto'
+        checkpoint          -- optional checkpoint_tools.Checkpoint; aligned accessions are recorded as they
+                               complete, and accessions it already holds for this field are not aligned again
+        cache               -- optional dictionary of earlier consensus results, keyed by the alignment settings and
+                               the variants; looked up before and filled in after every alignment
+        outlier_threshold   -- optional float between 0 and 1; variants whose mean MinHash similarity to the other
+                               variants of the accession is below it are dropped before alignment
+                               (see minhash_tools.filter_outliers) and listed in an extra <field>_dropped column
+        verbose             -- print what is being resolved and a progress line (False when the caller reports
+                               the progress, e.g. of chunks resolved on worker threads)
+
+        Returns:
+        a pandas.core.frame.Dataframe object
+    '''
     if align_method not in ["character", "token"]:
-        raise Exception("Alignment method not recognized. Must be either 'fuzzy' or 'distance'")
+        raise Exception("Alignment method not recognized. Must be either 'character' or 'token'")
 
     if consensus_method not in ["dumb", "dumber"]:
         raise Exception("Consensus method not recognized. Must be either 'dumb' or 'dumber'")
 
+    if align_strategy not in ALIGN_STRATEGIES:
+        raise Exception("Alignment strategy not recognized. Must be one of: " + ", ".join(ALIGN_STRATEGIES))
     
-    entry_id = create_variant_dict(accession, field, data)
+    groups = variant_groups(accession, data)
+    if outlier_threshold is not None:
+        from minhash_tools import filter_outliers
 
-    print("\nImplementing consensus procedure on", field, "field, using", align_method, "alignment method and", consensus_method, "consensus method")
+    if verbose:
+        print("\nImplementing consensus procedure on", field, "field, using", align_method, "alignment method and", consensus_method, "consensus method")
 
     # Find consensus in NfN data
     entry_results = defaultdict(list)
-    for k,v in entry_id.items():
-        print("Reconciling transcriptions for", k)
+    dropped_results = dict()
+    character_jobs = []
+    completed = checkpoint.completed(field) if checkpoint is not None else dict()
+    record = (lambda k, consensus: checkpoint.record(field, str(k), consensus)) if checkpoint is not None else None
+    settings = (align_method, consensus_method, align_strategy, str(align_thresholds))
+    progress = Progress(len(groups), "Reconciling " + field, quiet = not verbose)
+    for k,v in groups.items(field):
+        # Drop junk variants (far from the rest) before they reach the alignment
+        if outlier_threshold is not None and len(set(v)) > 1:
+            v, dropped = filter_outliers(v, outlier_threshold)
+            if len(dropped) > 0:
+                dropped_results[k] = "|".join(dropped)
+                metrics.incr("consensus.outliers_dropped", len(dropped))
+
+        # Resolved by an earlier, interrupted run
+        if str(k) in completed:
+            entry_results[k].append(completed[str(k)])
+            metrics.incr("consensus.resumed")
 
         # If entries are identical, then entry is consensus
-        if len(set(v)) == 1:
+        elif len(set(v)) == 1:
             entry_results[k].append(v[0])
+            metrics.incr("consensus.fast_path.identical")
 
         # If all entries are one character in length or below, then consensus is probably nothing
         elif sum([len(i) < 2 for i in v]) == len(v):
             entry_results[k].append("")
+            metrics.incr("consensus.fast_path.short")
+
+        # Same variants already aligned with the same settings
+        elif cache is not None and (settings, tuple(v)) in cache:
+            entry_results[k].append(cache[(settings, tuple(v))])
+            metrics.incr("consensus.cached")
 
         # If entries are not identical, use consensus
         else:
+            metrics.incr("consensus.aligned")
             if align_method == "character":
-                entry_results[k].append(character_align(v, wdir, consensus_method))
+                entry_results[k] # keeps the output in accession order; filled in once aligned
+                character_jobs.append((k, v))
+                continue
             elif align_method == "token":
                 entry_results[k].append(token_align(v, wdir, consensus_method))
+                if cache is not None:
+                    cache[(settings, tuple(v))] = entry_results[k][0]
+                if record is not None:
+                    record(k, entry_results[k][0])
+        progress.update()
+
+    # Character alignments run as concurrent MAFFT subprocesses
+    if len(character_jobs) > 0:
+        aligned, failures = align_accessions(character_jobs, consensus_method, max_jobs = workers,
+                                             timeout = mafft_timeout, retries = mafft_retries, progress = progress,
+                                             align_strategy = align_strategy, thresholds = align_thresholds,
+                                             on_result = record)
+        for k, v in character_jobs:
+            entry_results[k].append(aligned.get(k, ""))
+            if cache is not None and k in aligned:
+                cache[(settings, tuple(v))] = aligned[k]
+        if len(failures) > 0:
+            print("\n" + str(len(failures)), "accessions could not be aligned and were left empty")
+    progress.close()
+    if checkpoint is not None:
+        checkpoint.flush()
 
     # Convert results into dataframe
     est = [str(est[0]) for est in entry_results.values()] # Necessary to index 0 and default dict values are lists
     acc = [str(acc) for acc in entry_results.keys()]
     results = pd.DataFrame({str(accession):acc, str(field):est})
+    if outlier_threshold is not None:
+        results[str(field) + "_dropped"] = [dropped_results.get(k, "") for k in entry_results.keys()]
 
     # Export
     return results
 
-def vote_count(accession, field, data):
+def vote_count(accession, field, data, verbose = True):
 
     ''' Uses a vote counting procedure for selecting the best. For fields with discrete states.
+        Ties go to the value transcribed first (in the order of the rows of the accession)
         
         Arguments:
         accession   -- string, define unique ID field
         field       -- string, define target field to resolve,
-        data        -- pandas.core.frame.Dataframe object,
+        data        -- pandas.core.frame.Dataframe object (or VariantGroups),
                     must contain specified accession and field columns
+        verbose     -- print what is being resolved and a progress line (see variant_consensus)
 
         Returns:
         a pandas.core.frame.Dataframe object
     '''
-    print("Implementing vote-counting procedure on", field, "field.")
-    entry_id = create_variant_dict(accession, field, data)
+    if verbose:
+        print("Implementing vote-counting procedure on", field, "field.")
+    groups = variant_groups(accession, data)
+    if field in list(groups.data.columns) and isinstance(groups.data[field].dtype, pd.CategoricalDtype):
+        return categorical_vote_count(groups, field)
 
     entry_results = defaultdict(list)
-    for k,v in entry_id.items():
-        print("Reconciling transcriptions for", k)
-        count_vote = [v.count(i) for i in set(v)]
-        max_vote = list(set(v))[count_vote.index(max(count_vote))]
+    progress = Progress(len(groups), "Reconciling " + field, quiet = not verbose)
+    for k,v in groups.items(field):
+        progress.update()
+        states = list(dict.fromkeys(v)) # in order of first appearance, so ties go to the value transcribed first
+        count_vote = [int((v == i).sum()) for i in states]
+        max_vote = states[count_vote.index(max(count_vote))]
         entry_results[k].append(max_vote)
 
+    progress.close()
+
     vote = [str(v[0]) for v in entry_results.values()]
     key = [str(k) for k in entry_results.keys()]
     results = pd.DataFrame({str(accession):key, str(field):vote})
     return results
 
 
+def categorical_vote_count(groups, field):
+    ''' vote_count on a categorical column: the votes of every accession are counted at once on the
+        integer codes. As in vote_count, ties go to the value transcribed first, so the result does not
+        depend on the order of the categories '''
+    column = groups.data[field]
+    categories = column.cat.categories
+    size = len(categories) + 1
+    codes = column.cat.codes.to_numpy().astype(np.int64)[groups.order] + 1 # 0 is a missing value
+    group = np.repeat(np.arange(len(groups), dtype = np.int64), np.diff(groups.offsets))
+
+    # The rows are sorted by accession and, within one, in their original order, so the first index of a
+    # (accession, value) pair is where that value was first transcribed
+    pairs, first_seen, counts = np.unique(group * size + codes, return_index = True, return_counts = True)
+    group, codes = pairs // size, pairs % size
+    best = np.lexsort((first_seen, -counts, group)) # by accession, then most votes, then first transcribed
+    first = best[np.r_[True, group[best][1:] != group[best][:-1]]]
+
+    states = np.array([""] + list(categories), dtype = object)
+    key = [str(k) for k in groups.keys]
+    vote = [str(v) for v in states[codes[first]]]
+    return pd.DataFrame({str(groups.accession): key, str(field): vote})
+
+
 def dumber_consensus(self, threshold, ambiguous = ""):
         # find the length of the consensus we are creating
         con_len = self.alignment.get_alignment_length()
@@ -424,18 +920,18 @@ def metadata_handling(accession, field, data, delim = "|"):
         Arguments:
         accession   -- string, define unique ID field
         field       -- string, define target field to resolve,
-        data        -- pandas.core.frame.Dataframe object,
+        data        -- pandas.core.frame.Dataframe object (or VariantGroups),
                     must contain specified accession and field columns
 
         Returns:
         a pandas.core.frame.Dataframe object
     '''
     
-    # Create a dictionary of accession keys to metadata values
-    entry_id = create_variant_dict(accession, field, data)
+    # Group the metadata values by accession
+    groups = variant_groups(accession, data)
     entry_results = defaultdict(list)
 
-    for k,v in entry_id.items():
+    for k,v in groups.items(field):
         entry_results[k].append(delim.join(v)) #[j for j in set(v)[0]] this was for picking just 1
    
     key = [str(k) for k in entry_results.keys()]
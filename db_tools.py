@@ -0,0 +1,98 @@
+## DB TOOLS
+# Description: Pooled, retrying connections to the essig database, or to a local SQLite stand-in
+#
+# Notes:
+# Connections are opened on first use and kept in a pool keyed by their settings, so the prepare and clean
+# stages of a run (or every request of resolverService) share one connection per database. A query that fails
+# (e.g. the server dropped an idle connection) is retried on a fresh connection with exponential backoff.
+# The SQLite stand-in holds the two tables the pipeline reads (eme.bnhm_id and eme_people), for running
+# the pipeline and its benchmarks without access to the essig server
+
+
+## DEPENDENCIES
+import os # Path tools
+import time
+import sqlite3
+import threading
+import pandas as pd # data frame functionality
+
+ESSIG_HOST = "gall.bnhm.berkeley.edu"
+ESSIG_DB = "essig"
+DB_RETRIES = 3
+DB_BACKOFF = 1.0 # seconds before the first retry, doubled for every further retry
+
+_pool = dict() # connection settings -> (connection, lock)
+_pool_lock = threading.Lock()
+
+
+def _connect(username, password, sqlite):
+    if sqlite is not None:
+        # Used from the cleaner's startup threads, one query at a time (see query)
+        return sqlite3.connect(sqlite, check_same_thread = False)
+    import pymysql # only needed for the essig server
+    return pymysql.connect(host = ESSIG_HOST, user = username, passwd = password, db = ESSIG_DB)
+
+
+def get_connection(username = None, password = None, sqlite = None):
+    ''' Pooled connection (and its lock) to the essig database, or to the SQLite file `sqlite` if given '''
+    key = ("sqlite", sqlite) if sqlite is not None else ("mysql", username)
+    with _pool_lock:
+        if key not in _pool:
+            _pool[key] = (_connect(username, password, sqlite), threading.Lock())
+        return _pool[key]
+
+
+def discard_connection(username = None, password = None, sqlite = None):
+    ''' Closes and forgets a pooled connection, so the next query opens a new one '''
+    key = ("sqlite", sqlite) if sqlite is not None else ("mysql", username)
+    with _pool_lock:
+        conn, lock = _pool.pop(key, (None, None))
+    if conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def query(sql, username = None, password = None, sqlite = None, retries = DB_RETRIES, backoff = DB_BACKOFF):
+    ''' Runs a query on a pooled connection, retrying on a new connection if it fails
+
+        Arguments:
+        sql         -- string, query
+        username    -- essig database user
+        password    -- essig database password
+        sqlite      -- path to a SQLite stand-in; used instead of the essig server if given
+        retries     -- further attempts after a failed query
+
+        Returns:
+        a pandas.core.frame.Dataframe object
+    '''
+    for attempt in range(retries + 1):
+        try:
+            conn, lock = get_connection(username, password, sqlite)
+            with lock:
+                return pd.read_sql(sql, con = conn)
+        except Exception as e:
+            discard_connection(username, password, sqlite)
+            if attempt == retries:
+                raise
+            print("\nDatabase query failed (" + str(e) + "); retrying in", backoff * 2 ** attempt, "seconds")
+            time.sleep(backoff * 2 ** attempt)
+
+
+def create_standin(path, people, bnhm_ids):
+    ''' Writes a SQLite stand-in for the essig database
+
+        Arguments:
+        path        -- SQLite file (replaced if it exists)
+        people      -- pandas.core.frame.Dataframe object with the name_full, name_short and collector
+                       columns of eme_people
+        bnhm_ids    -- list of bnhm_ids already databased (the eme table)
+    '''
+    discard_connection(sqlite = path)
+    if os.path.exists(path):
+        os.remove(path) # no tables or data of an earlier stand-in are left behind
+    with sqlite3.connect(path) as conn:
+        people.to_sql("eme_people", conn, if_exists = "replace", index = False)
+        pd.DataFrame({"bnhm_id": list(bnhm_ids)}).to_sql("eme", conn, if_exists = "replace", index = False)
+    conn.close()
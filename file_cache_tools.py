@@ -0,0 +1,83 @@
+## FILE CACHE TOOLS
+# Description: Cache of parsed transcription files, so a file that has not changed since the last run is not
+#              parsed again
+#
+# Notes:
+# The cache directory holds a manifest (manifest.json: path -> size, modification time and SHA-1 of the file)
+# and one pickled data frame per file content and read settings (columns, categorical). A file whose size and
+# modification time match the manifest is taken as unchanged; otherwise its SHA-1 is computed, so a file that
+# was only touched or copied is still found. Frames no longer referenced by the manifest are removed on save
+
+
+## DEPENDENCIES
+import os # Path tools
+import json
+import pickle
+import hashlib
+import threading
+
+MANIFEST = "manifest.json"
+
+
+def file_sha1(path, blocksize = 1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class FileCache:
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock() # files are looked up and stored from concurrent reads
+        self.manifest = dict()
+        path = os.path.join(directory, MANIFEST)
+        if os.path.exists(path):
+            with open(path, encoding = "utf-8") as f:
+                self.manifest = json.load(f)
+
+    def signature(self, path):
+        ''' SHA-1 of a file, taken from the manifest if its size and modification time are unchanged '''
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.manifest.get(os.path.abspath(path))
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return entry["sha1"]
+        sha1 = file_sha1(path)
+        with self.lock:
+            self.manifest[os.path.abspath(path)] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": sha1}
+        return sha1
+
+    def frame_file(self, sha1, settings):
+        key = hashlib.sha1(json.dumps(settings, sort_keys = True).encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.directory, sha1 + "_" + key + ".pkl")
+
+    def load(self, path, settings):
+        ''' Cached data frame of a file read with the given settings (dictionary), or None '''
+        frame_file = self.frame_file(self.signature(path), settings)
+        if not os.path.exists(frame_file):
+            return None
+        with open(frame_file, "rb") as f:
+            return pickle.load(f)
+
+    def store(self, path, settings, data):
+        os.makedirs(self.directory, exist_ok = True)
+        frame_file = self.frame_file(self.signature(path), settings)
+        with open(frame_file + ".tmp", "wb") as f:
+            pickle.dump(data, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(frame_file + ".tmp", frame_file)
+
+    def save(self):
+        ''' Writes the manifest (dropping files that no longer exist) and removes the frames of file contents it
+            no longer lists '''
+        os.makedirs(self.directory, exist_ok = True)
+        self.manifest = {path: entry for path, entry in self.manifest.items() if os.path.exists(path)}
+        current = set(entry["sha1"] for entry in self.manifest.values())
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl") and name.split("_")[0] not in current:
+                os.remove(os.path.join(self.directory, name))
+        tmp = os.path.join(self.directory, MANIFEST + ".tmp")
+        with open(tmp, "w", encoding = "utf-8") as f:
+            json.dump(self.manifest, f, indent = 1)
+        os.replace(tmp, os.path.join(self.directory, MANIFEST))
@@ -0,0 +1,91 @@
+## GEOGRAPHY TOOLS
+# Description: Hierarchical matching of transcribed countries, states/provinces and counties to the essig
+#              reference lists, with an optional fuzzy fallback for misspelled names
+#
+# Notes:
+# Exact matches are looked up as before. With a threshold, a name without an exact match is compared
+# (Levenshtein ratio, as refcheck does for collectors) only with the children of its resolved parent: the
+# countries, the states of the resolved country, the counties of the resolved state. The candidate lists are
+# the per-node indexes of reference_tools.geography_index, and every (name, parent) pair is scored once per
+# run, so a million rows with a few thousand distinct names cost a few thousand lookups
+
+
+## DEPENDENCIES
+from Levenshtein import ratio # Levenshtein ratio, as in refcheck()
+
+
+class GeographyMatcher:
+    def __init__(self, geography, threshold = None):
+        ''' Arguments:
+            geography   -- the geography indexes of a reference snapshot (reference_tools.geography_index)
+            threshold   -- minimum similarity (0 to 1) of a fuzzy match; None only accepts exact matches
+        '''
+        self.geography = geography
+        self.threshold = threshold
+        self.cache = dict()
+
+        # Lower-cased candidates for fuzzy scoring, built once per node
+        self.candidates = {"country": [(key.lower(), key) for key in geography["country"]]}
+        for country, states in geography["states"].items():
+            self.candidates[("state", country)] = self.lower_keys(states)
+        for state, counties in geography["counties"].items():
+            self.candidates[("county", state)] = self.lower_keys(counties)
+
+    @staticmethod
+    def lower_keys(index):
+        return [(key.lower(), value) for key, value in index.items()]
+
+    def fuzzy(self, name, node):
+        ''' Best candidate of a node for a name without an exact match
+
+            Returns:
+            a tuple of the match ("NA" if below the threshold) and its similarity
+        '''
+        candidates = self.candidates.get(node, [])
+        if len(candidates) == 0:
+            return ("NA", "NA")
+        name = name.lower()
+        scores = [ratio(name, key) for key, value in candidates]
+        score = max(scores)
+        match = candidates[scores.index(score)][1] # ties go to the first candidate
+        if score < self.threshold:
+            return ("NA", score)
+        return (match, score)
+
+    def lookup(self, name, exact, node):
+        key = (name, node)
+        if key not in self.cache:
+            if name == "":
+                self.cache[key] = ("NA", "NA")
+            elif exact(name) is not None:
+                self.cache[key] = (exact(name), 1.0)
+            elif self.threshold is None:
+                self.cache[key] = ("NA", 0.0)
+            else:
+                self.cache[key] = self.fuzzy(name, node)
+        return self.cache[key]
+
+    def country(self, name):
+        ''' Returns a tuple of the reference country name (or "NA") and the similarity of the match '''
+        return self.lookup(name, lambda x: x if x in self.geography["country"] else None, "country")
+
+    def state(self, name, country):
+        ''' State or province of a resolved country (United States, Canada or Mexico) '''
+        if country == "United States":
+            # Postal abbreviations take precedence over names
+            exact = lambda x: self.geography["state_abbrev"].get(x, self.geography["state_name"].get(x))
+        elif country == "Canada":
+            exact = self.geography["canada"].get
+        elif country == "Mexico":
+            exact = self.geography["mexico"].get
+        else:
+            return ("", "NA")
+        return self.lookup(name, exact, ("state", country))
+
+    def county(self, name, state):
+        ''' County of a resolved U.S. state. An exact match is accepted from any state, as the exact pass always
+            has; fuzzy candidates only come from the resolved state '''
+        return self.lookup(name, self.geography["county"].get, ("county", state))
+
+    def continent(self, country):
+        return self.geography["country"].get(country, "NA")
@@ -0,0 +1,194 @@
+## IO TOOLS
+# Description: Shared readers for Notes from Nature transcription files
+#
+# Notes:
+# All stages read transcriptions as strings (dtype object) with NaNs converted to empty strings,
+# since the consensus and normalization functions operate on plain strings
+
+
+## DEPENDENCIES
+import os # Path tools
+import glob # -file patterns
+import numpy as np
+import pandas as pd # data frame functionality
+from pandas.api.types import union_categoricals
+
+ENCODING = "ISO-8859-1"
+
+# Columns read by each cleaning step in transcriptClean (after resolution)
+CLEAN_COLUMNS = ["filename", "Collector", "Begin Date Collected", "End Date Collected",
+                 "Country", "State/Province", "County", "subject_id", "id", "Locality"]
+
+# Columns transcriptPrepare needs in addition to those passed on to the resolver
+PREPARE_COLUMNS = ["collection", "filename", "Collector"]
+
+# Volunteer who made each transcription (read when the weighted_vote method is used)
+VOTER_COLUMN = "user_name"
+
+# Low-cardinality columns stored as categoricals (integer codes into one copy of each distinct string)
+# when a file is read with categorical = True
+CATEGORICAL_COLUMNS = ["collection", "Country", "State/Province", "County", "skipped", VOTER_COLUMN]
+
+# Rows per chunk when a file is streamed (see iter_transcripts)
+CHUNK_ROWS = 100000
+
+# Files read at once by read_transcript_files
+READ_WORKERS = 4
+
+
+def read_transcripts(path, usecols = None, categorical = False):
+    ''' Reads a transcription file as strings, converting NaNs into empty strings
+
+        Arguments:
+        path        -- path to a csv file
+        usecols     -- optional list of columns to read (all columns if None)
+        categorical -- if True, the CATEGORICAL_COLUMNS are read as categoricals instead of
+                       one Python string per row
+
+        Returns:
+        a pandas.core.frame.Dataframe object
+    '''
+    data = pd.read_csv(path, encoding = ENCODING, dtype = column_types(path, usecols, categorical), usecols = usecols)
+    return fill_missing(data)
+
+
+def expand_files(spec, wd = None):
+    ''' Input files of a -file argument: a file name, a glob pattern (e.g. export_*.csv) or a list in the format
+        [file1,file2], each relative to the working directory wd
+
+        Returns:
+        list of paths; the files matching a pattern are sorted by name
+    '''
+    paths = []
+    for item in spec.strip("[|]").split(","):
+        path = os.path.join(wd, item.strip()) if wd else item.strip()
+        if glob.has_magic(path):
+            matches = sorted(glob.glob(path))
+            if len(matches) == 0:
+                raise Exception("No files match " + path)
+            paths.extend(matches)
+        else:
+            paths.append(path)
+    return paths
+
+
+def read_transcript_files(paths, usecols = None, categorical = False, cache = None, workers = READ_WORKERS):
+    ''' Reads several transcription files (e.g. weekly exports) concurrently into a single data frame, the rows
+        of each file in turn, so the replicates of an accession split across files are grouped together when
+        it is resolved
+
+        Arguments:
+        paths       -- list of paths to csv files
+        usecols     -- optional list of columns to read (all columns if None)
+        categorical -- see read_transcripts
+        cache       -- optional file_cache_tools.FileCache; a file whose content is unchanged since it was
+                       cached is loaded from the cache instead of being parsed
+        workers     -- maximum number of files read at once
+
+        Returns:
+        a pandas.core.frame.Dataframe object
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    settings = {"usecols": sorted(usecols) if usecols is not None else None, "categorical": categorical}
+
+    def read(path):
+        data = cache.load(path, settings) if cache is not None else None
+        if data is not None:
+            print("\nUnchanged since the last run, not parsed again:", path)
+            return data
+        data = read_transcripts(path, usecols = usecols, categorical = categorical)
+        if cache is not None:
+            cache.store(path, settings, data)
+        return data
+
+    with ThreadPoolExecutor(max_workers = max(1, min(workers, len(paths)))) as pool:
+        frames = list(pool.map(read, paths))
+    if cache is not None:
+        cache.save()
+
+    return concat_transcripts(frames)
+
+
+def concat_transcripts(frames):
+    ''' Concatenates frames read from several files (or chunks of one file)
+
+        Each frame has its own categories, so concatenating a categorical column falls back to strings. Such
+        columns are merged with union_categoricals instead: the categories are sorted, with "" last as
+        fill_missing adds it, so the result is the same as reading the rows from a single file
+
+        Returns:
+        a pandas.core.frame.Dataframe object
+    '''
+    if len(frames) == 1:
+        return frames[0]
+    merged = dict()
+    for col in frames[0].columns:
+        if all(isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames):
+            column = union_categoricals([frame[col] for frame in frames], sort_categories = True)
+            if "" in column.categories:
+                column = column.reorder_categories([x for x in column.categories if x != ""] + [""])
+            merged[col] = column
+        else:
+            merged[col] = pd.concat([frame[col] for frame in frames], ignore_index = True)
+    return pd.DataFrame(merged)
+
+
+def iter_transcripts(path, usecols = None, categorical = False, chunksize = CHUNK_ROWS):
+    ''' Reads a transcription file like read_transcripts, but yields it in data frames of chunksize rows,
+        so a file can be filtered without holding all of it in memory '''
+    reader = pd.read_csv(path, encoding = ENCODING, dtype = column_types(path, usecols, categorical), usecols = usecols,
+                         chunksize = chunksize)
+    with reader:
+        for chunk in reader:
+            yield fill_missing(chunk)
+
+
+def column_types(path, usecols = None, categorical = False):
+    ''' read_csv dtype argument: strings, with the CATEGORICAL_COLUMNS as categoricals if categorical '''
+    if not categorical:
+        return object
+    columns = pd.read_csv(path, encoding = ENCODING, usecols = usecols, nrows = 0).columns
+    return {col: "category" if col in CATEGORICAL_COLUMNS else object for col in columns}
+
+
+def fill_missing(data):
+    ''' Converts NaNs into empty strings, column by column, so the frame is never copied as a whole '''
+    for col in data.columns:
+        if data[col].hasnans:
+            if isinstance(data[col].dtype, pd.CategoricalDtype) and "" not in data[col].cat.categories:
+                data[col] = data[col].cat.add_categories("")
+            data[col] = data[col].fillna("")
+    return data
+
+
+def map_strings(column, func):
+    ''' Applies func to every value of a column of strings
+
+        A categorical column is mapped once per category and expanded through its codes, so a lookup on a
+        million rows with a few hundred distinct values costs a few hundred calls
+
+        Returns:
+        a list with one value per row
+    '''
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        mapped = np.array([func(x) for x in column.cat.categories] + [func("")], dtype = object)
+        return list(mapped[column.cat.codes.to_numpy()]) # code -1 (missing) maps to the last entry
+    return [func(x) for x in column]
+
+
+def stage_columns(col_id, col_target, col_method = None):
+    ''' Column projection plan for a fused prepare -> resolve -> clean run
+
+        Arguments:
+        col_id      -- string, unique ID column
+        col_target  -- list of columns to be resolved
+        col_method  -- optional list of methods; weighted_vote also needs the volunteer column
+
+        Returns:
+        a dictionary of stage name -> list of columns the stage reads
+    '''
+    resolve = [col_id] + [col for col in col_target if col != col_id]
+    if col_method is not None and "weighted_vote" in col_method and VOTER_COLUMN not in resolve:
+        resolve.append(VOTER_COLUMN)
+    prepare = resolve + [col for col in PREPARE_COLUMNS if col not in resolve]
+    return {"prepare": prepare, "resolve": resolve, "clean": list(CLEAN_COLUMNS)}
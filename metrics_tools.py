@@ -0,0 +1,145 @@
+## METRICS TOOLS
+# Description: Lightweight instrumentation for the transcript pipeline - stage timers, counters,
+#              latency histograms, peak memory and a throttled progress line
+#
+# Notes:
+# A single module-level `metrics` instance is shared by transcriptResolver, transcriptClean and consensus_tools,
+# so any stage can record into it without threading an object through every function call. Updates are locked,
+# as the resolver's column jobs (-parallel_columns) record from several threads
+
+
+## DEPENDENCIES
+import sys
+import csv
+import json
+import time
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource # Peak RSS (not available on Windows)
+except ImportError:
+    resource = None
+
+# Upper bounds (in milliseconds) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+
+def peak_rss_mb():
+    ''' Peak resident set size of this process in MB (None if it cannot be determined) '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin": # bytes on macOS, kilobytes on Linux
+        return peak / 1e6
+    return peak / 1e3
+
+
+class Metrics:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.start = time.time()
+        self.stages = OrderedDict() # stage name -> cumulative wall time in seconds
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        ''' Context manager that adds the wall time of the enclosed block to stage `name` '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        ''' Adds wall time measured elsewhere (e.g. in a worker process) to stage `name` '''
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def incr(self, name, n = 1):
+        with self.lock:
+            self.counters[name] += n
+
+    def observe(self, name, seconds):
+        ''' Records a single latency (in seconds) into histogram `name` '''
+        ms = seconds * 1000
+        bucket = len(LATENCY_BUCKETS)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if ms <= bound:
+                bucket = i
+                break
+        with self.lock:
+            self.histograms[name][bucket] += 1
+
+    def summary(self):
+        bucket_names = ["<=%dms" % bound for bound in LATENCY_BUCKETS] + [">%dms" % LATENCY_BUCKETS[-1]]
+        return {"wall_time_s": time.time() - self.start,
+                "peak_rss_mb": peak_rss_mb(),
+                "stages_s": dict(self.stages),
+                "counters": dict(self.counters),
+                "histograms": {name: dict(zip(bucket_names, counts)) for name, counts in self.histograms.items()}}
+
+    def write(self, path):
+        ''' Writes the metrics to a JSON file, or to a long-format CSV (kind,name,key,value) if path ends in .csv '''
+        summary = self.summary()
+        if path.endswith(".csv"):
+            with open(path, "w", newline = "") as f:
+                writer = csv.writer(f)
+                writer.writerow(["kind", "name", "key", "value"])
+                writer.writerow(["run", "wall_time_s", "", summary["wall_time_s"]])
+                writer.writerow(["run", "peak_rss_mb", "", summary["peak_rss_mb"]])
+                for name, value in summary["stages_s"].items():
+                    writer.writerow(["stage", name, "", value])
+                for name, value in summary["counters"].items():
+                    writer.writerow(["counter", name, "", value])
+                for name, buckets in summary["histograms"].items():
+                    for key, value in buckets.items():
+                        writer.writerow(["histogram", name, key, value])
+        else:
+            with open(path, "w") as f:
+                json.dump(summary, f, indent = 2)
+
+
+class Progress:
+    ''' Single progress line (count, rate and ETA), redrawn at most once every `interval` seconds. A quiet
+        Progress draws nothing (e.g. in a worker thread, whose caller reports the progress) '''
+    def __init__(self, total, label, interval = 2.0, stream = None, quiet = False):
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.quiet = quiet
+        self.stream = stream if stream is not None else sys.stdout
+        self.done = 0
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    def update(self, n = 1):
+        self.done += n
+        now = time.perf_counter()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.draw(now)
+
+    def draw(self, now):
+        if self.quiet:
+            return
+        elapsed = max(now - self.start, 1e-9)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate > 0 else float("inf")
+        self.stream.write("\r%s: %d/%d (%.1f/s, ETA %.0fs)   " % (self.label, self.done, self.total, rate, eta))
+        self.stream.flush()
+
+    def close(self):
+        if self.quiet:
+            return
+        self.draw(time.perf_counter())
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+metrics = Metrics()
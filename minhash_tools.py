@@ -0,0 +1,75 @@
+## MINHASH TOOLS
+# Description: MinHash signatures of character shingles, used to drop outlier (junk) replicate transcriptions
+#              before they are aligned
+#
+# Notes:
+# Strings are lower-cased and white space is collapsed before shingling, so case and spacing noise do not make
+# a transcription look like an outlier. Hashing uses zlib.crc32 and fixed permutation seeds, so signatures
+# are the same in every run (Python's own string hash is randomized per process)
+
+
+## DEPENDENCIES
+import re # Regular expressions
+import zlib # crc32 shingle hashes
+import numpy as np
+
+MERSENNE_PRIME = (1 << 61) - 1
+NUM_PERM = 64
+SHINGLE_SIZE = 3
+
+_rng = np.random.RandomState(1)
+# Coefficients stay below 2**31 so a * hash + b fits in an unsigned 64 bit integer
+PERM_A = _rng.randint(1, 1 << 31, size = NUM_PERM).astype(np.uint64)
+PERM_B = _rng.randint(0, 1 << 31, size = NUM_PERM).astype(np.uint64)
+
+
+def shingles(x, k = SHINGLE_SIZE):
+    ''' Set of the character k-grams of a normalized string (the whole string if it is shorter than k) '''
+    x = re.sub(r"\s+", " ", x.lower()).strip()
+    if len(x) <= k:
+        return {x}
+    return {x[i:i + k] for i in range(len(x) - k + 1)}
+
+
+def signature(x, k = SHINGLE_SIZE):
+    ''' MinHash signature (NUM_PERM unsigned integers) of the shingles of a string '''
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles(x, k)], dtype = np.uint64)
+    return ((PERM_A[:, None] * hashes[None, :] + PERM_B[:, None]) % MERSENNE_PRIME).min(axis = 1)
+
+
+def similarity_matrix(x, k = SHINGLE_SIZE):
+    ''' Estimated Jaccard similarity of the shingle sets of every pair of strings
+
+        Returns:
+        numpy array of shape (len(x), len(x))
+    '''
+    signatures = np.array([signature(string, k) for string in x])
+    return (signatures[:, None, :] == signatures[None, :, :]).mean(axis = 2)
+
+
+def filter_outliers(x, threshold, k = SHINGLE_SIZE):
+    ''' Drops the strings whose mean estimated similarity to the other (non-empty) strings is below threshold
+
+        Empty strings are never dropped, and nothing is dropped unless the strings that remain are a clear
+        majority (more than half of the non-empty strings), since then there is no cluster to compare against
+
+        Arguments:
+        x           -- list (or array) of strings
+        threshold   -- float between 0 and 1
+
+        Returns:
+        a tuple of 2 lists - the strings kept (in their original order) and the strings dropped
+    '''
+    filled = [i for i, string in enumerate(x) if string != ""]
+    if len(filled) < 3:
+        return list(x), []
+
+    similarity = similarity_matrix([x[i] for i in filled], k)
+    score = (similarity.sum(axis = 1) - 1) / (len(filled) - 1) # mean similarity to the others, excluding itself
+    outliers = set(filled[i] for i in np.flatnonzero(score < threshold))
+    if len(outliers) == 0 or 2 * len(outliers) >= len(filled):
+        return list(x), []
+
+    kept = [string for i, string in enumerate(x) if i not in outliers]
+    dropped = [string for i, string in enumerate(x) if i in outliers]
+    return kept, dropped
@@ -12,14 +12,10 @@
 import pandas as pd 
 from collections import defaultdict
 import itertools as it
-from fuzzywuzzy import fuzz # Fuzzy string matching for best_transcript()
-from fuzzywuzzy import process # For reflst matching
-from Levenshtein import * # Levenshtein distance for best_transcript() 
+from Levenshtein import * # Levenshtein ratio for refcheck()
 
 import os # Path tools
 import string # String tools
-import nltk # For tokenizing
-import subprocess # For subprocessing MAFFT
 import re # Regular expressions
 
 
@@ -118,6 +114,8 @@ def reflist_check(datalst, reflst, threshold):
     >>> reflist_check(x,y)
 
     '''
+    from fuzzywuzzy import process # For reflst matching; slow to import, so only loaded here
+
     # Create empty lists
     estimate = ["NA"] * len(datalst)
     certainty = ["NA"] * len(datalst)
@@ -0,0 +1,275 @@
+## POA TOOLS
+# Description: Partial-order alignment (POA) graphs of replicate transcriptions, kept between runs so a new
+#              replicate is aligned into the existing graph instead of realigning every replicate
+#
+# Notes:
+# Each node of a graph is one character, weighted by the number of transcriptions passing through it. A new
+# transcription is aligned to the whole graph in one dynamic programming pass over the nodes in topological
+# order (O(length x nodes)) and merged into it; the consensus is read from the heaviest bundle, keeping the
+# characters shared by at least half of the transcriptions (as dumber_consensus does for MAFFT alignments).
+# Graphs are serialized to JSON, one per accession and field, next to the resolved output
+# Reference: Lee, Grasso & Sharlow (2002) Multiple sequence alignment using partial order graphs. Bioinformatics 18: 452-464
+
+
+## DEPENDENCIES
+import os # Path tools
+import json
+import bisect
+from collections import Counter, deque, defaultdict
+import numpy as np
+import pandas as pd # data frame functionality
+
+from metrics_tools import metrics, Progress # Instrumentation
+
+MATCH = 1
+MISMATCH = -1
+GAP = -2
+
+
+class POAGraph:
+    def __init__(self):
+        self.bases = [] # character of every node
+        self.weights = [] # number of transcriptions through every node
+        self.edges = [] # node -> {next node: number of transcriptions}
+        self.preds = [] # node -> sorted list of previous nodes
+        self.aligned = [] # node -> nodes aligned to it (the same column, a different character)
+        self.sequences = [] # transcriptions in the order they were added
+        self.paths = [] # nodes of every transcription
+
+    def __len__(self):
+        return len(self.bases)
+
+    def add_node(self, base):
+        self.bases.append(base)
+        self.weights.append(0)
+        self.edges.append(dict())
+        self.preds.append([])
+        self.aligned.append([])
+        return len(self.bases) - 1
+
+    def topological_order(self):
+        ''' Nodes in topological order (ties broken by node number, so the order is the same in every run) '''
+        indegree = [len(p) for p in self.preds]
+        queue = deque(node for node in range(len(self)) if indegree[node] == 0)
+        order = []
+        while len(queue) > 0:
+            node = queue.popleft()
+            order.append(node)
+            for following in sorted(self.edges[node]):
+                indegree[following] -= 1
+                if indegree[following] == 0:
+                    queue.append(following)
+        if len(order) != len(self):
+            raise Exception("Partial order graph has a cycle")
+        return order
+
+    def align(self, seq):
+        ''' Global alignment of a string to the graph
+
+            Returns:
+            list of (node, position in seq) pairs along the alignment; node is None for characters inserted
+            relative to the graph and position is None for nodes the string skips
+        '''
+        order = self.topological_order()
+        row = {node: r + 1 for r, node in enumerate(order)} # row 0 is the (virtual) start of the graph
+        codes = np.array([ord(c) for c in seq], dtype = np.int64)
+        steps = np.arange(len(seq) + 1) * GAP
+
+        # H[r, j]: best score of an alignment of seq[:j] ending at the node of row r
+        H = np.zeros((len(order) + 1, len(seq) + 1), dtype = np.int64)
+        H[0] = steps
+        previous = []
+        for r, node in enumerate(order, 1):
+            rows = [row[p] for p in self.preds[node]] or [0]
+            best = H[rows].max(axis = 0)
+            score = np.where(codes == ord(self.bases[node]), MATCH, MISMATCH)
+            D = best + GAP # node skipped by seq
+            D[1:] = np.maximum(D[1:], best[:-1] + score) # node aligned to a character
+            # Characters inserted after the node: H[r, j] = max(D[j], H[r, j - 1] + GAP)
+            H[r] = steps + np.maximum.accumulate(D - steps)
+            previous.append(rows)
+
+        # The alignment ends at the best sink (node without successors)
+        sinks = [node for node in order if len(self.edges[node]) == 0]
+        r = row[max(sinks, key = lambda node: (H[row[node], len(seq)], -row[node]))]
+        j = len(seq)
+
+        pairs = []
+        while r > 0 or j > 0:
+            if r == 0:
+                pairs.append((None, j - 1))
+                j -= 1
+                continue
+            node = order[r - 1]
+            value = H[r, j]
+            moved = False
+            if j > 0:
+                score = MATCH if seq[j - 1] == self.bases[node] else MISMATCH
+                for p in previous[r - 1]:
+                    if H[p, j - 1] + score == value:
+                        pairs.append((node, j - 1))
+                        r, j, moved = p, j - 1, True
+                        break
+            if not moved:
+                for p in previous[r - 1]:
+                    if H[p, j] + GAP == value:
+                        pairs.append((node, None))
+                        r, moved = p, True
+                        break
+            if not moved:
+                pairs.append((None, j - 1))
+                j -= 1
+        return pairs[::-1]
+
+    def add_sequence(self, seq):
+        ''' Aligns a transcription to the graph and merges it in '''
+        if seq in self.sequences:
+            # Same path as the identical transcription already in the graph; no alignment needed
+            path = list(self.paths[self.sequences.index(seq)])
+        elif len(self) == 0:
+            path = [self.add_node(c) for c in seq]
+        else:
+            path = []
+            for node, j in self.align(seq):
+                if j is None:
+                    continue
+                if node is not None and self.bases[node] != seq[j]:
+                    # A different character in the same column: reuse a node already holding it there
+                    column = [node] + self.aligned[node]
+                    same = [n for n in column if self.bases[n] == seq[j]]
+                    if len(same) > 0:
+                        node = same[0]
+                    else:
+                        new = self.add_node(seq[j])
+                        for n in column:
+                            self.aligned[n].append(new)
+                        self.aligned[new] = column
+                        node = new
+                elif node is None:
+                    node = self.add_node(seq[j])
+                path.append(node)
+
+        for node in path:
+            self.weights[node] += 1
+        for a, b in zip(path[:-1], path[1:]):
+            if b not in self.edges[a]:
+                self.edges[a][b] = 0
+                bisect.insort(self.preds[b], a)
+            self.edges[a][b] += 1
+        self.sequences.append(seq)
+        self.paths.append(path)
+
+    def consensus(self, threshold = 0.5):
+        ''' Heaviest bundle through the graph, keeping the characters of at least `threshold` of the transcriptions
+
+            Every node is reached from its predecessor over the heaviest edge (ties go to the higher scoring
+            predecessor), and the path ends at the heaviest end node. Summed edge weights alone would let a
+            long branch that one transcription took outscore the shorter one most of them took
+        '''
+        if len(self) == 0:
+            return ""
+        score = dict()
+        back = dict()
+        for node in self.topological_order():
+            score[node], back[node] = 0, None
+            best = None
+            for p in self.preds[node]: # sorted, so ties go to the lowest node
+                if best is None or (self.edges[p][node], score[p]) > best:
+                    best = (self.edges[p][node], score[p])
+                    score[node], back[node] = self.edges[p][node] + score[p], p
+        ends = [n for n in range(len(self)) if len(self.edges[n]) == 0]
+        node = max(ends, key = lambda n: (self.weights[n], score[n], -n))
+
+        path = []
+        while node is not None:
+            path.append(node)
+            node = back[node]
+        keep = threshold * len(self.sequences)
+        return "".join(self.bases[n] for n in reversed(path) if self.weights[n] >= keep)
+
+    def to_dict(self):
+        return {"bases": self.bases, "weights": self.weights,
+                "edges": [[a, b, w] for a in range(len(self)) for b, w in self.edges[a].items()],
+                "aligned": self.aligned, "sequences": self.sequences, "paths": self.paths}
+
+    @classmethod
+    def from_dict(cls, d):
+        graph = cls()
+        for base in d["bases"]:
+            graph.add_node(base)
+        graph.weights = list(d["weights"])
+        for a, b, w in d["edges"]:
+            graph.edges[a][b] = w
+            bisect.insort(graph.preds[b], a)
+        graph.aligned = [list(a) for a in d["aligned"]]
+        graph.sequences = list(d["sequences"])
+        graph.paths = [list(p) for p in d["paths"]]
+        return graph
+
+
+def load_graphs(path):
+    ''' Stored graphs (field -> accession -> serialized POAGraph), or an empty store if path does not exist '''
+    if path is None or not os.path.exists(path):
+        return defaultdict(dict)
+    with open(path, encoding = "utf-8") as f:
+        return defaultdict(dict, json.load(f))
+
+
+def save_graphs(graphs, path):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding = "utf-8") as f:
+        json.dump(graphs, f)
+    os.replace(tmp, path) # never leave a half-written store behind
+
+
+def poa_consensus(accession, field, data, poa_graphs = None, threshold = 0.5, verbose = True):
+    ''' Finds the consensus of the replicate transcriptions of every accession from a partial order alignment
+
+        Arguments:
+        accession   -- string, define unique ID field
+        field       -- string, define target field to resolve
+        data        -- pandas.core.frame.Dataframe object (or consensus_tools.VariantGroups)
+        poa_graphs  -- optional store of graphs from earlier runs (see load_graphs), updated in place. An
+                       accession's stored graph only has the transcriptions it does not hold yet aligned into it;
+                       it is rebuilt if a transcription it holds is gone
+        threshold   -- minimum fraction of the transcriptions sharing a consensus character
+        verbose     -- print what is being resolved and a progress line (see consensus_tools.variant_consensus)
+
+        Returns:
+        a pandas.core.frame.Dataframe object
+    '''
+    from consensus_tools import variant_groups
+
+    if verbose:
+        print("\nImplementing partial order alignment consensus on", field, "field")
+    groups = variant_groups(accession, data)
+    stored = poa_graphs.setdefault(field, dict()) if poa_graphs is not None else dict()
+
+    keys = []
+    results = []
+    progress = Progress(len(groups), "Reconciling " + field, quiet = not verbose)
+    for k, v in groups.items(field):
+        v = list(v)
+        graph = POAGraph.from_dict(stored[str(k)]) if str(k) in stored else None
+        if graph is not None and len(Counter(graph.sequences) - Counter(v)) > 0:
+            graph = None
+            metrics.incr("poa.rebuilt")
+        if graph is None:
+            graph = POAGraph()
+            new = v
+        else:
+            new = list((Counter(v) - Counter(graph.sequences)).elements())
+            metrics.incr("poa.reused")
+
+        for seq in new:
+            graph.add_sequence(seq)
+        metrics.incr("poa.absorbed", len(new))
+        if poa_graphs is not None and len(new) > 0:
+            stored[str(k)] = graph.to_dict()
+
+        keys.append(str(k))
+        results.append(graph.consensus(threshold).strip())
+        progress.update()
+    progress.close()
+
+    return pd.DataFrame({str(accession): keys, str(field): results})
@@ -0,0 +1,168 @@
+## REFERENCE TOOLS
+# Description: Builds, saves and loads the reference indexes used by transcriptClean
+#              (collector aliases, geography names and holding institutions)
+#
+# Notes:
+# The indexes are compiled into a single versioned pickle snapshot so the cleaner can start without
+# querying the essig database or re-parsing the reference CSVs. A snapshot is considered stale when its
+# version differs, any reference CSV changed since it was built, or it is older than the maximum age
+
+
+## DEPENDENCIES
+import os # Path tools
+import re # Regular expressions
+import time
+import pickle
+import pandas as pd # data frame functionality
+
+SNAPSHOT_VERSION = 2
+REFERENCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference") # next to this module, wherever it is run from
+SNAPSHOT_FILE = os.path.join(REFERENCE_DIR, "essig_reference.pkl")
+
+# Reference table name -> (file name, encoding)
+REFERENCE_FILES = {"canprov": ("essig_canprov.csv", None),
+                   "country": ("essig_country.csv", "latin-1"),
+                   "mexstate": ("essig_mexstate.csv", "latin-1"),
+                   "statecounty": ("essig_statecounty.csv", None),
+                   "holdinginst": ("essig_inst.csv", None)}
+
+COLLECTOR_QUERY = "select name_full, name_short, collector from eme_people where collector = 1"
+
+
+def load_reference_csvs(ref_dir = REFERENCE_DIR, pool = None):
+    ''' Reads the reference CSVs into a dictionary of table name -> pandas.core.frame.DataFrame
+
+        Arguments:
+        ref_dir -- directory holding the reference CSVs
+        pool    -- optional concurrent.futures executor; the files are then read concurrently
+    '''
+    if pool is None:
+        return {name: pd.read_csv(os.path.join(ref_dir, filename), encoding = encoding)
+                for name, (filename, encoding) in REFERENCE_FILES.items()}
+    futures = {name: pool.submit(pd.read_csv, os.path.join(ref_dir, filename), encoding = encoding)
+               for name, (filename, encoding) in REFERENCE_FILES.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+def source_signature(ref_dir = REFERENCE_DIR):
+    ''' Size and modification time of every reference CSV, used to detect stale snapshots '''
+    signature = dict()
+    for filename, encoding in REFERENCE_FILES.values():
+        stat = os.stat(os.path.join(ref_dir, filename))
+        signature[filename] = (stat.st_size, stat.st_mtime)
+    return signature
+
+
+def collector_index(essig_collector):
+    ''' Builds the collector alias map from the essig eme_people table
+
+        Arguments:
+        essig_collector -- pandas.core.frame.DataFrame with name_full and name_short columns
+
+        Returns:
+        dictionary of normalized alias (lower case, alphanumeric only) -> full collector name
+    '''
+    essig_collector = essig_collector.fillna("")
+    short_names = [col.strip("=") for col in list(essig_collector['name_short'])] # Remove the "=" characters in the essig database
+
+    essig_ref = dict()
+    for full_name, name_short in zip(essig_collector['name_full'], short_names):
+        if full_name != "":
+            essig_ref[re.sub(r'[\W_]+', '', full_name).lower()] = full_name # Remove spaces and non alphanumeric characters from reference list
+
+        if name_short != "":
+            temp = name_short.split(", ")
+            for sec_name in temp:
+                essig_ref[re.sub(r'[\W_]+', '', sec_name).lower()] = full_name # Remove spaces and non alphanumeric characters from reference list
+    return essig_ref
+
+
+def geography_index(references):
+    ''' Builds exact-match lookups for countries, states/provinces and counties, and the per-node candidate
+        lists of the hierarchical matcher (geography_tools): state names by country, county names by U.S. state
+
+        Where a name occurs more than once in a reference table, the first occurrence wins
+
+        Returns:
+        dictionary of lookup name -> dictionary
+    '''
+    def first_occurrence(keys, values):
+        index = dict()
+        for key, value in zip(keys, values):
+            index.setdefault(key, value)
+        return index
+
+    country = references["country"]
+    statecounty = references["statecounty"]
+    counties = dict()
+    for state, county in zip(statecounty["State"], statecounty["County"]):
+        counties.setdefault(state, dict()).setdefault(county, county)
+    return {"country": first_occurrence(country["name"], country["continent"]), # country -> continent
+            "state_abbrev": first_occurrence(statecounty["State.Abbrev"], statecounty["State"]),
+            "state_name": first_occurrence(statecounty["State"], statecounty["State"]),
+            "canada": first_occurrence(references["canprov"]["name"], references["canprov"]["name"]),
+            "mexico": first_occurrence(references["mexstate"]["name"], references["mexstate"]["name"]),
+            "county": first_occurrence(statecounty["County"], statecounty["County"]),
+            "states": {"United States": first_occurrence(statecounty["State"], statecounty["State"]),
+                       "Canada": first_occurrence(references["canprov"]["name"], references["canprov"]["name"]),
+                       "Mexico": first_occurrence(references["mexstate"]["name"], references["mexstate"]["name"])},
+            "counties": counties}
+
+
+def holdinginst_index(holdinginst):
+    ''' Maps the first three letters of an institution abbreviation to the institution name '''
+    codes = [abbrev[0:3] for abbrev in holdinginst['Abbrev']]
+    return dict(zip(codes, holdinginst['Name']))
+
+
+def build_reference_snapshot(essig_collector, ref_dir = REFERENCE_DIR, references = None):
+    ''' Compiles every reference index used by transcriptCleaner into one dictionary
+
+        Arguments:
+        essig_collector -- pandas.core.frame.DataFrame, the eme_people collector table
+        ref_dir         -- directory holding the reference CSVs
+        references      -- optional dictionary of already loaded reference tables
+
+        Returns:
+        dictionary with the snapshot version, creation time, source signature and the indexes
+    '''
+    if references is None:
+        references = load_reference_csvs(ref_dir)
+    return {"version": SNAPSHOT_VERSION,
+            "created": time.time(),
+            "sources": source_signature(ref_dir),
+            "collector": collector_index(essig_collector),
+            "geography": geography_index(references),
+            "holdinginst": holdinginst_index(references["holdinginst"])}
+
+
+def save_snapshot(snapshot, path = SNAPSHOT_FILE):
+    # Write to a temporary file first so a concurrent reader never sees a partial snapshot
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(snapshot, f, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path = SNAPSHOT_FILE, ref_dir = REFERENCE_DIR, max_age_days = 7):
+    ''' Loads a reference snapshot
+
+        Returns:
+        the snapshot dictionary, or None if the file is missing or the snapshot is stale
+    '''
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as f:
+        snapshot = pickle.load(f)
+
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        print("\nReference snapshot", path, "was built by a different version; ignoring it")
+        return None
+    if snapshot["sources"] != source_signature(ref_dir):
+        print("\nReference CSVs changed since", path, "was built; ignoring it")
+        return None
+    if max_age_days is not None and time.time() - snapshot["created"] > max_age_days * 86400:
+        print("\nReference snapshot", path, "is older than", max_age_days, "days; ignoring it")
+        return None
+    return snapshot
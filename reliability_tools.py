@@ -0,0 +1,143 @@
+## RELIABILITY TOOLS
+# Description: Per-volunteer reliability scores and reliability-weighted vote counting
+#
+# Notes:
+# A volunteer's reliability is how often their transcription agrees with the majority on unambiguous accessions
+# (a single value holds more than half of the non-empty votes, and at least 2 of them), smoothed towards a prior so volunteers with few
+# transcriptions are not trusted (or distrusted) on the strength of a handful of votes. Scores are computed in one
+# vectorized pass over every vote column of the export and cached to a CSV file, along with a signature (SHA-1) of
+# the columns they were scored on, so they are scored again when the export changes
+
+
+## DEPENDENCIES
+import os # Path tools
+import hashlib
+import numpy as np
+import pandas as pd # data frame functionality
+from io_tools import VOTER_COLUMN
+
+# Beta prior on the agreement rate: a volunteer without unambiguous votes scores PRIOR_AGREE / PRIOR_VOTES
+PRIOR_AGREE = 3
+PRIOR_VOTES = 4
+
+
+def volunteer_reliability(data, accession, fields, voter = VOTER_COLUMN, prior_agree = PRIOR_AGREE, prior_votes = PRIOR_VOTES):
+    ''' Scores every volunteer by their agreement with the majority on unambiguous accessions
+
+        Arguments:
+        data        -- pandas.core.frame.Dataframe object with the accession, voter and field columns
+        accession   -- string, unique ID field
+        fields      -- list of vote columns
+        voter       -- string, column identifying the volunteer
+
+        Returns:
+        a pandas.core.frame.Dataframe object with the voter, votes, agreements and reliability columns
+    '''
+    missing = [col for col in [accession, voter] + list(fields) if col not in data.columns]
+    if len(missing) > 0:
+        raise Exception("Columns not found in data object: " + ", ".join(missing))
+
+    # Long format: one row per (transcription, field); empty fields are not votes
+    votes = data[[accession, voter] + list(fields)].melt(id_vars = [accession, voter], var_name = "field", value_name = "value")
+    votes = votes[votes["value"] != ""]
+
+    # Majority value of every (accession, field) and whether it is unambiguous; a lone vote agrees with itself
+    counts = votes.groupby([accession, "field", "value"], sort = False).size().rename("count").reset_index()
+    totals = counts.groupby([accession, "field"], sort = False)["count"].transform("sum")
+    majority = counts[(counts["count"] * 2 > totals) & (counts["count"] >= 2)][[accession, "field", "value"]]
+
+    votes = votes.merge(majority, on = [accession, "field"], how = "inner", suffixes = ("", "_majority"))
+    votes["agree"] = (votes["value"] == votes["value_majority"]).astype(np.int64)
+
+    scores = votes.groupby(voter, sort = True)["agree"].agg(["size", "sum"]).reset_index()
+    scores.columns = [voter, "votes", "agreements"]
+    scores["reliability"] = (scores["agreements"] + prior_agree) / (scores["votes"] + prior_votes)
+    return scores
+
+
+def reliability_source(data, accession, fields, voter = VOTER_COLUMN):
+    ''' Signature (SHA-1) of the columns volunteer reliability is scored on. The same for string and categorical
+        columns with the same values '''
+    columns = [accession, voter] + sorted(fields)
+    sha1 = hashlib.sha1(",".join(columns).encode("utf-8"))
+    sha1.update(pd.util.hash_pandas_object(data[columns], index = False).to_numpy().tobytes())
+    return sha1.hexdigest()
+
+
+def read_reliability(path, voter = VOTER_COLUMN):
+    ''' Volunteer reliability scores of a file written by load_reliability, as a dictionary of voter -> reliability '''
+    scores = pd.read_csv(path, dtype = {voter: object, "source": object}, keep_default_na = False)
+    return dict(zip(scores[voter], scores["reliability"]))
+
+
+def load_reliability(data, accession, fields, path = None, refresh = False, voter = VOTER_COLUMN, check = True):
+    ''' Volunteer reliability scores, read from the cache file at path if it exists and was scored on the same
+        data (unless refresh), otherwise computed with volunteer_reliability and written to path
+
+        Arguments:
+        check       -- if False, the cache file is used whatever data it was scored on (e.g. one shard of an
+                       export, with the scores of the whole export)
+
+        Returns:
+        dictionary of voter -> reliability
+    '''
+    scores = None
+    if path is not None and os.path.exists(path) and not refresh:
+        scores = pd.read_csv(path, dtype = {voter: object, "source": object}, keep_default_na = False)
+        if not check:
+            print("\nUsing volunteer reliability scores from", path)
+        elif "source" in scores.columns and len(scores) > 0 and scores["source"].iloc[0] == reliability_source(data, accession, fields, voter = voter):
+            print("\nUsing volunteer reliability scores from", path)
+        else:
+            print("\nVolunteer reliability scores in", path, "were scored on other data")
+            scores = None
+    if scores is None:
+        print("\nScoring volunteer reliability on", ", ".join(fields), "...")
+        scores = volunteer_reliability(data, accession, fields, voter = voter)
+        if path is not None:
+            scores["source"] = reliability_source(data, accession, fields, voter = voter)
+            scores.to_csv(path, index = False)
+    return dict(zip(scores[voter], scores["reliability"]))
+
+
+def weighted_vote(accession, field, data, reliability = None, voter = VOTER_COLUMN, verbose = True):
+    ''' Chooses the value with the highest total reliability of the volunteers voting for it. For fields with
+        discrete states. Ties go to the value transcribed first
+
+        Arguments:
+        accession   -- string, define unique ID field
+        field       -- string, define target field to resolve
+        data        -- pandas.core.frame.Dataframe object (or consensus_tools.VariantGroups),
+                       must contain the accession, field and voter columns
+        reliability -- dictionary of voter -> reliability; volunteers missing from it get the prior score.
+                       If None, scores are computed from this field alone
+        verbose     -- print what is being resolved (see consensus_tools.variant_consensus)
+
+        Returns:
+        a pandas.core.frame.Dataframe object
+    '''
+    from consensus_tools import variant_groups
+
+    if verbose:
+        print("Implementing reliability-weighted vote on", field, "field.")
+    groups = variant_groups(accession, data)
+    if voter not in groups.data.columns:
+        raise Exception("Volunteer column '" + voter + "' not found in data object; it is needed by weighted_vote")
+    if field not in groups.data.columns:
+        raise Exception("Target field not found in data object")
+    if reliability is None:
+        reliability = load_reliability(groups.data.iloc[groups.order], accession, [field], voter = voter)
+
+    # Only the rows of these groups (e.g. one chunk of a column), sorted by accession; within an accession the
+    # rows keep their original order, so "first" still gives ties to the value transcribed first
+    weights = pd.Series(groups.values(voter)).map(reliability).astype(float).fillna(PRIOR_AGREE / PRIOR_VOTES)
+    votes = pd.DataFrame({"acc": groups.values(accession), "value": groups.values(field),
+                          "weight": weights.to_numpy(), "first": np.arange(len(groups.order))})
+
+    # Weighted grouped argmax: total weight per (accession, value), best value per accession
+    totals = votes.groupby(["acc", "value"], sort = False).agg(weight = ("weight", "sum"), first = ("first", "min")).reset_index()
+    totals = totals.sort_values(["weight", "first"], ascending = [False, True], kind = "stable")
+    best = totals.drop_duplicates("acc").set_index("acc")["value"]
+
+    return pd.DataFrame({str(accession): [str(k) for k in groups.keys],
+                         str(field): [str(v) for v in best.reindex(groups.keys)]})
@@ -0,0 +1,106 @@
+import os
+import json
+import socket
+import argparse #For command line arguments
+import http.client
+
+from io_tools import read_transcripts, CLEAN_COLUMNS, VOTER_COLUMN
+import pandas as pd # data frame functionality
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    ''' HTTP connection over a Unix socket '''
+    def __init__(self, path, timeout = None):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout = timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def connect(address, timeout = None):
+    ''' Connection to a resolverService address: "unix:<socket path>" or "http://host:port" '''
+    if address.startswith("unix:"):
+        return UnixHTTPConnection(address[len("unix:"):], timeout = timeout)
+    host = address.replace("http://", "").rstrip("/")
+    return http.client.HTTPConnection(host, timeout = timeout)
+
+
+def submit(address, endpoint, request = None, timeout = None, conn = None):
+    ''' Sends a request to a resolverService endpoint
+
+        Arguments:
+        address     -- "unix:<socket path>" or "http://host:port"
+        endpoint    -- "resolve" or "clean" (POST), "health" or "metrics" (GET)
+        request     -- dictionary sent as the JSON body of a POST
+        conn        -- optional open connection to reuse (see connect)
+
+        Returns:
+        dictionary, the JSON response; raises an Exception if the service reports an error
+    '''
+    own = conn is None
+    if own:
+        conn = connect(address, timeout)
+    try:
+        if request is None:
+            conn.request("GET", "/" + endpoint)
+        else:
+            body = json.dumps(request).encode("utf-8")
+            conn.request("POST", "/" + endpoint, body = body, headers = {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        result = json.loads(response.read().decode("utf-8"))
+    finally:
+        if own:
+            conn.close()
+
+    if response.status != 200:
+        raise Exception("resolverService " + endpoint + " failed: " + result.get("error", str(response.status)))
+    return result
+
+## MAIN ##
+def main():
+    args = parser.parse_args()
+    address = "unix:" + args.socket if args.socket else args.address
+
+    if args.endpoint in ["health", "metrics"]:
+        print(json.dumps(submit(address, args.endpoint), indent = 2))
+        return
+
+    if args.endpoint == "resolve":
+        col_target = args.col_target.strip("[|]").split(",")
+        col_method = args.col_method.strip("[|]").split(",")
+        usecols = [args.col_id] + col_target
+        if "weighted_vote" in col_method:
+            usecols.append(VOTER_COLUMN) # weighted_vote weighs every row by the volunteer who transcribed it
+        data = read_transcripts(os.path.join(args.wd, args.file), usecols = usecols)
+        request = {"rows": data.to_dict(orient = "records"), "col_id": args.col_id,
+                   "col_target": col_target, "col_method": col_method}
+    else:
+        data = read_transcripts(os.path.join(args.wd, args.file), usecols = CLEAN_COLUMNS)
+        request = {"rows": data.to_dict(orient = "records")}
+
+    result = submit(address, args.endpoint, request)
+    print("\n" + args.endpoint.capitalize(), len(data), "rows in", "%.1f" % result["elapsed_ms"], "ms")
+
+    outputfile = os.path.join(args.wd, args.output)
+    pd.DataFrame(result["rows"]).to_csv(outputfile, index = False)
+    print("\nExporting results to", outputfile)
+    if len(result.get("errors", [])) > 0:
+        errorfile = os.path.join(os.path.dirname(outputfile), "error_" + os.path.basename(outputfile))
+        pd.DataFrame(result["errors"]).to_csv(errorfile, index = False, header = False)
+        print("\nExporting potential errors to", errorfile)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="resolverClient - send a file to a running resolverService")
+    parser.add_argument("endpoint", choices = ["resolve", "clean", "health", "metrics"], help = "Service endpoint")
+    parser.add_argument("-address", default = "http://127.0.0.1:8765", help = "Service address")
+    parser.add_argument("-socket", help = "Unix socket of the service (instead of -address)")
+    parser.add_argument("-wd", default = ".", help = "Working directory")
+    parser.add_argument("-file", "-f", help = "File with transcriptions")
+    parser.add_argument("-output", "-o", default = "service_transcript.csv", help = "Output file name")
+    parser.add_argument("-col_id", default = "subject_id", help = "Column name specifying unique IDs")
+    parser.add_argument("-col_target", help = "Target column. Must be in the format -col_target [target1,target2,target3]")
+    parser.add_argument("-col_method", help = "Method. Must be in the format -col_method [method1,method2,method3]")
+    main()
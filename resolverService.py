@@ -0,0 +1,259 @@
+import os
+import io
+import json
+import time
+import signal
+import argparse #For command line arguments
+import contextlib
+import socketserver
+from concurrent.futures import ThreadPoolExecutor # column-parallel resolution, shared by all requests
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import pandas as pd # data frame functionality
+
+from metrics_tools import metrics # stage timers and counters
+from io_tools import CLEAN_COLUMNS, VOTER_COLUMN
+from reference_tools import SNAPSHOT_FILE, load_snapshot, save_snapshot
+from reliability_tools import read_reliability
+from poa_tools import load_graphs, save_graphs
+from transcriptResolver import resolve_transcripts, get_method, RESOLVER_METHODS
+from transcriptClean import transcriptCleaner, clean_transcripts, fetch_reference
+
+# Run options a /resolve request may set (see transcriptResolver.resolve_field)
+RESOLVE_OPTIONS = ["workers", "parallel_columns", "mafft_timeout", "mafft_retries", "align_strategy", "align_thresholds", "outlier_threshold"]
+
+
+class ResolverService:
+    ''' Keeps everything a resolve or clean batch needs warm between requests: the imported resolver
+        methods, the consensus cache, the partial order alignment graphs, the volunteer reliability scores,
+        the column pool and the collector/geography reference indexes. A batch is then resolved as it would
+        be in a single run over the whole export, however the rows were batched '''
+    def __init__(self, args):
+        self.args = args
+        self.cache = dict() # (alignment settings, variants) -> consensus, shared by all requests
+        self.cache_size = args.cache_size
+        self.reference = None
+        self.poa_graphs = load_graphs(args.poa) # grown by every consensus_poa request
+        self.executor = ThreadPoolExecutor(max_workers = max(1, args.workers))
+
+        # weighted_vote scores are those of the whole export (see transcriptResolver.py), not of one batch
+        self.reliability = None
+        if args.reliability:
+            print("\nLoading volunteer reliability scores ...")
+            self.reliability = read_reliability(args.reliability)
+
+        print("\nLoading resolver methods ...")
+        for method in RESOLVER_METHODS:
+            get_method(method)
+
+        if not args.no_clean:
+            print("\nLoading reference indexes ...")
+            self.load_reference()
+
+    def load_reference(self):
+        self.reference = load_snapshot(self.args.reference, max_age_days = self.args.reference_max_age)
+        if self.reference is None:
+            self.reference = fetch_reference(self.args)
+            save_snapshot(self.reference, self.args.reference)
+        self.reference_loaded = time.time()
+
+    def check_reference(self):
+        ''' Reloads the reference indexes once they are older than -reference_max_age days '''
+        if self.args.reference_max_age is not None and time.time() - self.reference_loaded > self.args.reference_max_age * 86400:
+            self.load_reference()
+
+    def trim_cache(self):
+        # dictionaries keep insertion order, so the oldest results are dropped first
+        while len(self.cache) > self.cache_size:
+            del self.cache[next(iter(self.cache))]
+
+    def resolve(self, request):
+        ''' Resolves a batch of transcriptions
+
+            Arguments:
+            request -- dictionary with "rows" (list of transcriptions, column -> value), "col_id",
+                       "col_target" and "col_method" (lists), and optional "options" (see RESOLVE_OPTIONS)
+
+            Returns:
+            dictionary with the resolved "rows"
+        '''
+        for key in ["rows", "col_id", "col_target", "col_method"]:
+            if key not in request:
+                raise Exception("Missing '" + key + "' in the resolve request")
+        if len(request["col_target"]) != len(request["col_method"]):
+            raise Exception("col_target and col_method must have the same number of entries")
+
+        options = {"workers": self.args.workers}
+        for name, value in request.get("options", dict()).items():
+            if name not in RESOLVE_OPTIONS:
+                raise Exception("Option '" + name + "' is not valid. Must be one of: " + ", ".join(RESOLVE_OPTIONS))
+            options[name] = value
+
+        columns = [request["col_id"]] + list(request["col_target"])
+        if "weighted_vote" in request["col_method"]:
+            if self.reliability is None:
+                raise Exception("weighted_vote needs the volunteer reliability scores of the export; start the service with -reliability")
+            if not all(VOTER_COLUMN in row for row in request["rows"]):
+                raise Exception("weighted_vote needs the '" + VOTER_COLUMN + "' column of every row")
+            columns.append(VOTER_COLUMN)
+        data = pd.DataFrame(request["rows"], columns = columns, dtype = object).fillna("")
+        resolved = resolve_transcripts(data = data,
+                                       col_id = request["col_id"],
+                                       col_target = request["col_target"],
+                                       col_method = request["col_method"],
+                                       wdir = self.args.wd,
+                                       cache = self.cache,
+                                       poa_graphs = self.poa_graphs,
+                                       reliability = self.reliability,
+                                       executor = self.executor,
+                                       **options)
+        self.trim_cache()
+        return {"rows": resolved.to_dict(orient = "records")}
+
+    def clean(self, request):
+        ''' Cleans a batch of resolved transcriptions
+
+            Arguments:
+            request -- dictionary with "rows" (list of resolved transcriptions with the CLEAN_COLUMNS)
+
+            Returns:
+            dictionary with the cleaned "rows" and the logged "errors" (list of [bnhm_id, error])
+        '''
+        if self.reference is None:
+            raise Exception("The service was started with -no_clean")
+        if "rows" not in request:
+            raise Exception("Missing 'rows' in the clean request")
+
+        data = pd.DataFrame(request["rows"], dtype = object)
+        missing = [col for col in CLEAN_COLUMNS if col not in data.columns]
+        if len(missing) > 0:
+            raise Exception("Rows are missing the columns: " + ", ".join(missing))
+
+        self.check_reference()
+        pipeline = transcriptCleaner(self.args, data = data[CLEAN_COLUMNS], reference = self.reference)
+        allClean = clean_transcripts(pipeline)
+        errors = pipeline.errorLog.frame()[["bnhm_id", "error"]].values.tolist()
+        return {"rows": allClean.to_dict(orient = "records"), "errors": errors}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None # ResolverService, set by serve()
+    verbose = False
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", "cache_entries": len(self.service.cache),
+                                 "poa_graphs": sum(len(graphs) for graphs in self.service.poa_graphs.values())})
+        elif self.path == "/metrics":
+            self.send_json(200, metrics.summary())
+        else:
+            self.send_json(404, {"error": "Unknown endpoint " + self.path})
+
+    def do_POST(self):
+        endpoints = {"/resolve": self.service.resolve, "/clean": self.service.clean}
+        if self.path not in endpoints:
+            self.send_json(404, {"error": "Unknown endpoint " + self.path})
+            return
+
+        start = time.perf_counter()
+        metrics.incr("service.requests")
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+            # The resolver and cleaner report their progress on stdout; keep it out of the service log
+            output = contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+            with output, metrics.stage("service" + self.path):
+                body = endpoints[self.path](request)
+        except Exception as e:
+            metrics.incr("service.errors")
+            self.send_json(400, {"error": str(e)})
+            return
+
+        elapsed = time.perf_counter() - start
+        metrics.observe("service" + self.path, elapsed)
+        body["elapsed_ms"] = 1000 * elapsed
+        self.send_json(200, body)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "local"
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def serve(args):
+    ''' Starts the service and handles requests (one at a time) until interrupted '''
+    ServiceHandler.service = ResolverService(args)
+    ServiceHandler.verbose = args.verbose
+
+    if args.socket:
+        server = UnixHTTPServer(args.socket, ServiceHandler)
+        address = "unix:" + args.socket
+    else:
+        server = HTTPServer((args.host, args.port), ServiceHandler)
+        address = "http://%s:%d" % (args.host, server.server_port)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop) # stop cleanly under process managers too
+
+    print("\nResolver service listening on", address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping resolver service")
+    finally:
+        server.server_close()
+        ServiceHandler.service.executor.shutdown()
+        if args.poa:
+            save_graphs(ServiceHandler.service.poa_graphs, args.poa)
+            print("\nPartial order alignment graphs written to", args.poa)
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+        if args.metrics:
+            metrics.write(args.metrics)
+            print("\nMetrics written to", args.metrics)
+
+## MAIN ##
+def main():
+    args = parser.parse_args()
+    serve(args)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="resolverService - resolve and clean batches of transcriptions over a local HTTP or Unix socket")
+    parser.add_argument("-host", default = "127.0.0.1", help = "Address to listen on")
+    parser.add_argument("-port", type = int, default = 8765, help = "Port to listen on")
+    parser.add_argument("-socket", help = "Listen on this Unix socket instead of a TCP port")
+    parser.add_argument("-wd", default = ".", help = "Working directory for temporary alignment files")
+    parser.add_argument("-workers", type = int, default = 1, help = "Number of concurrent MAFFT alignments per request")
+    parser.add_argument("-cache_size", type = int, default = 100000, help = "Maximum number of cached consensus results")
+    parser.add_argument("-poa", help = "Partial order alignment graph file, read at startup and written when the service stops, so consensus_poa requests build on earlier ones")
+    parser.add_argument("-reliability", help = "Volunteer reliability scores of the export (written by transcriptResolver.py), used by weighted_vote requests")
+    parser.add_argument("-no_clean", action = "store_true", help = "Only serve /resolve (no reference indexes are loaded)")
+    parser.add_argument("-username", help = "Username. Access to essig SQL database")
+    parser.add_argument("-password", help = "Password. Access to essig SQL database")
+    parser.add_argument("-sqlite", help = "SQLite stand-in for the essig database (see db_tools.create_standin)")
+    parser.add_argument("-reference", default = SNAPSHOT_FILE, help = "Reference snapshot file (see transcriptClean.py -build_reference)")
+    parser.add_argument("-reference_max_age", type = float, default = 7, help = "Days after which the reference indexes are reloaded")
+    parser.add_argument("-geo_threshold", type = float, help = "Accept fuzzy country, state and county matches at least this similar (0 to 1); exact matches only if not given")
+    parser.add_argument("-verbose", action = "store_true", help = "Print the resolver and cleaner progress and every request")
+    parser.add_argument("-metrics", help = "Metrics output file (.json or .csv), written when the service stops")
+    main()
@@ -0,0 +1,84 @@
+## SHARD TOOLS
+# Description: Splits a transcription export into shards by accession, so each shard can be resolved on a
+#              different machine, and merges the shard outputs back into a single result
+#
+# Notes:
+# Rows go to shard crc32(accession) mod N (Python's own string hash is randomized per process), so every
+# replicate of an accession lands in the same shard and a shard can be resolved on its own. The shard step
+# also writes the order in which accessions first appear in the export; the merge puts the shard outputs
+# back in that order, which is the order of a single-node run
+
+
+## DEPENDENCIES
+import os # Path tools
+import zlib # crc32 accession hashes
+import numpy as np
+import pandas as pd # data frame functionality
+
+from io_tools import ENCODING
+
+
+def parse_shard(shard):
+    ''' Parses a shard specification "i/N" (1 <= i <= N)
+
+        Returns:
+        a tuple of 2 integers - the shard index and the number of shards
+    '''
+    try:
+        index, count = [int(x) for x in shard.split("/")]
+    except ValueError:
+        raise Exception("Shard must be in the format i/N (e.g. 2/8), not '" + shard + "'")
+    if count < 1 or not 1 <= index <= count:
+        raise Exception("Shard index must be between 1 and the number of shards, not '" + shard + "'")
+    return index, count
+
+
+def shard_of(accessions, count):
+    ''' Shard index (1 to count) of every accession '''
+    hashes = np.fromiter((zlib.crc32(str(x).encode("utf-8")) for x in accessions), dtype = np.int64, count = len(accessions))
+    return hashes % count + 1
+
+
+def shard_stem(stem, index, count):
+    ''' Stem of the files of one shard, e.g. "calbug_shard2of8_" '''
+    return stem + "shard" + str(index) + "of" + str(count) + "_"
+
+
+def order_file(wd, stem):
+    return os.path.join(wd, stem + "shard_order.csv")
+
+
+def write_shards(data, col_id, count, wd, stem):
+    ''' Writes the rows of each shard (in their original order) to <stem>shard<i>of<N>_input.csv and the
+        accession order to <stem>shard_order.csv
+
+        Returns:
+        list of the shard files
+    '''
+    shards = shard_of(data[col_id].to_numpy(), count)
+    paths = []
+    for index in range(1, count + 1):
+        path = os.path.join(wd, shard_stem(stem, index, count) + "input.csv")
+        data[shards == index].to_csv(path, index = False, encoding = ENCODING)
+        paths.append(path)
+    pd.DataFrame({col_id: pd.unique(data[col_id])}).to_csv(order_file(wd, stem), index = False)
+    return paths
+
+
+def merge_shards(wd, stem, count):
+    ''' Combines the resolved shards (<stem>shard<i>of<N>_transcript.csv) in the order of the original export
+
+        Returns:
+        a pandas.core.frame.Dataframe object
+    '''
+    paths = [os.path.join(wd, shard_stem(stem, index, count) + "transcript.csv") for index in range(1, count + 1)]
+    missing = [str(index) for index, path in enumerate(paths, 1) if not os.path.exists(path)]
+    if len(missing) > 0:
+        raise Exception("Shards not resolved yet: " + ", ".join(missing) + " (of " + str(count) + ")")
+
+    order = pd.read_csv(order_file(wd, stem), dtype = object, keep_default_na = False)
+    col_id = order.columns[0]
+    merged = pd.concat([pd.read_csv(path, dtype = object, keep_default_na = False) for path in paths], ignore_index = True)
+    if len(merged) != len(order) or not merged[col_id].isin(order[col_id]).all():
+        raise Exception("The shard outputs do not match the accessions in " + order_file(wd, stem) + "; were they resolved from the same shard step?")
+    return merged.set_index(col_id).loc[order[col_id]].reset_index()
@@ -0,0 +1,195 @@
+## SYNTHETIC TOOLS
+# Description: Generates synthetic replicate transcriptions shaped like a Notes from Nature export,
+#              together with the ground truth each replicate was derived from
+#
+# Notes:
+# Columns mirror tests/raw_transcript.csv so the output can be fed straight into transcriptResolver
+# The generator is seeded, so the same arguments always produce the same export
+
+
+## DEPENDENCIES
+import os # Path tools
+import random # Seeded random numbers
+import string # String tools
+import argparse # For command line arguments
+import pandas as pd # data frame functionality
+
+
+# Column order of a raw Notes from Nature export (see tests/raw_transcript.csv)
+NFN_COLUMNS = ["id", "collection", "subject_id", "filename", "user_name", "created_at",
+               "Begin Date Collected", "Collector", "Country", "County", "Date collected",
+               "Elevation", "End Date Collected", "Host", "Latitude and Longitude", "Locality",
+               "Other Notes", "State/Province", "skipped", "started_at", "finished_at"]
+
+# Free-text fields receive typo, case and drop-out noise; constrained fields only drop-out noise
+FREE_TEXT_FIELDS = ["Collector", "County", "Locality", "Host", "Other Notes"]
+CONSTRAINED_FIELDS = ["Begin Date Collected", "Country", "State/Province"]
+
+INSTITUTIONS = ["EMEC", "CIS", "LACMENT", "CASENT", "UCBME", "UCRCENT", "SDNHM"]
+GENERA = ["Agapostemon", "Lasioglossum", "Cicindela", "Pyrgus", "Nysson", "Bombus", "Archilestes", "Smerinthus"]
+EPITHETS = ["texanus", "lineatulum", "nebraskana", "communis", "plagiatus", "vosnesenskii", "californica", "cerisyi"]
+COLLECTORS = ["e. g. linsley", "j. w. macswain", "j. powell", "p. d. hurd", "r. m. bohart",
+              "j. a. chemsak", "a. e. michelbacher", "c. w. o'brien", "e. i. schlinger", "b. benzon"]
+LOCATIONS = [("United States", "CA", "Alameda"), ("United States", "CA", "Tulare"),
+             ("United States", "AZ", "Cochise"), ("United States", "TX", "Cameron"),
+             ("United States", "UT", "Beaver"), ("United States", "MN", "Clay"),
+             ("Mexico", "Sonora", ""), ("Canada", "British Columbia", "")]
+LOCALITY_WORDS = ["mi", "N", "S", "E", "W", "of", "Berkeley", "Strawberry", "Canyon", "Creek", "Mts.",
+                  "Portal", "Chiricahua", "Lake", "Tahoe", "Rd.", "Hwy", "Jct.", "Sierra", "Ranch", "Pass",
+                  "Valley", "Spring", "Station", "nr.", "Moorhead", "El", "Modena", "Harlingen", "Paradise"]
+HOSTS = ["Helianthus annuus", "Eriogonum", "Salix", "Baccharis pilularis", "Quercus agrifolia"]
+
+
+def _hex_id(rng):
+    ''' Random 24 character hexadecimal id, like the Zooniverse object ids '''
+    return "%024x" % rng.getrandbits(96)
+
+
+def _free_text(rng, length):
+    ''' Builds a locality-like phrase of roughly the requested number of characters '''
+    words = []
+    while len(" ".join(words)) < length:
+        if rng.random() < 0.2:
+            words.append(str(rng.randint(1, 30)))
+        else:
+            words.append(rng.choice(LOCALITY_WORDS))
+    return " ".join(words)
+
+
+def add_typos(x, rate, rng):
+    ''' Applies random character substitutions, deletions and insertions
+
+        Arguments:
+        x       -- string to perturb
+        rate    -- per character probability of a typo
+        rng     -- random.Random instance
+
+        Returns:
+        Perturbed string
+    '''
+    if rate <= 0:
+        return x
+
+    out = []
+    for char in x:
+        if rng.random() >= rate:
+            out.append(char)
+            continue
+
+        edit = rng.random()
+        if edit < 0.5: # substitution
+            out.append(rng.choice(string.ascii_lowercase))
+        elif edit < 0.75: # deletion
+            pass
+        else: # insertion
+            out.append(char)
+            out.append(rng.choice(string.ascii_lowercase))
+    return "".join(out)
+
+
+def add_case_noise(x, rate, rng):
+    ''' Randomly changes the case of the whole string (lower, upper or title case) '''
+    if rate <= 0 or rng.random() >= rate:
+        return x
+    return rng.choice([str.lower, str.upper, str.title])(x)
+
+
+def generate_transcripts(n_accessions = 100, n_replicates = 4, field_length = 30,
+                         typo_rate = 0.02, case_rate = 0.1, dropout_rate = 0.05, junk_rate = 0, seed = 1):
+    ''' Generates a synthetic Notes from Nature export with known ground truth
+
+        Arguments:
+        n_accessions    -- int, number of specimens (unique subject_id values)
+        n_replicates    -- int, number of replicate transcriptions per specimen
+        field_length    -- int, approximate length in characters of the Locality field
+        typo_rate       -- float, per character probability of a typo in free-text fields
+        case_rate       -- float, probability that a free-text field has its case changed
+        dropout_rate    -- float, probability that a volunteer leaves a field empty
+        junk_rate       -- float, probability that a free-text field is replaced by unrelated text
+                           (the field of another specimen, or random words)
+        seed            -- int, random seed
+
+        Returns:
+        a tuple of 2 pandas.core.frame.DataFrame objects - the replicate transcriptions,
+        with the columns of a raw export, and the ground truth, one row per subject_id
+    '''
+    rng = random.Random(seed)
+    users = ["volunteer%d" % i for i in range(max(10, n_accessions // 5))]
+
+    rows = []
+    truths = []
+    for acc in range(n_accessions):
+        genus = rng.randrange(len(GENERA))
+        country, state, county = rng.choice(LOCATIONS)
+        truth = {"subject_id": _hex_id(rng),
+                 "filename": "%s%d %s %s.jpg" % (rng.choice(INSTITUTIONS), rng.randint(100000, 999999),
+                                                  GENERA[genus], EPITHETS[genus]),
+                 "Begin Date Collected": "%02d/%02d/%d" % (rng.randint(1, 12), rng.randint(1, 28), rng.randint(1900, 1990)),
+                 "Collector": rng.choice(COLLECTORS),
+                 "Country": country,
+                 "State/Province": state,
+                 "County": county,
+                 "Locality": _free_text(rng, field_length),
+                 "Host": rng.choice(HOSTS) if rng.random() < 0.2 else "",
+                 "Other Notes": ""}
+        truths.append(truth)
+
+        for rep in range(n_replicates):
+            row = dict.fromkeys(NFN_COLUMNS, "")
+            row["id"] = _hex_id(rng)
+            row["collection"] = "Calbug"
+            row["subject_id"] = truth["subject_id"]
+            row["filename"] = truth["filename"]
+            row["user_name"] = rng.choice(users)
+            row["created_at"] = "2013-07-%02d 17:%02d:%02d UTC" % (rng.randint(1, 28), rng.randint(0, 59), rng.randint(0, 59))
+            row["started_at"] = row["finished_at"] = "Wed, 10 Jul 2013 17:34:40 GMT"
+
+            for field in CONSTRAINED_FIELDS:
+                row[field] = "" if rng.random() < dropout_rate else truth[field]
+
+            for field in FREE_TEXT_FIELDS:
+                if rng.random() < dropout_rate:
+                    continue
+                if junk_rate > 0 and len(truths) > 1 and rng.random() < junk_rate:
+                    other = rng.choice(truths[:-1])[field]
+                    row[field] = other if other != "" and rng.random() < 0.5 else _free_text(rng, field_length)
+                    continue
+                value = add_typos(truth[field], typo_rate, rng)
+                row[field] = add_case_noise(value, case_rate, rng)
+
+            rows.append(row)
+
+    transcripts = pd.DataFrame(rows, columns = NFN_COLUMNS)
+    truth = pd.DataFrame(truths)
+    return transcripts, truth
+
+
+def main():
+    args = parser.parse_args()
+    transcripts, truth = generate_transcripts(n_accessions = args.accessions,
+                                              n_replicates = args.replicates,
+                                              field_length = args.length,
+                                              typo_rate = args.typo,
+                                              case_rate = args.case,
+                                              dropout_rate = args.dropout,
+                                              junk_rate = args.junk,
+                                              seed = args.seed)
+
+    stem = args.stem + "_" if args.stem else ""
+    transcripts.to_csv(os.path.join(args.wd, stem + "synthetic_transcript.csv"), index = False)
+    truth.to_csv(os.path.join(args.wd, stem + "synthetic_truth.csv"), index = False)
+    print("\nExported", len(transcripts), "transcriptions of", len(truth), "specimens to", args.wd)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="synthetic_tools - generate synthetic replicate transcriptions")
+    parser.add_argument("-wd", default = ".", help = "Working directory")
+    parser.add_argument("-stem", "-n", help = "'Stem' name for all output files.")
+    parser.add_argument("-accessions", type = int, default = 100, help = "Number of specimens")
+    parser.add_argument("-replicates", type = int, default = 4, help = "Replicate transcriptions per specimen")
+    parser.add_argument("-length", type = int, default = 30, help = "Approximate length of the Locality field")
+    parser.add_argument("-typo", type = float, default = 0.02, help = "Per character typo rate")
+    parser.add_argument("-case", type = float, default = 0.1, help = "Probability of case noise per field")
+    parser.add_argument("-dropout", type = float, default = 0.05, help = "Probability of an empty field")
+    parser.add_argument("-junk", type = float, default = 0, help = "Probability of an unrelated (junk) free-text field")
+    parser.add_argument("-seed", type = int, default = 1, help = "Random seed")
+    main()
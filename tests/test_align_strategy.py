@@ -0,0 +1,38 @@
+# Tests of the per-accession choice of the character alignment strategy
+# Usage: python3 -m pytest tests
+
+import os
+import sys
+import asyncio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from consensus_tools import choose_align_strategy, centerstar_character_align, align_accessions
+
+
+def test_auto_strategy_thresholds():
+    close = ["Hayfork_Ranger_Station", "Hayfork_Ranger_Statin", "Hayfork_Ranger_Station", "Hayfork_Rangr_Station"]
+    divergent = ["Hayfork_Ranger_Station", "Hayfork_Rgr%_Sta%", "Trinity_Co%", "Hayfork"]
+    assert choose_align_strategy(close[:3]) == "centerstar"
+    assert choose_align_strategy(close) == "fftns2"
+    assert choose_align_strategy(divergent) == "linsi"
+    assert choose_align_strategy(close, {"centerstar_max_variants": 5}) == "centerstar"
+    assert choose_align_strategy(close, {"fast_max_divergence": 0.0}) == "linsi"
+
+
+def test_centerstar_rows_keep_every_string():
+    y = ["Hayfork_Ranger_Station", "Hayfork_Rgr%_Sta%", "Hayfork_Ranger_Statoin"]
+    aligned = centerstar_character_align(y)
+    assert len(set(len(row) for row in aligned)) == 1
+    assert [row.replace("-", "") for row in aligned] == y
+
+
+def test_align_accessions_inside_a_running_event_loop():
+    jobs = [("a", ["Hayfork Ranger Station"] * 3), ("b", ["Trinity Co.", "Trinity Co.", "Trinity Co"])]
+    expected = align_accessions(jobs, "dumber", align_strategy = "centerstar")
+
+    async def caller():
+        return align_accessions(jobs, "dumber", align_strategy = "centerstar")
+    assert asyncio.run(caller()) == expected
+    assert expected[0] == {"a": "Hayfork Ranger Station", "b": "Trinity Co."}
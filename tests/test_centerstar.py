@@ -0,0 +1,40 @@
+# Tests of the built-in center-star character aligner (consensus_centerstar)
+# Usage: python3 -m pytest tests
+
+import os
+import sys
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from consensus_tools import levenshtein_align, center_star_align, variant_consensus
+
+
+def test_levenshtein_align():
+    a, b, distance = levenshtein_align("Hayfork", "Hayfrok")
+    assert distance == 2
+    assert len(a) == len(b)
+    assert "".join(x for x in a if x is not None) == "Hayfork"
+    assert "".join(x for x in b if x is not None) == "Hayfrok"
+
+
+def test_center_star_rows_keep_every_string():
+    from Levenshtein import distance
+
+    seqs = ["Hayfork Ranger Station", "Hayfork Ranger Statoin", "Hayfork Rgr. Sta.", "Hayfork Ranger Station"]
+    rows = center_star_align(seqs, align = levenshtein_align, distance = distance)
+    assert len(set(len(row) for row in rows)) == 1
+    assert ["".join(x for x in row if x is not None) for row in rows] == seqs
+    assert rows[0] == rows[3] # identical strings are aligned identically
+
+
+def test_consensus_centerstar_needs_no_mafft(tmp_path):
+    data = pd.DataFrame({"subject_id": ["a"] * 3 + ["b"] * 3,
+                         "Locality": ["Hayfork Ranger Station", "Hayfork Ranger Statoin", "Hayfork Ranger Station",
+                                      "Trinity Co.", "Trinity Co.", "Trinity Co"]}, dtype = object)
+    result = variant_consensus("subject_id", "Locality", data, align_method = "character", consensus_method = "dumber",
+                               wdir = str(tmp_path), align_strategy = "centerstar")
+    assert list(result["subject_id"]) == ["a", "b"]
+    assert list(result["Locality"]) == ["Hayfork Ranger Station", "Trinity Co."]
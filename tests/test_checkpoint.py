@@ -0,0 +1,45 @@
+# Tests of the checkpoint of resolved accessions (-resume)
+# Usage: python3 -m pytest tests
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from checkpoint_tools import Checkpoint
+
+
+def test_resume_reads_back_flushed_results(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    checkpoint = Checkpoint(path, interval = 3600)
+    checkpoint.record("Locality", "a", "Hayfork")
+    checkpoint.record("Collector", "a", "J. Smith")
+    assert not os.path.exists(path) # buffered until the interval has passed
+    checkpoint.flush()
+
+    resumed = Checkpoint(path, resume = True)
+    assert resumed.completed("Locality") == {"a": "Hayfork"}
+    assert resumed.completed("Collector") == {"a": "J. Smith"}
+    assert resumed.completed("County") == dict()
+
+
+def test_a_line_cut_short_by_a_crash_is_ignored(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    checkpoint = Checkpoint(path, interval = 0)
+    checkpoint.record("Locality", "a", "Hayfork")
+    with open(path, "a", encoding = "utf-8") as f:
+        f.write('{"field": "Locality", "accession": "b", "val')
+    assert Checkpoint(path, resume = True).completed("Locality") == {"a": "Hayfork"}
+
+
+def test_a_new_run_discards_the_checkpoint(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    Checkpoint(path, interval = 0).record("Locality", "a", "Hayfork")
+    assert Checkpoint(path).completed("Locality") == dict()
+    assert not os.path.exists(path)
+
+    checkpoint = Checkpoint(path, interval = 0)
+    checkpoint.record("Locality", "a", "Hayfork")
+    checkpoint.close(remove = True) # the run finished
+    assert not os.path.exists(path)
@@ -0,0 +1,32 @@
+# Tests of the columnar error log of transcriptClean
+# Usage: python3 -m pytest tests
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from transcriptClean import ErrorLog, ERROR_MESSAGES
+
+
+def test_one_row_per_logged_error():
+    log = ErrorLog()
+    log.add(["EMEC1", "EMEC2"], "duplicates", "duplicate")
+    log.add([], "dates", "incomplete_begin_date") # a check that no row fails logs nothing
+    other = ErrorLog()
+    other.add(["EMEC3"], "dates", "nonsensical_end_date")
+    log.extend(other)
+
+    assert len(log) == 3
+    frame = log.frame()
+    assert list(frame.columns) == ["bnhm_id", "stage", "code", "error"]
+    assert list(frame["bnhm_id"]) == ["EMEC1", "EMEC2", "EMEC3"]
+    assert list(frame["stage"]) == ["duplicates", "duplicates", "dates"]
+    assert list(frame["error"]) == [ERROR_MESSAGES["duplicate"]] * 2 + [ERROR_MESSAGES["nonsensical_end_date"]]
+
+
+def test_empty_log():
+    log = ErrorLog()
+    assert len(log) == 0
+    assert len(log.frame()) == 0 and list(log.frame().columns) == ["bnhm_id", "stage", "code", "error"]
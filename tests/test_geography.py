@@ -0,0 +1,39 @@
+# Tests of the hierarchical fuzzy geography matcher (-geo_threshold)
+# Usage: python3 -m pytest tests
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from reference_tools import load_reference_csvs, geography_index
+from geography_tools import GeographyMatcher
+
+GEOGRAPHY = geography_index(load_reference_csvs(os.path.join(ROOT, "reference")))
+
+
+def test_exact_matches():
+    matcher = GeographyMatcher(GEOGRAPHY)
+    assert matcher.country("United States") == ("United States", 1.0)
+    assert matcher.state("CA", "United States") == ("California", 1.0)
+    assert matcher.county("Trinity", "California") == ("Trinity", 1.0)
+    assert matcher.country("") == ("NA", "NA")
+    assert matcher.country("Untied States") == ("NA", 0.0) # no fuzzy matching without a threshold
+
+
+def test_fuzzy_matches_follow_the_hierarchy():
+    matcher = GeographyMatcher(GEOGRAPHY, threshold = 0.85)
+    country, score = matcher.country("Untied States")
+    assert country == "United States" and 0.85 <= score < 1
+    assert matcher.state("Califronia", "United States")[0] == "California"
+    assert matcher.county("Trinty", "California")[0] == "Trinity"
+    # Candidates only come from the resolved parent
+    assert matcher.state("Califronia", "Mexico")[0] == "NA"
+    assert matcher.country("Atlantis")[0] == "NA"
+
+
+def test_continent_of_a_country():
+    matcher = GeographyMatcher(GEOGRAPHY)
+    assert matcher.continent("Mexico") == GEOGRAPHY["country"]["Mexico"]
+    assert matcher.continent("Atlantis") == "NA"
@@ -0,0 +1,36 @@
+# Tests of the MinHash outlier filter applied before alignment (-outlier_threshold)
+# Usage: python3 -m pytest tests
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from minhash_tools import shingles, signature, similarity_matrix, filter_outliers
+
+
+def test_shingles_ignore_case_and_spacing():
+    assert shingles("Hay  Fork") == shingles("hay fork")
+    assert shingles("ab") == {"ab"}
+
+
+def test_signatures_are_deterministic():
+    assert (signature("Hayfork Ranger Station") == signature("Hayfork Ranger Station")).all()
+    similarity = similarity_matrix(["Hayfork Ranger Station", "Hayfork Ranger Station", "zzqx"])
+    assert similarity[0, 1] == 1.0 and similarity[0, 2] < 0.2
+
+
+def test_junk_transcriptions_are_dropped():
+    x = ["Hayfork Ranger Station", "asdf qwerty", "Hayfork Ranger Statoin", "Hayfork Ranger Station"]
+    kept, dropped = filter_outliers(x, 0.3)
+    assert dropped == ["asdf qwerty"]
+    assert kept == [x[0], x[2], x[3]]
+
+
+def test_nothing_is_dropped_without_a_clear_majority():
+    # Too few transcriptions to compare, empty strings, and two equally sized clusters are all kept
+    assert filter_outliers(["Hayfork", "asdf qwerty"], 0.3) == (["Hayfork", "asdf qwerty"], [])
+    assert filter_outliers(["", "", "Hayfork", "Hayfork"], 0.3)[1] == []
+    x = ["Hayfork Ranger Station", "Hayfork Ranger Station", "Trinity County", "Trinity County"]
+    assert filter_outliers(x, 0.3) == (x, [])
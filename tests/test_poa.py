@@ -0,0 +1,76 @@
+# Tests of the partial order alignment consensus (consensus_poa)
+# Usage: python3 -m pytest tests
+
+import os
+import sys
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from poa_tools import POAGraph, poa_consensus
+
+
+def graph_of(seqs):
+    graph = POAGraph()
+    for seq in seqs:
+        graph.add_sequence(seq)
+    return graph
+
+
+def test_every_transcription_is_a_path_through_the_graph():
+    seqs = ["Hayfork Ranger Station", "Hayfork Rangr Station", "Hayfork Ranger Statoin"]
+    graph = graph_of(seqs)
+    for seq, path in zip(graph.sequences, graph.paths):
+        assert "".join(graph.bases[node] for node in path) == seq
+    assert sum(graph.weights) == sum(len(seq) for seq in seqs)
+    graph.topological_order() # acyclic
+
+
+def test_consensus_keeps_majority_characters():
+    assert graph_of(["Hayfork"] * 3).consensus() == "Hayfork"
+    assert graph_of(["Hayfork Ranger Station", "Hayfork Rangr Station", "Hayfork Ranger Station"]).consensus() == "Hayfork Ranger Station"
+    assert graph_of(["Trinity Co.", "Trinity Co.", "Trinity Co"]).consensus() == "Trinity Co."
+
+
+def test_graph_round_trips_through_json():
+    graph = graph_of(["Hayfork Ranger Station", "Hayfork Rangr Station"])
+    copy = POAGraph.from_dict(graph.to_dict())
+    assert copy.to_dict() == graph.to_dict()
+    copy.add_sequence("Hayfork Ranger Station")
+    graph.add_sequence("Hayfork Ranger Station")
+    assert copy.consensus() == graph.consensus()
+
+
+def test_stored_graphs_absorb_new_transcriptions():
+    first = pd.DataFrame({"subject_id": ["a", "a", "b", "b"],
+                          "Locality": ["Hayfork Ranger Station", "Hayfork Rangr Station", "Trinity Co.", "Trinity Co"]}, dtype = object)
+    more = pd.concat([first, pd.DataFrame({"subject_id": ["a", "b"], "Locality": ["Hayfork Ranger Station", "Trinity Co."]})],
+                     ignore_index = True)
+
+    graphs = dict()
+    poa_consensus("subject_id", "Locality", first, poa_graphs = graphs)
+    incremental = poa_consensus("subject_id", "Locality", more, poa_graphs = graphs)
+    assert incremental.equals(poa_consensus("subject_id", "Locality", more))
+    assert len(graphs["Locality"]["a"]["sequences"]) == 3
+
+    # A transcription the stored graph holds is gone: the graph is rebuilt
+    fewer = more.drop(index = 0)
+    assert poa_consensus("subject_id", "Locality", fewer, poa_graphs = graphs).equals(poa_consensus("subject_id", "Locality", fewer))
+
+
+def test_consensus_follows_the_branch_most_transcriptions_took():
+    # The minority branch is longer, so it has the larger summed edge weight
+    seqs = ["Hayfork Rgr. Sta."] * 3 + ["Hayfork Ranger Station"]
+    assert graph_of(seqs).consensus() == "Hayfork Rgr. Sta."
+    assert graph_of(seqs[::-1]).consensus() == "Hayfork Rgr. Sta."
+    assert graph_of(["Hayfork"] * 3 + ["Hayfork Ranger"]).consensus() == "Hayfork"
+
+    # Adding the transcriptions to a stored graph gives the same consensus as building it at once
+    data = pd.DataFrame({"subject_id": ["a"] * 4, "Locality": seqs}, dtype = object)
+    graphs = dict()
+    poa_consensus("subject_id", "Locality", data.iloc[:2], poa_graphs = graphs)
+    incremental = poa_consensus("subject_id", "Locality", data, poa_graphs = graphs)
+    assert list(incremental["Locality"]) == ["Hayfork Rgr. Sta."]
+    assert incremental.equals(poa_consensus("subject_id", "Locality", data))
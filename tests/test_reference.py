@@ -0,0 +1,52 @@
+# Tests of the reference snapshot of transcriptClean (-reference, -build_reference)
+# Usage: python3 -m pytest tests
+
+import os
+import sys
+import shutil
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import reference_tools
+from reference_tools import build_reference_snapshot, save_snapshot, load_snapshot
+
+COLLECTORS = pd.DataFrame({"name_full": ["John Smith", "Jane Doe"], "name_short": ["=J. Smith, Smith J.", None]})
+
+
+def snapshot_dir(tmp_path):
+    ''' Copy of the reference CSVs, so they can be touched, and a snapshot built from them '''
+    ref_dir = str(tmp_path / "reference")
+    shutil.copytree(os.path.join(ROOT, "reference"), ref_dir)
+    path = os.path.join(ref_dir, "snapshot.pkl")
+    save_snapshot(build_reference_snapshot(COLLECTORS, ref_dir = ref_dir), path)
+    return ref_dir, path
+
+
+def test_fresh_snapshot_is_loaded(tmp_path):
+    ref_dir, path = snapshot_dir(tmp_path)
+    snapshot = load_snapshot(path, ref_dir = ref_dir)
+    assert snapshot["collector"]["jsmith"] == "John Smith"
+    assert snapshot["collector"]["smithj"] == "John Smith"
+    assert snapshot["collector"]["janedoe"] == "Jane Doe"
+    assert load_snapshot(str(tmp_path / "missing.pkl"), ref_dir = ref_dir) is None
+
+
+def test_stale_snapshots_are_ignored(tmp_path, monkeypatch):
+    ref_dir, path = snapshot_dir(tmp_path)
+
+    # Too old
+    assert load_snapshot(path, ref_dir = ref_dir, max_age_days = 0) is None
+
+    # Built by another version
+    monkeypatch.setattr(reference_tools, "SNAPSHOT_VERSION", reference_tools.SNAPSHOT_VERSION + 1)
+    assert load_snapshot(path, ref_dir = ref_dir) is None
+    monkeypatch.undo()
+    assert load_snapshot(path, ref_dir = ref_dir) is not None
+
+    # A reference CSV changed since
+    with open(os.path.join(ref_dir, "essig_inst.csv"), "a") as f:
+        f.write("\n")
+    assert load_snapshot(path, ref_dir = ref_dir) is None
@@ -0,0 +1,137 @@
+# Tests of transcriptResolver results that must not depend on how (or in how many processes) a file is resolved
+# Usage: python3 -m pytest tests
+
+import os
+import sys
+import subprocess
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from io_tools import read_transcripts, read_transcript_files
+
+VOTE_TARGET = ["filename", "Country", "State/Province", "County", "Begin Date Collected", "End Date Collected", "id"]
+VOTE_METHOD = ["vote_count", "vote_count", "vote_count", "vote_count", "vote_count", "vote_count", "metadata"]
+
+
+def tie_heavy_export(path):
+    ''' tests/prep_transcript.csv plus a copy of every accession cut down to two replicates, the second with the
+        geography and dates of another accession, so most of the copied fields are 1-1 ties '''
+    data = read_transcripts(os.path.join(ROOT, "tests", "prep_transcript.csv"))
+    pairs = data.groupby("subject_id", sort = False).head(2).reset_index(drop = True)
+    pairs["subject_id"] = pairs["subject_id"] + "tie"
+    second = pairs.duplicated("subject_id").to_numpy()
+    for field in ["Country", "State/Province", "County", "Begin Date Collected"]:
+        pairs.loc[second, field] = pairs[field].to_numpy()[::-1][second]
+    pd.concat([data, pairs], ignore_index = True).to_csv(path, index = False)
+
+
+def resolver(wd, hashseed, *args):
+    env = dict(os.environ, PYTHONHASHSEED = str(hashseed))
+    subprocess.run([sys.executable, os.path.join(ROOT, "transcriptResolver.py"), "-wd", str(wd), "-col_id", "subject_id",
+                    "-col_target", "[" + ",".join(VOTE_TARGET) + "]", "-col_method", "[" + ",".join(VOTE_METHOD) + "]"] + list(args),
+                   cwd = ROOT, env = env, check = True, stdout = subprocess.DEVNULL)
+
+
+def test_sharded_merge_matches_single_node(tmp_path):
+    tie_heavy_export(tmp_path / "ties.csv")
+
+    # Every process gets a different string hash seed, so ties must not depend on hash order
+    resolver(tmp_path, 0, "-stem", "single", "-file", "ties.csv")
+    resolver(tmp_path, 0, "-stem", "sharded", "-file", "ties.csv", "-mode", "shard", "-shards", "3")
+    for index in range(1, 4):
+        resolver(tmp_path, index, "-stem", "sharded", "-shard", "%d/3" % index)
+    resolver(tmp_path, 0, "-stem", "sharded", "-mode", "merge", "-shards", "3")
+
+    single = (tmp_path / "single_transcript.csv").read_bytes()
+    merged = (tmp_path / "sharded_transcript.csv").read_bytes()
+    assert merged == single
+
+
+def test_vote_count_ties_go_to_first_transcribed(tmp_path):
+    from consensus_tools import vote_count
+
+    data = pd.DataFrame({"subject_id": ["a", "a", "b", "b", "b", "b"],
+                         "Country": ["Mexico", "Canada", "", "Canada", "Canada", ""]}, dtype = object)
+    result = vote_count("subject_id", "Country", data)
+    assert list(result["Country"]) == ["Mexico", ""]
+
+
+def test_categorical_vote_count_matches_default(tmp_path):
+    from consensus_tools import vote_count
+
+    tie_heavy_export(tmp_path / "ties.csv")
+    data = read_transcripts(str(tmp_path / "ties.csv"))
+    categorical = read_transcripts(str(tmp_path / "ties.csv"), categorical = True)
+    for field in ["Country", "State/Province", "County"]:
+        assert isinstance(categorical[field].dtype, pd.CategoricalDtype)
+        expected = vote_count("subject_id", field, data)
+        assert vote_count("subject_id", field, categorical).equals(expected)
+
+        # Nor may ties depend on the order of the categories
+        reordered = categorical.copy()
+        reordered[field] = reordered[field].cat.reorder_categories(reordered[field].cat.categories[::-1])
+        assert vote_count("subject_id", field, reordered).equals(expected)
+
+
+def test_split_export_reads_as_one_file(tmp_path):
+    tie_heavy_export(tmp_path / "ties.csv")
+    data = pd.read_csv(tmp_path / "ties.csv", dtype = str)
+    half = len(data) // 2
+    data.iloc[:half].to_csv(tmp_path / "week1.csv", index = False)
+    data.iloc[half:].to_csv(tmp_path / "week2.csv", index = False)
+
+    # Same rows, same categories in the same order (so the same codes) as reading the whole export
+    single = read_transcripts(str(tmp_path / "ties.csv"), categorical = True)
+    split = read_transcript_files([str(tmp_path / "week1.csv"), str(tmp_path / "week2.csv")], categorical = True)
+    assert split.equals(single)
+    for col in single.columns:
+        if isinstance(single[col].dtype, pd.CategoricalDtype):
+            assert list(split[col].cat.categories) == list(single[col].cat.categories)
+
+
+def test_prepared_categories_do_not_depend_on_chunks(tmp_path):
+    from transcriptPrepare import prepare_file
+
+    tie_heavy_export(tmp_path / "ties.csv")
+    whole = prepare_file(str(tmp_path / "ties.csv"), [], "filename", categorical = True)
+    chunked = prepare_file(str(tmp_path / "ties.csv"), [], "filename", categorical = True, chunksize = 50)
+    assert chunked.equals(whole)
+    for col in whole.columns:
+        if isinstance(whole[col].dtype, pd.CategoricalDtype):
+            assert list(chunked[col].cat.categories) == list(whole[col].cat.categories)
+
+    # No rows kept (or read) is an empty frame, not an error
+    pd.read_csv(tmp_path / "ties.csv", nrows = 0).to_csv(tmp_path / "header.csv", index = False)
+    empty = prepare_file(str(tmp_path / "header.csv"), [], "filename", usecols = ["collection", "filename", "Collector"])
+    assert len(empty) == 0 and list(empty.columns) == ["collection", "filename", "Collector"]
+
+
+def test_reliability_cache_is_rescored_when_the_export_changes(tmp_path):
+    from reliability_tools import load_reliability
+
+    data = pd.DataFrame({"subject_id": ["a", "a", "a", "b", "b", "b"], "user_name": ["u1", "u2", "u3", "u1", "u2", "u3"],
+                         "Country": ["Mexico", "Mexico", "Canada", "Chile", "Chile", "Peru"]}, dtype = object)
+    path = str(tmp_path / "volunteer_reliability.csv")
+    first = load_reliability(data, "subject_id", ["Country"], path = path)
+    assert load_reliability(data.astype("category"), "subject_id", ["Country"], path = path) == first
+
+    changed = data.copy()
+    changed["Country"] = ["Mexico", "Canada", "Canada", "Chile", "Peru", "Peru"]
+    assert load_reliability(changed, "subject_id", ["Country"], path = path) != first
+
+    # A shard uses the scores of the whole export as they are
+    export = load_reliability(changed, "subject_id", ["Country"], path = path)
+    assert load_reliability(changed.iloc[:3], "subject_id", ["Country"], path = path, check = False) == export
+
+
+def test_a_lone_vote_is_not_an_unambiguous_majority():
+    from reliability_tools import volunteer_reliability
+
+    data = pd.DataFrame({"subject_id": ["a", "a", "a", "b", "c", "c"], "user_name": ["u1", "u2", "u3", "u1", "u2", "u3"],
+                         "Country": ["Mexico", "Mexico", "Canada", "Chile", "", "Peru"]}, dtype = object)
+    scores = volunteer_reliability(data, "subject_id", ["Country"]).set_index("user_name")
+    assert scores["votes"].to_dict() == {"u1": 1, "u2": 1, "u3": 1}
+    assert scores["agreements"].to_dict() == {"u1": 1, "u2": 1, "u3": 0}
@@ -0,0 +1,50 @@
+# Tests of the token aligner used by the consensus_token method
+# Usage: python3 -m pytest tests
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from consensus_tools import encode_tokens, pairwise_align, center_star_align, column_consensus, token_align
+
+
+def test_tokens_are_encoded_in_order_of_first_appearance():
+    encoded, vocabulary = encode_tokens(["11 mi W Walcott", "W of Walcott"])
+    assert vocabulary == ["11", "mi", "W", "Walcott", "of"]
+    assert encoded == [[0, 1, 2, 3], [2, 4, 3]]
+
+    # The vocabulary is not bounded by an alphabet of placeholder characters
+    encoded, vocabulary = encode_tokens([" ".join("t%d" % i for i in range(1000))])
+    assert len(vocabulary) == 1000 and encoded[0][-1] == 999
+
+
+def test_pairwise_align_is_an_edit_distance_alignment():
+    a, b, distance = pairwise_align([1, 2, 3, 4], [1, 3, 4, 5])
+    assert distance == 2
+    assert len(a) == len(b)
+    assert [x for x in a if x is not None] == [1, 2, 3, 4]
+    assert [x for x in b if x is not None] == [1, 3, 4, 5]
+
+
+def test_center_star_rows_keep_every_sequence():
+    seqs = [[1, 2, 3], [1, 3], [1, 2, 3, 4], [2, 3, 4]]
+    rows = center_star_align(seqs)
+    assert len(set(len(row) for row in rows)) == 1
+    assert [[x for x in row if x is not None] for row in rows] == seqs
+
+
+def test_column_consensus_keeps_majority_items():
+    rows = [[1, 2, None], [1, 2, 3], [1, 5, None]]
+    assert column_consensus(rows, threshold = 0.5) == [1, 2]
+    # A tied column keeps the item of the first row instead of being dropped
+    assert column_consensus([[1, 2], [1, 5], [1, 5], [1, 2]], threshold = 0.5) == [1, 2]
+
+
+def test_token_consensus():
+    assert token_align(["Hayfork Ranger Station"] * 3) == "Hayfork Ranger Station"
+    assert token_align(["11 mi W Walcott", "11 mi W Walcott", "11 mi. W Walcott"]) == "11 mi W Walcott"
+    assert token_align(["near Hayfork", "Hayfork", "Hayfork"]) == "Hayfork"
+    assert token_align(["11 mi W Walcott"] * 2 + ["11 mi. W. Walcott"] * 2) == "11 mi W Walcott"
+    assert token_align(["11 mi. W. Walcott"] * 2 + ["11 mi W Walcott"] * 2) == "11 mi. W. Walcott"
@@ -8,47 +8,130 @@ import csv
 
 from name_splitter import * # Code courtesy of Charles McCallum
 from normalization_tools import *
+from metrics_tools import metrics # stage timers and counters
+from io_tools import read_transcripts, fill_missing, map_strings, CLEAN_COLUMNS
+from reference_tools import *
+from geography_tools import GeographyMatcher # hierarchical country/state/county matching
 from collections import defaultdict # utility functions to create dictionaries
-import pymysql
 import argparse
+import time
 from functools import reduce # for the reduce function
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor # concurrent cleaning stages and startup reads
+from db_tools import query # pooled essig database connections
+
+
+def fetch_reference(args, pool = None):
+    ''' Builds the reference indexes from the essig database (or the -sqlite stand-in) and the reference CSVs.
+        With a concurrent.futures executor as pool, the query and the CSV reads run concurrently '''
+    sqlite = getattr(args, "sqlite", None)
+    if pool is None:
+        essig_collector = query(COLLECTOR_QUERY, args.username, args.password, sqlite = sqlite)
+        references = load_reference_csvs()
+    else:
+        collector_future = pool.submit(query, COLLECTOR_QUERY, args.username, args.password, sqlite = sqlite)
+        references = load_reference_csvs(pool = pool)
+        essig_collector = collector_future.result()
+    
+    #essig_canprov       = pd.read_sql("select * from canadian_provinces", con = conn)
+    #essig_country       = pd.read_sql("select * from country", con = conn)
+    #essig_mexstate      = pd.read_sql("select * from mexican_states", con = conn)
+    #essig_state         = pd.read_sql("select * from state", con = conn)
+    #essig_county        = pd.read_sql("select * from county", con = conn)
+
+    return build_reference_snapshot(essig_collector, references = references)
+
+
+def fix_country(cty):
+    ''' Ad-hoc spelling changes due to differences in Zoouniverse country list and Essig's country name standards '''
+    cty = cty.replace('Afganistan','Afghanistan')
+    cty = cty.replace('United Arab Erimates','United Arab Emirates')
+    cty = cty.replace('Iran','Iran, Islamic Republic of')
+    cty = cty.replace("Cote DIvoire","Cote D'Ivoire")
+    cty = cty.replace("Curaco","Curacao")
+    cty = cty.replace("Korea Sout","Korea, Republic of")
+    cty = cty.replace("Korea South","Korea, Republic of")
+    cty = cty.replace("Korea North","Korea, Democratic People's Republic of")
+    cty = cty.replace("Nambia","Namibia")
+    cty = cty.replace("Philipines","Philippines")
+    cty = cty.replace("Uraguay","Uruguay")
+    cty = cty.replace('Iran','Iran, Islamic Republic of')
+    cty = cty.replace('Great Britain','United Kingdom')
+    cty = cty.replace('Trinidad & Tobago','Trinidad and Tobago')
+    cty = cty.replace('Vietnam','Viet Nam')
+    cty = cty.replace('Antigua & Barbuda','Antigua and Barbuda')
+    cty = re.sub('^US$|^U\\.S\\.$|^U\\.S\\.A\\.$|^USA$|United States of America|united states','United States', cty, flags = re.IGNORECASE)
+    return cty
+
+
+# Error code -> message written to the error log
+ERROR_MESSAGES = {"duplicate": "Potential duplicate",
+                  "incomplete_begin_date": "Incomplete collection begin date",
+                  "incomplete_end_date": "Incomplete collection end date",
+                  "nonsensical_begin_date": "Nonsensical collection begin date",
+                  "nonsensical_end_date": "Nonsensical collection end date"}
+
+class ErrorLog:
+    ''' Errors logged by the cleaning stages as columnar (bnhm_id, stage, code) arrays: a check logs all the
+        rows it fails with one call to add '''
+    def __init__(self):
+        self.chunks = [] # (bnhm_ids, stage, code) per call to add
+
+    def add(self, bnhm_ids, stage, code):
+        bnhm_ids = np.asarray(bnhm_ids, dtype = object)
+        if len(bnhm_ids) > 0:
+            self.chunks.append((bnhm_ids, stage, code))
+
+    def extend(self, other):
+        self.chunks.extend(other.chunks)
+
+    def __len__(self):
+        return sum(len(bnhm_ids) for bnhm_ids, stage, code in self.chunks)
+
+    def frame(self):
+        ''' Returns a pandas.core.frame.Dataframe object with one row (bnhm_id, stage, code, error) per error '''
+        if len(self.chunks) == 0:
+            return pd.DataFrame(columns = ["bnhm_id", "stage", "code", "error"])
+        sizes = [len(bnhm_ids) for bnhm_ids, stage, code in self.chunks]
+        codes = np.repeat([code for bnhm_ids, stage, code in self.chunks], sizes)
+        return pd.DataFrame({"bnhm_id": np.concatenate([bnhm_ids for bnhm_ids, stage, code in self.chunks]),
+                             "stage": np.repeat([stage for bnhm_ids, stage, code in self.chunks], sizes),
+                             "code": codes,
+                             "error": [ERROR_MESSAGES[code] for code in codes]})
 
 
 class transcriptCleaner:
-    def __init__(self, args):
+    def __init__(self, args, data = None, reference = None):
         
-        ## IMPORTING FILE ========================
-        print("\nImporting file")
-        if args.wd:
-            data = pd.read_csv(os.path.join(args.wd, args.file), encoding = "ISO-8859-1", dtype = "object")
-        else:
-            data = pd.read_csv(args.file, encoding = "ISO-8859-1", dtype = "object")
+        # The input file, the database query and the reference CSVs are independent reads, so they are
+        # issued together and startup takes as long as the slowest of them
+        with ThreadPoolExecutor(max_workers = 4) as pool:
+            ## IMPORTING FILE ========================
+            # Resolved transcriptions can also be passed in directly (e.g., by transcriptPipeline)
+            if data is None:
+                print("\nImporting file")
+                path = os.path.join(args.wd, args.file) if args.wd else args.file
+                data_future = pool.submit(read_transcripts, path, usecols = CLEAN_COLUMNS, categorical = getattr(args, "categorical", False))
+
+            ## CREATING REFERNECE LISTS ========================
+            # Use already loaded reference indexes (e.g., kept warm by resolverService), else the precompiled
+            # reference snapshot if it is fresh; otherwise rebuild them from the database and CSVs, and save
+            # them as the snapshot for the next runs
+            self.reference = reference
+            if self.reference is None and args.reference:
+                self.reference = load_snapshot(args.reference, max_age_days = args.reference_max_age)
+            if self.reference is None:
+                print("\nCreating reference lists for some fields")
+                self.reference = fetch_reference(args, pool = pool)
+                if args.reference:
+                    save_snapshot(self.reference, args.reference)
+
+            if data is None:
+                data = data_future.result()
         
-        self.data = data.fillna("")
+        self.data = fill_missing(data).reset_index(drop = True) # column by column; categoricals stay categorical
         self.data["filename"]
-        self.errorLog = defaultdict(list)
-        
-        ## CREATING REFERNECE LISTS ========================
-        print("\nCreating reference lists for some fields")
-        
-        conn = pymysql.connect(host = "gall.bnhm.berkeley.edu",
-                               user = args.username, # should be args.username
-                               passwd = args.password, # should be args.password
-                               db = "essig")
-
-        self.essig_collector     = pd.read_sql("select name_full, name_short, collector from eme_people where collector = 1", con = conn)
-        
-        #essig_canprov       = pd.read_sql("select * from canadian_provinces", con = conn)
-        #essig_country       = pd.read_sql("select * from country", con = conn)
-        #essig_mexstate      = pd.read_sql("select * from mexican_states", con = conn)
-        #essig_state         = pd.read_sql("select * from state", con = conn)
-        #essig_county        = pd.read_sql("select * from county", con = conn)
-        
-        self.essig_canprov = pd.read_csv(os.path.join(os.getcwd(), "reference", "essig_canprov.csv"))
-        self.essig_country = pd.read_csv(os.path.join(os.getcwd(), "reference", "essig_country.csv"), encoding = "latin-1")
-        self.essig_mexstate = pd.read_csv(os.path.join(os.getcwd(), "reference", "essig_mexstate.csv"), encoding = "latin-1")
-        self.essig_statecounty = pd.read_csv(os.path.join(os.getcwd(), "reference", "essig_statecounty.csv"))
-        self.essig_holdinginst   = pd.read_csv(os.path.join(os.getcwd(), "reference", "essig_inst.csv"))
+        self.errorLog = ErrorLog()
+        self.geo_threshold = getattr(args, "geo_threshold", None) # None: exact geography matches only
 
     def normalizeCollector(self):
         print("\nSplitting collector name strings ...")
@@ -68,22 +151,8 @@ class transcriptCleaner:
         # NORMALIZE COLLECTOR NAMES ========================    
         print("\nNormalizing collector names based on reference list")
 
-        # Build hash table of collectors
-        self.essig_collector = self.essig_collector.fillna("")
-        self.essig_collector['name_short'] = [col.strip("=") for col in list(self.essig_collector['name_short'])] # Remove the "=" characters in the essig database
-
-        essig_ref = dict()
-        for full_name, name_short in zip(self.essig_collector['name_full'], self.essig_collector['name_short']):
-            #full_name = full_name.encode("latin-1")
-            #name_short = name_short.encode("latin-1")
-            
-            if full_name != "":
-                essig_ref[re.sub('[\W_]+', '', full_name).lower()] = full_name # Remove spaces and non alphanumeric characters from reference list
-
-            if name_short != "":
-                temp = name_short.split(", ")
-                for sec_name in temp:                    
-                    essig_ref[re.sub('[\W_]+', '', sec_name).lower()] = full_name # Remove spaces and non alphanumeric characters from reference list
+        # Hash table of collectors
+        essig_ref = self.reference["collector"]
 
         # To deal with non-ascii characters
         essig_ref_keys = list(essig_ref.keys())
@@ -149,35 +218,22 @@ class transcriptCleaner:
         split_end_date["DayCollected2"] = [date.replace('00', '') for date in split_end_date["DayCollected2"]]
         split_end_date["YearCollected2"] = [date.replace('0000', '') for date in split_end_date["YearCollected2"]]
 
-        # Remove incomplete dates where day but not month was recovered
-        for i in range(len(split_begin_date)):
-            if split_begin_date["DayCollected"][i] != "" and split_begin_date["MonthCollected"][i] == "":
-                split_begin_date["DayCollected"][i] = ""
-                self.errorLog[self.data["bnhm_id"][i]].append("Incomplete collection begin date")
-
-            if split_begin_date["MonthCollected"][i] == "" and split_begin_date["DayCollected"][i] != "":
-                split_begin_date["DayCollected"][i] == ""
-                self.errorLog[self.data["bnhm_id"][i]].append("Incomplete collection begin date")
-
-        for i in range(len(split_end_date)):
-            if split_end_date["DayCollected2"][i] != "" and split_end_date["MonthCollected2"][i] == "":
-                split_end_date["DayCollected2"][i] = ""
-                self.errorLog[self.data["bnhm_id"][i]].append("Incomplete collection end date")
+        # Each check runs on whole columns and logs every row it fails with one call
+        bnhm_id = self.data["bnhm_id"].to_numpy()
+        dates = [(split_begin_date, "MonthCollected", "DayCollected", "begin"),
+                 (split_end_date, "MonthCollected2", "DayCollected2", "end")]
 
-            if split_end_date["MonthCollected2"][i] == "" and split_end_date["DayCollected2"][i] != "":
-                split_end_date["DayCollected2"][i] == ""
-                self.errorLog[self.data["bnhm_id"][i]].append("Incomplete collection end date")
+        # Remove incomplete dates where day but not month was recovered
+        for split_date, month, day, which in dates:
+            incomplete = ((split_date[day] != "") & (split_date[month] == "")).to_numpy()
+            split_date.loc[incomplete, day] = ""
+            self.errorLog.add(bnhm_id[incomplete], "normalizeDates", "incomplete_" + which + "_date")
 
         # Remove nonsensical dates as ambiguity
-        for i in range(len(split_begin_date)):
-            if split_begin_date["MonthCollected"][i] in ["02", "04", "06", "09", "11"] and split_begin_date["DayCollected"][i] == "31":
-                split_begin_date["DayCollected"][i] = ""
-                self.errorLog[self.data["bnhm_id"][i]].append("Nonsensical collection begin date")
-            
-        for i in range(len(split_end_date)):
-            if split_end_date["MonthCollected2"][i] in ["02", "04", "06", "09", "11"] and split_end_date["DayCollected2"][i] == "31":
-                split_end_date["DayCollected2"][i] = ""
-                self.errorLog[self.data["bnhm_id"][i]].append("Nonsensical collection end date")
+        for split_date, month, day, which in dates:
+            nonsensical = (split_date[month].isin(["02", "04", "06", "09", "11"]) & (split_date[day] == "31")).to_numpy()
+            split_date.loc[nonsensical, day] = ""
+            self.errorLog.add(bnhm_id[nonsensical], "normalizeDates", "nonsensical_" + which + "_date")
             
         self.begin_date = split_begin_date
         self.end_date = split_end_date
@@ -186,8 +242,7 @@ class transcriptCleaner:
         index = range(len(self.data))
 
         # Create dictionary of holding institutions
-        self.essig_holdinginst['Code'] = [abbrev[0:3] for abbrev in self.essig_holdinginst['Abbrev']]
-        essig_holdinginst_dict = self.essig_holdinginst.set_index('Code')['Name'].to_dict()
+        essig_holdinginst_dict = self.reference["holdinginst"]
         
         # Create empty dataframes to hold cleaned up entries
         taxa_metadata = pd.DataFrame(index = index,\
@@ -262,93 +317,36 @@ class transcriptCleaner:
         # Create an empty dataframe to hold cleaned up entries
         split_location = pd.DataFrame(index=index, columns=["Country", "StateProvince", "County", "ContinentOcean"])
 
+        # Names are matched hierarchically (country, then the states of that country, then the counties of that
+        # state), exactly unless a fuzzy threshold (-geo_threshold) was given; see geography_tools
+        matcher = GeographyMatcher(self.reference["geography"], threshold = self.geo_threshold)
+        cert = pd.DataFrame(index = index, columns = ["Country_cert", "StateProvince_cert", "County_cert"])
+
         # Ad-hoc spelling changes due to differences in Zoouniverse country list and Essig's country name standards
-        self.data['Country'] = [cty.replace('Afganistan','Afghanistan') for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace('United Arab Erimates','United Arab Emirates') for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace('Iran','Iran, Islamic Republic of') for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace("Cote DIvoire","Cote D'Ivoire") for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace("Curaco","Curacao") for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace("Korea Sout","Korea, Republic of") for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace("Korea South","Korea, Republic of") for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace("Korea North","Korea, Democratic People's Republic of") for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace("Nambia","Namibia") for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace("Philipines","Philippines") for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace("Uraguay","Uruguay") for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace('Iran','Iran, Islamic Republic of') for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace('Great Britain','United Kingdom') for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace('Trinidad & Tobago','Trinidad and Tobago') for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace('Vietnam','Viet Nam') for cty in self.data['Country']]
-        self.data['Country'] = [cty.replace('Antigua & Barbuda','Antigua and Barbuda') for cty in self.data['Country']]
-        self.data['Country'] = [re.sub('^US$|^U\\.S\\.$|^U\\.S\\.A\\.$|^USA$|United States of America|united states','United States', cty, flags = re.IGNORECASE) for cty in self.data['Country']]
-
-        # Normalizing country name
-        # Check if country is in reference database, if there isn't an exact match, assign an NA
+        # (applied to a local copy, so self.data is only read while the other stages run alongside).
+        # Lookups go through map_strings: once per distinct value when the column is categorical
         print("\nChecking if country entries are valid ...")
-        country_ref = list(self.essig_country['name'])
-        country_index = [country_ref.index(cty)
-                         if cty in country_ref else "NA"
-                         for cty in self.data['Country']]
+        country = map_strings(self.data['Country'], lambda cty: matcher.country(fix_country(cty)))
+        split_location["Country"] = [cty for cty, score in country]
+        cert["Country_cert"] = [score for cty, score in country]
 
         # Populate continent ocean based on country
         print("\nPopulating continent field ...")
-        continent_ref = list(self.essig_country['continent'])
-        split_location["Country"] = [country_ref[index]
-                                     if index is not "NA" else "NA"
-                                     for index in country_index]
-        split_location["ContinentOcean"] = [continent_ref[index]
-                                            if index is not "NA" else "NA"
-                                            for index in country_index]
-
-        # Normalize states/province
+        split_location["ContinentOcean"] = [matcher.continent(cty) for cty in split_location["Country"]]
+
+        # Normalize states/provinces of the United States, Canada and Mexico
         print("\nChecking if state and province entries are valid ...")
-        state_abb_ref = list(self.essig_statecounty["State.Abbrev"])
-        state_name_ref = list(self.essig_statecounty["State"])
-
-        state_index = [
-                    state_abb_ref.index(state) if state in state_abb_ref
-                    else state_name_ref.index(state) if state in state_name_ref
-                    else "NA"
-                    for state, cty in zip(self.data['State/Province'], split_location['Country']) if cty == "United States"]
-
-        split_location.loc[split_location['Country'] == "United States", 'StateProvince'] = [state_name_ref[index]
-                                                                                    if index is not "NA" else "NA" for index in state_index]
-
-        canada_ref = list(self.essig_canprov['name'])
-        canada_index = [
-                    canada_ref.index(province)
-                    if province in canada_ref
-                    else "NA"
-                    for province, cty in zip(self.data['State/Province'], split_location['Country']) if cty == "Canada"]
-
-        split_location.loc[split_location['Country'] == "Canada", 'StateProvince'] = [canada_ref[index]
-                                                                              if index is not "NA" else "NA" for index in canada_index]
-
-
-        mexico_ref = list(self.essig_mexstate['name'])
-        mexico_index = [
-                    mexico_ref.index(mexstate)
-                    if mexstate in mexico_ref
-                    else "NA"
-                    for mexstate, cty in zip(self.data['State/Province'], split_location['Country']) if cty == "Mexico"]
-
-        split_location.loc[split_location['Country'] == "Mexico", 'StateProvince'] = [mexico_ref[index]
-                                                                              if index is not "NA" else "NA" for index in mexico_index]           
+        state = [matcher.state(state, cty) for state, cty in zip(self.data['State/Province'], split_location["Country"])]
+        split_location["StateProvince"] = [state for state, score in state]
+        cert["StateProvince_cert"] = [score for state, score in state]
+
         # Normalize county
         print("\nChecking if county fields (only for the U.S.) are valid ...")
-        county_ref = list(self.essig_statecounty['County'])
-
-        county_index = [
-            
-                # Find the county in the state list
-                county_ref.index(county) if county in county_ref #list(essig_statecounty.loc[essig_statecounty["State"] == state, 'County'])
-                # essig_statecounty.loc[essig_statecounty["State"] == state, 'County'].index[list(essig_statecounty.loc[essig_statecounty["State"] == state, 'County']).index(county)]        
-                else "NA"
+        county = [matcher.county(county, state) if cty == "United States" else ("", "NA")
+                  for county, state, cty in zip(self.data['County'], split_location["StateProvince"], split_location["Country"])]
+        split_location["County"] = [county for county, score in county]
+        cert["County_cert"] = [score for county, score in county]
 
-                for county, state, cty in zip(self.data['County'], split_location['StateProvince'], split_location['Country']) if cty == "United States"]
-
-
-        split_location.loc[split_location['Country'] == "United States", 'County'] = [county_ref[index]
-                                                                                  if index is not "NA" else "NA" for index in county_index]
         # Append 'county', 'parish' and 'borough' to US counties
         split_location = split_location.fillna("")
         split_location["County"] = ["" if county == "NA" or county == ""
@@ -358,42 +356,89 @@ class transcriptCleaner:
                                     for county , state in zip(split_location["County"], split_location["StateProvince"])]
         
         self.geography = split_location
-
-def main():
-    ## PREAMBLE ========================
-    print("\n\n\n")
-    print("=" * 50)
-    print("PREPARING TRANSCRIPTS FOR RESOLUTION!!")
-    print("Written by Jun Ying Lim (junyinglim@gmail.com) \nfor the Essig Museum of Entomology at UC Berkeley")
-    print("=" * 50)
-    print("\n\n\n")
-    
-    ## CREATE TRANSCRIPTCLEANER INSTANCE ========================
-    args = parser.parse_args()
-    pipeline = transcriptCleaner(args)
-    
+        self.geography_cert = cert
+
+# Stages that only need the bnhm_id from prepMetadata: they read disjoint columns of pipeline.data and set
+# disjoint attributes, so they can run side by side. Stage -> (progress message, columns of pipeline.data and
+# reference indexes it reads, attributes it sets)
+CLEAN_STAGES = [("normalizeCollector", ("collector names", ["Collector"], ["collector"], ["clean_collector", "clean_collector_cert"])),
+                ("normalizeDates", ("dates", ["bnhm_id", "Begin Date Collected", "End Date Collected"], [], ["begin_date", "end_date"])),
+                ("normalizeGeography", ("geography fields", ["Country", "State/Province", "County"], ["geography"], ["geography", "geography_cert"]))]
+
+def stage_cleaner(pipeline, stage):
+    ''' A cleaner holding only the columns and reference indexes a stage reads, so a worker process is not
+        sent the whole data frame and every reference index for each stage '''
+    message, columns, references, outputs = dict(CLEAN_STAGES)[stage]
+    cleaner = transcriptCleaner.__new__(transcriptCleaner) # the data and indexes are already loaded
+    cleaner.data = pipeline.data[columns]
+    cleaner.reference = {name: pipeline.reference[name] for name in references}
+    cleaner.geo_threshold = pipeline.geo_threshold
+    cleaner.errorLog = ErrorLog() # only this stage's errors go back to the parent
+    return cleaner
+
+def run_stage(pipeline, stage):
+    ''' Runs one cleaning stage on a cleaner made by stage_cleaner (in a worker process)
+
+        Returns:
+        a tuple of the attributes the stage set (dictionary), the errors it logged and its wall time in seconds
+    '''
+    message, columns, references, outputs = dict(CLEAN_STAGES)[stage]
+    start = time.perf_counter()
+    getattr(pipeline, stage)()
+    return {name: getattr(pipeline, name) for name in outputs}, pipeline.errorLog, time.perf_counter() - start
+
+def clean_transcripts(pipeline, workers = 1):
+    ''' Runs every cleaning step of a transcriptCleaner and merges the results
+
+        Arguments:
+        pipeline    -- transcriptCleaner instance
+        workers     -- number of processes for the collector, date and geography stages, which run
+                       concurrently once prepMetadata is done; 1 runs them one after another
+
+        Returns:
+        a pandas.core.frame.Dataframe object without the rows of duplicated bnhm_ids;
+        errors (including the duplicates) are logged in pipeline.errorLog
+    '''
     ## CLEANUP ========================
     ## Prepare metadata
     # Metadata has to prepped first as the bnhm_id will be used to log errors in dates
     print("\nPreparing metadata fields in the resolved transcriptions ...")
-    pipeline.prepMetadata()
+    with metrics.stage("clean.prepMetadata"):
+        pipeline.prepMetadata()
+
+    ## Skip duplicates
+    # Every row of a bnhm_id that occurs more than once is logged and dropped here (bnhm_ids are hashed once),
+    # so the duplicates are not normalized only to be removed from the output
+    duplicated = pipeline.data["bnhm_id"].duplicated(keep = False).to_numpy()
+    pipeline.errorLog.add(pipeline.data["bnhm_id"].to_numpy()[duplicated], "duplicates", "duplicate")
+    metrics.incr("clean.duplicates", int(duplicated.sum()))
+    if duplicated.any():
+        pipeline.data = pipeline.data[~duplicated].reset_index(drop = True)
+        pipeline.metadata = pipeline.metadata[~duplicated].reset_index(drop = True)
     metadata = pipeline.metadata
 
-    ## Normalize collectors
-    print("\nNormalizing collector names in the resolved transcriptions ...")
-    pipeline.normalizeCollector()
+    ## Normalize collectors, dates and geography fields
+    if workers > 1:
+        # The stages are CPU-bound Python, so they run in processes rather than threads. Each stage logs
+        # errors into its own log; the logs are merged in stage order, giving the same error log as a sequential run
+        print("\nNormalizing collector names, dates and geography fields in", min(workers, len(CLEAN_STAGES)), "processes ...")
+        with ProcessPoolExecutor(max_workers = min(workers, len(CLEAN_STAGES))) as pool:
+            futures = [pool.submit(run_stage, stage_cleaner(pipeline, stage), stage) for stage, details in CLEAN_STAGES]
+            for (stage, details), future in zip(CLEAN_STAGES, futures):
+                outputs, errorLog, seconds = future.result()
+                for name, value in outputs.items():
+                    setattr(pipeline, name, value)
+                pipeline.errorLog.extend(errorLog)
+                metrics.add_time("clean." + stage, seconds)
+    else:
+        for stage, (message, columns, references, outputs) in CLEAN_STAGES:
+            print("\nNormalizing", message, "in the resolved transcriptions ...")
+            with metrics.stage("clean." + stage):
+                getattr(pipeline, stage)()
+
     collector = pipeline.clean_collector
-    
-    ## Normalize dates
-    print("\nNormalizing dates in the resolved transcriptions ...")
-    pipeline.normalizeDates()
-    
     begin_date = pipeline.begin_date
     end_date = pipeline.end_date
-    
-    ## Normalize geography fields
-    print("\nNormalizing geography fields in the resolved transcriptions ...")
-    pipeline.normalizeGeography()
     geography = pipeline.geography
 
     geography["Country"]        = [x.replace("NA", "") for x in geography["Country"]]
@@ -407,15 +452,33 @@ def main():
     allClean = pd.concat(cleanList, axis = 1)
     allClean.rename(columns={'subject_id':'TranscriptionSubjectIDs', "id":"TranscriptionIDs"}, inplace=True)
     allClean = allClean.fillna("") # remove all NAs
-    
-    # Identify duplicates and log them
-    duplicates = list(allClean["bnhm_id"][allClean.duplicated(keep = False)])
-    for x in duplicates:
-        pipeline.errorLog[x].append("Potential duplicate")
 
-    # Remove duplicate bnhm_id numbers
-    allClean = allClean.drop_duplicates('bnhm_id', keep = False)
+    return allClean
 
+def write_error_log(errorLog, path):
+    ''' Writes one "bnhm_id,error" line per logged error (ErrorLog), in one write '''
+    errorLog.frame()[["bnhm_id", "error"]].to_csv(path, header = False, index = False)
+
+def main():
+    ## PREAMBLE ========================
+    print("\n\n\n")
+    print("=" * 50)
+    print("PREPARING TRANSCRIPTS FOR RESOLUTION!!")
+    print("Written by Jun Ying Lim (junyinglim@gmail.com) \nfor the Essig Museum of Entomology at UC Berkeley")
+    print("=" * 50)
+    print("\n\n\n")
+    
+    ## CREATE TRANSCRIPTCLEANER INSTANCE ========================
+    args = parser.parse_args()
+    if args.build_reference:
+        print("\nBuilding reference snapshot", args.reference, "...")
+        save_snapshot(fetch_reference(args), args.reference)
+        return
+
+    with metrics.stage("clean.load"):
+        pipeline = transcriptCleaner(args)
+    
+    allClean = clean_transcripts(pipeline, workers = args.workers)
 
     ## EXPORTING RESULTS ========================
     print("\nExporting results to", args.wd, "...")
@@ -425,15 +488,19 @@ def main():
     else:
         outputfile = "clean_transcript"
 
-    allClean.to_csv(os.path.join(args.wd, outputfile + ".csv"), index = False)
+    with metrics.stage("clean.export"):
+        allClean.to_csv(os.path.join(args.wd, outputfile + ".csv"), index = False)
 
     ## PRINT OUT ERRORS ========================
     if(len(pipeline.errorLog) > 0):
         print("\nExporting potential errors \n")
-        with open(os.path.join(args.wd, 'error_transcript.csv'), 'w') as f:
-            for i in pipeline.errorLog:
-                for j in pipeline.errorLog[i]:
-                    f.write('{0},{1}\n'.format(i, j))
+        write_error_log(pipeline.errorLog, os.path.join(args.wd, 'error_transcript.csv'))
+
+    metrics.incr("clean.rows", len(allClean))
+    metrics.incr("clean.errors", len(pipeline.errorLog))
+    if args.metrics:
+        metrics.write(args.metrics)
+        print("\nMetrics written to", args.metrics)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="transcriptClean - Let's clean some transcripts!")
@@ -442,4 +509,12 @@ if __name__ == '__main__':
     parser.add_argument("-output", "-o", help = "Output file name")
     parser.add_argument("-username", help = "Username. Access to essig SQL database")
     parser.add_argument("-password", help = "Password. Access to essig SQL database")
+    parser.add_argument("-sqlite", help = "SQLite stand-in for the essig database (see db_tools.create_standin)")
+    parser.add_argument("-workers", type = int, default = 1, help = "Processes for the collector, date and geography stages (run concurrently when > 1)")
+    parser.add_argument("-categorical", action = "store_true", help = "Store low-cardinality columns (e.g. collection, Country, user_name) as categoricals to reduce memory")
+    parser.add_argument("-geo_threshold", type = float, help = "Accept fuzzy country, state and county matches at least this similar (0 to 1); exact matches only if not given")
+    parser.add_argument("-metrics", help = "Optional metrics output file (.json or .csv)")
+    parser.add_argument("-build_reference", action = "store_true", help = "Compile the reference snapshot from the essig database and reference CSVs, then exit")
+    parser.add_argument("-reference", default = SNAPSHOT_FILE, help = "Reference snapshot file")
+    parser.add_argument("-reference_max_age", type = float, default = 7, help = "Days after which the reference snapshot is rebuilt")
     main()
\ No newline at end of file
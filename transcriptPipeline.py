@@ -0,0 +1,94 @@
+import os
+import argparse #For command line arguments
+
+from io_tools import stage_columns
+from metrics_tools import metrics # stage timers and counters
+from transcriptPrepare import prepare_file, fetch_essig_ids
+from transcriptResolver import resolve_transcripts, reliability_file
+from reference_tools import SNAPSHOT_FILE
+from transcriptClean import transcriptCleaner, clean_transcripts, write_error_log
+
+## MAIN ##
+def main():
+    args = parser.parse_args()
+
+    ## Preamble ========================
+    print("\n\n\n")
+    print("=" * 50)
+    print("PREPARING, RESOLVING AND CLEANING TRANSCRIPTS!!")
+    print("=" * 50)
+    print("\n\n\n")
+
+    col_target = args.col_target.strip("[|]").split(",")
+    col_method = args.col_method.strip("[|]").split(",")
+    if len(col_target) != len(col_method):
+        raise Exception("-col_target and -col_method must have the same number of entries")
+
+    # Every stage only loads the columns it needs
+    columns = stage_columns(args.col_id, col_target, col_method)
+    missing = [col for col in columns["clean"] if col not in columns["resolve"]]
+    if len(missing) > 0:
+        raise Exception("The cleaning stage needs the following columns to be resolved: " + ", ".join(missing))
+
+    stem = args.stem + "_" if args.stem else ""
+
+    ## Prepare ========================
+    print("\nImporting transcription file", args.file, "...")
+    with metrics.stage("prepare"):
+        essigIDs = fetch_essig_ids(args.username, args.password, sqlite = args.sqlite)
+        prepared = prepare_file(os.path.join(args.wd, args.file), essigIDs, "filename", usecols = columns["prepare"],
+                                categorical = args.categorical)
+    if args.keep_intermediate:
+        prepared.to_csv(os.path.join(args.wd, stem + "prep_transcript.csv"), index = False)
+
+    ## Resolve ========================
+    with metrics.stage("resolve"):
+        resolved = resolve_transcripts(data = prepared[columns["resolve"]],
+                                       col_id = args.col_id,
+                                       col_target = col_target,
+                                       col_method = col_method,
+                                       wdir = args.wd,
+                                       reliability_file = os.path.join(args.wd, reliability_file(args, stem)),
+                                       refresh_reliability = args.refresh_reliability)
+    if args.keep_intermediate:
+        resolved.to_csv(os.path.join(args.wd, stem + "transcript.csv"), index = False)
+
+    ## Clean ========================
+    with metrics.stage("clean"):
+        pipeline = transcriptCleaner(args, data = resolved[columns["clean"]])
+        allClean = clean_transcripts(pipeline, workers = args.clean_workers)
+
+    outputfile = args.output if args.output else stem + "clean_transcript"
+    print("\nExporting results to", args.wd, "...")
+    allClean.to_csv(os.path.join(args.wd, outputfile + ".csv"), index = False)
+
+    if(len(pipeline.errorLog) > 0):
+        print("\nExporting potential errors \n")
+        write_error_log(pipeline.errorLog, os.path.join(args.wd, stem + 'error_transcript.csv'))
+
+    if args.metrics:
+        metrics.write(args.metrics)
+        print("\nMetrics written to", args.metrics)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="transcriptPipeline - prepare, resolve and clean transcripts in a single run")
+    parser.add_argument("-wd", default = ".", help = "Working directory")
+    parser.add_argument("-file", "-f", help = "Raw Notes from Nature export")
+    parser.add_argument("-stem", "-n", help = "'Stem' name for all output files.")
+    parser.add_argument("-output", "-o", help = "Output file name")
+    parser.add_argument("-col_id", default = "subject_id", help = "Column name specifying unique IDs")
+    parser.add_argument("-col_target", help = "Target column. Must be in the format -col_target [target1,target2,target3]")
+    parser.add_argument("-col_method", help = "Method. Must be in the format -col_method [method1,method2,method3]")
+    parser.add_argument("-reliability", help = "weighted_vote: volunteer reliability cache file (in the working directory); <stem>_volunteer_reliability.csv if not given")
+    parser.add_argument("-refresh_reliability", action = "store_true", help = "weighted_vote: recompute the volunteer reliability scores even if the cache file exists")
+    parser.add_argument("-username", help = "Username. Access to essig SQL database")
+    parser.add_argument("-password", help = "Password. Access to essig SQL database")
+    parser.add_argument("-sqlite", help = "SQLite stand-in for the essig database (see db_tools.create_standin)")
+    parser.add_argument("-reference", default = SNAPSHOT_FILE, help = "Reference snapshot file (see transcriptClean.py -build_reference)")
+    parser.add_argument("-reference_max_age", type = float, default = 7, help = "Days after which the reference snapshot is rebuilt")
+    parser.add_argument("-clean_workers", type = int, default = 1, help = "Processes for the collector, date and geography cleaning stages")
+    parser.add_argument("-geo_threshold", type = float, help = "Accept fuzzy country, state and county matches at least this similar (0 to 1); exact matches only if not given")
+    parser.add_argument("-keep_intermediate", action = "store_true", help = "Also write the prepared and resolved transcriptions")
+    parser.add_argument("-categorical", action = "store_true", help = "Store low-cardinality columns (e.g. collection, Country, user_name) as categoricals to reduce memory")
+    parser.add_argument("-metrics", help = "Optional metrics output file (.json or .csv)")
+    main()
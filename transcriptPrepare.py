@@ -5,25 +5,25 @@ import numpy as np
 import re # regular expressions
 import argparse #For command line arguments
 import pandas as pd # data frame functionality
-import pymysql
+from io_tools import iter_transcripts, concat_transcripts, ENCODING, CHUNK_ROWS
+from db_tools import query # pooled essig database connections
 
-## MAIN ##
-def main():
-    args = parser.parse_args()
-    
-    ## Preamble ========================
-    print("\n\n\n")
-    print("=" * 50)
-    print("PREPARING TRANSCRIPTS FOR RESOLUTION!!")
-    
-    ## Import transcription file ========================
-    print("\nImporting transcription file ", args.file, " ...")
-    data = pd.read_csv(os.path.join(args.wd, args.file), encoding = "ISO-8859-1", dtype = "object")
-    data = data.fillna("")
+def fetch_essig_ids(username, password, sqlite = None):
+    ''' Returns the list of bnhm_ids already databased in the essig database (or the SQLite stand-in) '''
+    essigIDs = query('select bnhm_id from eme;', username, password, sqlite = sqlite)
+    return list(essigIDs["bnhm_id"])
 
-    ## Prepping transcription file ========================
-    print("\nPrepping transcription file...")
+def prepare_transcripts(data, essigIDs, col_id):
+    ''' Prepares raw Notes from Nature transcriptions for resolution
+
+        Arguments:
+        data        -- pandas.core.frame.Dataframe object, raw transcriptions as strings
+        essigIDs    -- list of bnhm_ids that are already databased
+        col_id      -- string, column used to identify specimens (e.g., filename)
 
+        Returns:
+        a pandas.core.frame.Dataframe object
+    '''
     # Exclude non-calbug entries
     print("\nExcluding non-Calbug transcriptions ...")
     data = data[data["collection"] == "Calbug"] 
@@ -31,21 +31,12 @@ def main():
     # Convert Collector names to lower case to facilitate alignments
     data["Collector"] = [collector.lower() for collector in data["Collector"]]
     
-    # Connect to essig database
-    conn = pymysql.connect(host = "gall.bnhm.berkeley.edu",\
-                           user = args.username, # should be args.username
-                           passwd = args.password, # should be args.password
-                           db = "essig")
-    essigIDs = pd.read_sql('select bnhm_id from eme;', con=conn)
-    essigIDs = list(essigIDs["bnhm_id"])
-    
-    
     # exclude specimens that are already in the database
     ##comment## are all the nfn entries meant for calbug, this stage might basically exclude all the non-essig transcirptions
     ##comment## assumes that a specimen ID does not have multiple filenames
     
     print("\nExcluding specimens that have already been databased ...")
-    unique_filename = list(set(data[args.col_id])) # create a dictionary of bnhm_id and filename
+    unique_filename = list(set(data[col_id])) # create a dictionary of bnhm_id and filename
     id_dict = dict()
 
     for f in unique_filename:
@@ -57,19 +48,74 @@ def main():
     completed_ids = list(unique_ids.intersection(essigIDs))
 
     completed_filenames = [id_dict[f] for f in completed_ids]
-    completed_filenames
 
     # exclude filenames whose bnhm_id is already in the essig database
-    data = data[~data["filename"].isin(completed_filenames)] # ~ means the inverse; so filenames that have not been completed
+    return data[~data["filename"].isin(completed_filenames)] # ~ means the inverse; so filenames that have not been completed
+
+def prepare_file(path, essigIDs, col_id, output = None, usecols = None, categorical = False, chunksize = CHUNK_ROWS):
+    ''' Prepares a raw export chunk by chunk (see prepare_transcripts), so only the kept rows and
+        columns are ever held in memory
+
+        Arguments:
+        path        -- raw Notes from Nature export
+        essigIDs    -- list of bnhm_ids that are already databased
+        col_id      -- string, column used to identify specimens (e.g., filename)
+        output      -- optional csv file; the prepared chunks are appended to it as they are done
+        usecols     -- optional list of columns to keep (all columns if None)
+        categorical -- store the low-cardinality columns as categoricals (see io_tools.read_transcripts)
+        chunksize   -- rows read at a time
+
+        Returns:
+        a pandas.core.frame.Dataframe object of the prepared rows, or the number of rows written if output is given
+    '''
+    if output is not None and os.path.exists(output):
+        os.remove(output)
+
+    kept = []
+    rows = 0
+    for chunk in iter_transcripts(path, usecols = usecols, categorical = categorical, chunksize = chunksize):
+        chunk = prepare_transcripts(chunk, essigIDs, col_id)
+        rows += len(chunk)
+        if output is not None:
+            chunk.to_csv(output, mode = "a", header = not os.path.exists(output), index = False)
+        else:
+            kept.append(chunk)
+
+    if output is not None:
+        return rows
+    if len(kept) == 0:
+        # No rows were read: an empty frame with the columns of the file
+        return pd.read_csv(path, encoding = ENCODING, dtype = str, usecols = usecols, nrows = 0)
+    return concat_transcripts(kept) # categories as if the file was read at once, whatever the chunk size
+
+## MAIN ##
+def main():
+    args = parser.parse_args()
     
-    ## Export the new data file ========================
+    ## Preamble ========================
+    print("\n\n\n")
+    print("=" * 50)
+    print("PREPARING TRANSCRIPTS FOR RESOLUTION!!")
+    
+    ## Export file ========================
     if args.output:
         outputfile = args.output
     else:
         outputfile = "prep_transcript"
-    
-    print("\nExporting prepared transcriptions to", os.getcwd())
-    data.to_csv(os.path.join(args.wd, outputfile + ".csv"), index = False)
+
+    # Connect to essig database
+    essigIDs = fetch_essig_ids(args.username, args.password, sqlite = args.sqlite)
+
+    ## Prepping transcription file ========================
+    # The export is streamed in chunks: rows of other collections and unused columns are dropped as they
+    # are read, and prepared rows are written out as each chunk is done
+    print("\nImporting and prepping transcription file ", args.file, " ...")
+    usecols = args.columns.strip("[|]").split(",") if args.columns else None
+    rows = prepare_file(os.path.join(args.wd, args.file), essigIDs, args.col_id,
+                        output = os.path.join(args.wd, outputfile + ".csv"), usecols = usecols,
+                        categorical = args.categorical, chunksize = args.chunksize)
+
+    print("\nExported", rows, "prepared transcriptions to", os.path.join(args.wd, outputfile + ".csv"))
     
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="transcriptPrepare - Let's prepare some crowd-sourced transcripts!")
@@ -79,6 +125,10 @@ if __name__ == '__main__':
     parser.add_argument("-col_id", help = "List of columns to be checked")
     parser.add_argument("-username", help = "Username. Access to essig SQL database")
     parser.add_argument("-password", help = "Password. Access to essig SQL database")
+    parser.add_argument("-sqlite", help = "SQLite stand-in for the essig database (see db_tools.create_standin)")
+    parser.add_argument("-categorical", action = "store_true", help = "Store low-cardinality columns (e.g. collection, Country, user_name) as categoricals to reduce memory")
+    parser.add_argument("-columns", help = "Only keep these columns. Must be in the format -columns [col1,col2,col3] and include collection, filename and Collector")
+    parser.add_argument("-chunksize", type = int, default = CHUNK_ROWS, help = "Rows read at a time")
     main()
     
 ##todo## logging the results
\ No newline at end of file
@@ -1,20 +1,47 @@
 
-import csv
 import os
-import itertools as it
-import numpy as np
-import re # regular expressions
+import time
 import argparse #For command line arguments
+import importlib # lazy loading of resolver methods
+from concurrent.futures import ThreadPoolExecutor, as_completed # column-parallel resolution
 
-from consensus_tools import * # custom functions to run transcript resolving
-from collections import defaultdict # utility functions to create dictionaries
+from metrics_tools import metrics, Progress # stage timers and counters
+from io_tools import read_transcripts, expand_files, read_transcript_files, VOTER_COLUMN
+from file_cache_tools import FileCache # parsed input files, reused while unchanged
+from checkpoint_tools import Checkpoint # resumable consensus runs
+from shard_tools import parse_shard, shard_stem, write_shards, merge_shards # multi-node runs
 import pandas as pd # data frame functionality
-from fuzzywuzzy import process, fuzz # Functions that are useful for fuzzy string matching (https://github.com/seatgeek/fuzzywuzzy)
 from functools import reduce # for the reduce function
 
-import webbrowser
 import copy
 
+# Resolver methods: name -> (module, function, fixed keyword arguments, run options the function accepts)
+# A method's module (and its heavy dependencies, e.g. Biopython for character alignment) is only imported
+# the first time the method is used
+RESOLVER_METHODS = {
+    "vote_count":       ("consensus_tools", "vote_count", {}, ["verbose"]),
+    "consensus":        ("consensus_tools", "variant_consensus", {"align_method": "character", "consensus_method": "dumber"}, ["wdir", "workers", "mafft_timeout", "mafft_retries", "align_strategy", "align_thresholds", "checkpoint", "cache", "outlier_threshold", "verbose"]),
+    "consensus_token":  ("consensus_tools", "variant_consensus", {"align_method": "token", "consensus_method": "dumber"}, ["wdir", "checkpoint", "cache", "outlier_threshold", "verbose"]),
+    "consensus_centerstar": ("consensus_tools", "variant_consensus", {"align_method": "character", "consensus_method": "dumber", "align_strategy": "centerstar"}, ["wdir", "checkpoint", "cache", "outlier_threshold", "verbose"]),
+    "metadata":         ("consensus_tools", "metadata_handling", {}, []),
+    "weighted_vote":    ("reliability_tools", "weighted_vote", {}, ["reliability", "verbose"]),
+    "consensus_poa":    ("poa_tools", "poa_consensus", {}, ["poa_graphs", "verbose"]),
+}
+
+# -parallel_columns: accession chunks per worker and column, so a column's work can be spread over the pool
+CHUNKS_PER_WORKER = 2
+
+_loaded_methods = dict()
+
+def get_method(method):
+    ''' Returns the function implementing a resolver method, importing its module on first use '''
+    if method not in RESOLVER_METHODS:
+        raise Exception("Method '" + method + "' is not valid. Must be one of: " + ", ".join(RESOLVER_METHODS))
+    if method not in _loaded_methods:
+        module, function, fixed, options = RESOLVER_METHODS[method]
+        _loaded_methods[method] = getattr(importlib.import_module(module), function)
+    return _loaded_methods[method]
+
 class transcriptResolver:
     def __init__(self, args): # __init__ always run when an instance of the class is created
 
@@ -27,6 +54,7 @@ class transcriptResolver:
             self.stem = input("Stem name: ")
 
         self.stem = self.stem + "_"
+        self.export_stem = self.stem # a shard's outputs get their own stem below, but share some with the export
 
         print("\nStem name for all outputs will be '" + self.stem + "'")
         
@@ -40,13 +68,19 @@ class transcriptResolver:
         print("\nUsing working directory '" + self.wd + "' ...")
 
         ## Define transcription file ========================
-        if args.file:
+        if getattr(args, "shard", None):
+            # One shard of an export split with -mode shard; all its outputs get the shard's stem
+            index, count = parse_shard(args.shard)
+            self.stem = shard_stem(self.stem, index, count)
+            tempfile = self.stem + "input.csv"
+        elif args.file:
             tempfile = args.file
         else:
             tempfile = input("\nInput your working file name. \nWorking file should be in your stated working directory:")
         
-        filedir = os.path.join(self.wd, tempfile)
-        print("\nFile directory will be '" + filedir + "'")
+        # -file may also be a glob pattern or a list of files (e.g. weekly exports), which are read together
+        filedirs = expand_files(tempfile, self.wd)
+        [print("\nFile directory will be '" + filedir + "'") for filedir in filedirs]
 
         
         ## Define id column ========================
@@ -89,19 +123,208 @@ class transcriptResolver:
         ## Import file ========================
         allcols = copy.copy(self.col_target) # make a copy so we don't alter self.col_target
         allcols.append(self.col_id)
+        if "weighted_vote" in self.col_method:
+            allcols.append(VOTER_COLUMN) # volunteer reliability needs who transcribed each row
         
-        self.file = pd.read_csv(filedir, dtype=object,\
-                                encoding = "ISO-8859-1",
-                                usecols = allcols) # only use columns that were supplied
-        self.file = self.file.fillna("") # Converts all NaNs into empty strings for alignment
+        # only use columns that were supplied; NaNs become empty strings for alignment
+        self.file = read_input(filedirs, allcols, getattr(args, "categorical", False), os.path.join(self.wd, self.stem + "file_cache"))
         
         
+def read_input(paths, usecols, categorical, cache_dir):
+    ''' Reads the input file, or several files merged into one export. Files are read concurrently, and a file
+        whose content has not changed since the last run with the same stem is loaded from cache_dir instead
+        of being parsed '''
+    if len(paths) == 1:
+        return read_transcripts(paths[0], usecols = usecols, categorical = categorical)
+    data = read_transcript_files(paths, usecols = usecols, categorical = categorical, cache = FileCache(cache_dir))
+    print("\nRead", len(data), "transcriptions from", len(paths), "files")
+    return data
+
+def resolve_field(method, accession, field, data, wdir, **options):
+    ''' Resolves a single target field using the named method
+
+        Arguments:
+        method      -- string, a key of RESOLVER_METHODS
+        accession   -- string, unique ID column
+        field       -- string, target column
+        data        -- pandas.core.frame.Dataframe object, or consensus_tools.VariantGroups
+        wdir        -- working directory for temporary alignment files
+        options     -- further run options, passed on to methods that accept them
+
+        Returns:
+        a pandas.core.frame.Dataframe object with the accession and field columns
+    '''
+    func = get_method(method)
+    module, function, fixed, accepted = RESOLVER_METHODS[method]
+    options["wdir"] = wdir
+
+    kwargs = dict(fixed)
+    kwargs.update({name: options[name] for name in accepted if name in options})
+    return func(accession = accession, field = field, data = data, **kwargs)
+
+def resolve_columns(groups, col_id, col_target, col_method, wdir, workers = 1, executor = None, **options):
+    ''' Resolves the target columns concurrently on one pool of `workers` threads, or on executor (e.g. the
+        long-lived pool of resolverService) if given
+
+        Every column is split into the same accession chunks, and the jobs are queued chunk by chunk (the first
+        chunk of every column, then the second, ...), so cheap columns finish early and an expensive one is
+        spread over the whole pool. Each job runs a single MAFFT process; the pool is the run's whole
+        alignment budget. A column's chunk results are concatenated in order, as a sequential run returns them
+
+        Returns:
+        a tuple of 2 lists - one data frame per column, and the seconds spent on each column (summed over chunks)
+    '''
+    chunks = groups.split(CHUNKS_PER_WORKER * workers)
+    options["workers"] = 1
+    options["verbose"] = False # progress lines of concurrent jobs would overwrite each other; drawn below
+    print("\nResolving", len(col_target), "columns in", len(chunks), "accession chunks on", workers, "threads")
+
+    def job(field, method, chunk):
+        start = time.perf_counter()
+        df = resolve_field(method = method, accession = col_id, field = field, data = chunk, wdir = wdir, **options)
+        return df, time.perf_counter() - start
+
+    pool = executor if executor is not None else ThreadPoolExecutor(max_workers = workers)
+    futures = [[None] * len(chunks) for field in col_target]
+    try:
+        for i, chunk in enumerate(chunks):
+            for c, (field, method) in enumerate(zip(col_target, col_method)):
+                futures[c][i] = pool.submit(job, field, method, chunk)
+        # One progress line, drawn from this thread as the jobs complete
+        progress = Progress(len(groups) * len(col_target), "Reconciling " + ", ".join(col_target))
+        sizes = {future: len(chunk) for column in futures for future, chunk in zip(column, chunks)}
+        for future in as_completed(sizes):
+            future.result()
+            progress.update(sizes[future])
+        progress.close()
+        done = [[future.result() for future in column] for column in futures]
+    except BaseException:
+        # Do not start the queued jobs of a failed run; a shared executor stays usable
+        [future.cancel() for column in futures for future in column if future is not None]
+        raise
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+    results = [pd.concat([df for df, t in column], ignore_index = True) for column in done]
+    seconds = [sum(t for df, t in column) for column in done]
+    return results, seconds
+
+def resolve_transcripts(data, col_id, col_target, col_method, wdir, **options):
+    ''' Resolves every target field and merges the results into a single data frame
+
+        Arguments:
+        data        -- pandas.core.frame.Dataframe object with the id and target columns
+        col_id      -- string, unique ID column
+        col_target  -- list of columns to be resolved
+        col_method  -- list of methods, one per target column
+        wdir        -- working directory for temporary alignment files
+        options     -- further run options, passed on to methods that accept them. With parallel_columns
+                       and workers > 1, the columns are resolved concurrently (see resolve_columns)
+
+        Returns:
+        a pandas.core.frame.Dataframe object, one row per unique ID
+    '''
+    # Check methods before any (potentially long) resolution starts
+    invalid = [method for method in col_method if method not in RESOLVER_METHODS]
+    if len(invalid) > 0:
+        raise Exception("Methods not valid: " + ", ".join(invalid) + ". Must be one of: " + ", ".join(RESOLVER_METHODS))
+
+    # Volunteer reliability is scored once, over every weighted_vote column, and cached for later runs
+    vote_fields = [field for field, method in zip(col_target, col_method) if method == "weighted_vote"]
+    if len(vote_fields) > 0 and options.get("reliability") is None:
+        from reliability_tools import load_reliability
+        with metrics.stage("resolve.reliability"):
+            options["reliability"] = load_reliability(data, col_id, vote_fields, path = options.get("reliability_file"),
+                                                      refresh = options.get("refresh_reliability", False),
+                                                      check = options.get("check_reliability", True))
+
+    # Partial order alignment graphs of earlier runs; new transcriptions are aligned into them
+    poa_file = options.get("poa_file")
+    if "consensus_poa" in col_method and options.get("poa_graphs") is None:
+        from poa_tools import load_graphs
+        options["poa_graphs"] = load_graphs(poa_file)
+
+    # Sort the rows by accession once; every method then works on slices of the sorted columns
+    from consensus_tools import VariantGroups
+    with metrics.stage("resolve.group"):
+        groups = VariantGroups(data, col_id)
+
+    parallel = options.get("parallel_columns") and options.get("workers", 1) > 1
+    if parallel:
+        results, seconds = resolve_columns(groups, col_id, col_target, col_method, wdir, **options)
+    else:
+        results = []
+        seconds = []
+        for field, method in zip(col_target, col_method):
+            start = time.perf_counter()
+            results.append(resolve_field(method = method,\
+                                         accession = col_id,\
+                                         field = field,\
+                                         data = groups,\
+                                         wdir = wdir,\
+                                         **options))
+            seconds.append(time.perf_counter() - start)
+
+    print("\nResolution time per column" + (" (summed over its chunks):" if parallel else ":"))
+    for field, method, t in zip(col_target, col_method, seconds):
+        metrics.add_time("resolve." + method + "." + field, t)
+        print("  %s (%s): %.1f s" % (field, method, t))
+        
+    if "consensus_poa" in col_method and poa_file is not None:
+        from poa_tools import save_graphs
+        with metrics.stage("resolve.poa_save"):
+            save_graphs(options["poa_graphs"], poa_file)
+        
+    # Merge results
+    with metrics.stage("resolve.merge"):
+        return reduce(lambda a, d: pd.merge(a, d, on = col_id), results)
+
+def reliability_file(args, stem):
+    ''' -reliability, or the volunteer reliability cache of the export (shared by all its shards) '''
+    return args.reliability if args.reliability else stem + "volunteer_reliability.csv"
+
+def shard_export(args):
+    ''' -mode shard: splits the export into -shards files by accession, to be resolved with -shard i/N '''
+    for name in ["stem", "wd", "file", "col_id", "shards"]:
+        if getattr(args, name) is None:
+            raise Exception("-mode shard needs -" + name)
+    stem = args.stem + "_"
+
+    data = read_input(expand_files(args.file, args.wd), None, args.categorical, os.path.join(args.wd, stem + "file_cache"))
+    paths = write_shards(data, args.col_id, args.shards, args.wd, stem)
+    print("\nSplit", len(data), "transcriptions into", args.shards, "shards:")
+    [print(path) for path in paths]
+
+    # Volunteer reliability has to be scored over the whole export, not shard by shard
+    if args.col_target and args.col_method:
+        col_target = args.col_target.strip("[|]").split(",")
+        col_method = args.col_method.strip("[|]").split(",")
+        vote_fields = [field for field, method in zip(col_target, col_method) if method == "weighted_vote"]
+        if len(vote_fields) > 0:
+            from reliability_tools import load_reliability
+            load_reliability(data, args.col_id, vote_fields, path = os.path.join(args.wd, reliability_file(args, stem)),
+                             refresh = args.refresh_reliability)
+
+def merge_export(args):
+    ''' -mode merge: combines the resolved shards into <stem>transcript.csv, in the order of a single-node run '''
+    for name in ["stem", "wd", "shards"]:
+        if getattr(args, name) is None:
+            raise Exception("-mode merge needs -" + name)
+    stem = args.stem + "_"
+
+    allResults = merge_shards(args.wd, stem, args.shards)
+    finalDir = os.path.join(args.wd, stem + "transcript.csv")
+    allResults.to_csv(finalDir, index = False)
+    print("\nExporting results of", args.shards, "shards to", finalDir)
+
 ## MAIN ##
 def main():
     args = parser.parse_args()
     if args.version:
         print("v1.0")
     elif args.manual:
+        import webbrowser
         webbrowser.open("https://github.com/junyinglim/TranscriptResolver")
     else:
         print("\n\n\n")
@@ -112,41 +335,60 @@ def main():
         print("This crude program was written by Jun Ying Lim (junyinglim@gmail.com) \nfor the Essig Museum of Entomology at UC Berkeley")
         print("=" * 50)
         print("\n\n\n")
+
+    if args.mode == "shard":
+        shard_export(args)
+        return
+    if args.mode == "merge":
+        merge_export(args)
+        return
                
     ## Startup
-    currentArgs = transcriptResolver(args)
-    
-    # Create empty list
-    results = []
-    for col_no in range(len(currentArgs.col_target)):
-        if currentArgs.col_method[col_no] == "vote_count":
-            df = vote_count(accession = currentArgs.col_id,\
-                            field = currentArgs.col_target[col_no],\
-                            data = currentArgs.file)
-        elif currentArgs.col_method[col_no] == "consensus":
-            df = variant_consensus(accession = currentArgs.col_id,\
-                                   field = currentArgs.col_target[col_no],\
-                                   align_method = "character",\
-                                   consensus_method = "dumber",\
-                                   wdir = currentArgs.wd,\
-                                   data = currentArgs.file)
-        elif currentArgs.col_method[col_no] == "metadata":
-            df = metadata_handling(accession = currentArgs.col_id,\
-                                   field = currentArgs.col_target[col_no],\
-                                   data = currentArgs.file)
-        else:
-            ##todo## write a proper error handling here
-            print("Sorry, method supplied is not valid")
-        
-        # Add data frame to the results list
-        results.append(df)
-        
-    # Merge results
-    allResults = reduce(lambda a, d: pd.merge(a, d, on = currentArgs.col_id), results)
+    with metrics.stage("resolve.load"):
+        currentArgs = transcriptResolver(args)
+
+    reliabilityDir = os.path.join(currentArgs.wd, reliability_file(args, currentArgs.export_stem))
+    if args.shard and "weighted_vote" in currentArgs.col_method and not os.path.exists(reliabilityDir):
+        raise Exception("weighted_vote on a shard needs the volunteer reliability scores of the whole export (" + reliabilityDir + "); they are written by -mode shard")
+
+    # Aligned accessions are checkpointed as they complete, so a crashed run can be resumed with -resume
+    checkpointDir = os.path.join(currentArgs.wd, currentArgs.stem + "checkpoint.jsonl")
+    checkpoint = Checkpoint(checkpointDir, resume = args.resume, interval = args.checkpoint_interval)
+    if args.resume:
+        print("\nResuming from", checkpointDir, "-", sum(len(v) for v in checkpoint.results.values()), "accessions already resolved")
+
+    try:
+        allResults = resolve_transcripts(data = currentArgs.file,\
+                                         col_id = currentArgs.col_id,\
+                                         col_target = currentArgs.col_target,\
+                                         col_method = currentArgs.col_method,\
+                                         wdir = currentArgs.wd,\
+                                         workers = args.workers,\
+                                         mafft_timeout = args.mafft_timeout,\
+                                         mafft_retries = args.mafft_retries,\
+                                         align_strategy = args.align_strategy,\
+                                         align_thresholds = {"centerstar_max_variants": args.centerstar_max_variants,
+                                                             "fast_max_divergence": args.fast_max_divergence},\
+                                         checkpoint = checkpoint,\
+                                         outlier_threshold = args.outlier_threshold,\
+                                         reliability_file = reliabilityDir,\
+                                         poa_file = os.path.join(currentArgs.wd, currentArgs.stem + "poa_graphs.json"),\
+                                         refresh_reliability = args.refresh_reliability and not args.shard,\
+                                         check_reliability = not args.shard,\
+                                         parallel_columns = args.parallel_columns)
+    except BaseException:
+        checkpoint.flush() # keep everything resolved so far for -resume
+        raise
             
     finalDir = os.path.join(currentArgs.wd, currentArgs.stem + "transcript.csv")
-    allResults.to_csv(finalDir, index = False)
+    with metrics.stage("resolve.export"):
+        allResults.to_csv(finalDir, index = False)
     print("\nExporting results to", finalDir)
+    checkpoint.close(remove = True) # the run finished, nothing left to resume
+
+    if args.metrics:
+        metrics.write(args.metrics)
+        print("\nMetrics written to", args.metrics)
     
 
 if __name__ == '__main__':
@@ -155,10 +397,27 @@ if __name__ == '__main__':
     parser.add_argument("--manual", action="store_true", help="(Attempt to) open browser and show help")
     parser.add_argument("-stem", "-n", help="'Stem' name for all output files.") # for command line
     parser.add_argument("-wd", help = "Working directory")
-    parser.add_argument("-file", "-f", help = "File with transcriptions")
+    parser.add_argument("-file", "-f", help = "File with transcriptions, a glob pattern (e.g. 'export_*.csv') or several files in the format [file1,file2]; several files are resolved as one export")
     parser.add_argument("-col_id", help = "List of columns to be resolved")
     parser.add_argument("-col_target", help = "Target column. Must be in the format -col_target [target1,target2,target3]")
     parser.add_argument("-col_method", help = "Method. Must be in the format -col_method [method1,method2,method3]")
+    parser.add_argument("-workers", type = int, default = 1, help = "Number of concurrent MAFFT alignments")
+    parser.add_argument("-parallel_columns", action = "store_true", help = "Resolve the target columns concurrently, in accession chunks on a shared pool of -workers threads (one MAFFT alignment per thread)")
+    parser.add_argument("-mafft_timeout", type = float, help = "Seconds before a MAFFT alignment is killed")
+    parser.add_argument("-mafft_retries", type = int, default = 1, help = "Retries for a failed MAFFT alignment")
+    parser.add_argument("-align_strategy", default = "linsi", choices = ["auto", "centerstar", "fftns2", "linsi"], help = "Character alignment strategy for the consensus method")
+    parser.add_argument("-centerstar_max_variants", type = int, default = 3, help = "auto strategy: align up to this many variants with the built-in center-star aligner")
+    parser.add_argument("-fast_max_divergence", type = float, default = 0.2, help = "auto strategy: use FFT-NS-2 when variants differ by at most this fraction, otherwise L-INS-i")
+    parser.add_argument("-outlier_threshold", type = float, help = "Drop variants whose MinHash similarity to the other replicates is below this (e.g. 0.2) before alignment; dropped variants are listed in <field>_dropped")
+    parser.add_argument("-reliability", help = "weighted_vote: volunteer reliability cache file (in the working directory); <stem>_volunteer_reliability.csv if not given")
+    parser.add_argument("-refresh_reliability", action = "store_true", help = "weighted_vote: recompute the volunteer reliability scores even if the cache file exists")
+    parser.add_argument("-resume", action = "store_true", help = "Skip accessions already resolved in the checkpoint of an interrupted run with the same stem")
+    parser.add_argument("-checkpoint_interval", type = float, default = 30, help = "Seconds between checkpoint writes")
+    parser.add_argument("-categorical", action = "store_true", help = "Store low-cardinality columns (e.g. collection, Country, user_name) as categoricals to reduce memory")
+    parser.add_argument("-mode", default = "run", choices = ["run", "shard", "merge"], help = "run: resolve the file (or one shard of it, see -shard); shard: split the file into -shards files by accession; merge: combine the resolved shards into <stem>transcript.csv")
+    parser.add_argument("-shards", type = int, help = "shard and merge modes: number of shards")
+    parser.add_argument("-shard", help = "run mode: resolve only shard i of N (in the format i/N) written by -mode shard")
+    parser.add_argument("-metrics", help = "Optional metrics output file (.json or .csv)")
     main()
     
 ##todo## logging the results
\ No newline at end of file